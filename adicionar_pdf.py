@@ -2,16 +2,32 @@
 """
 Adicionar PDF ao Knowledge Base
 Sistema único e simples com metadados otimizados + Metadata Enrichment
+
+Uso:
+    python adicionar_pdf.py arquivo.pdf
+    python adicionar_pdf.py content/ --workers 4        (ingestão em lote)
+    python adicionar_pdf.py "content/*.pdf" --workers 4  (ingestão em lote)
+    python adicionar_pdf.py arquivo.pdf --incremental    (reaproveita chunks inalterados)
+    python adicionar_pdf.py arquivo.pdf --resume         (retoma execução interrompida)
 """
 
 import os
 import sys
 from dotenv import load_dotenv
 import time
-from document_manager import generate_pdf_id, check_duplicate
+import json
+import uuid
+from document_manager import generate_pdf_id, check_duplicate, find_document_by_filename
+from llm_cache import get_llm_cache, input_hash
+from ingestion_checkpoint import get_checkpoint
+from rate_limiter import get_rate_limiter, estimate_tokens, is_rate_limit_error, retry_after_seconds
+from image_index import content_hash, get_image_index
+from blob_store import put_base64, externalize_element_images, collect_garbage, is_blob_ref
+from image_transcode import convert_image_cached, transcode_images, reset_transcode_memo, set_transcode_workers
+from vision_input import optimize_for_vision, reset_vision_stats, vision_stats, VISION_TABLE_MAX_TILES
 from PIL import Image
 import io
-from base64 import b64decode, b64encode
+from base64 import b64decode
 
 load_dotenv()
 
@@ -20,6 +36,60 @@ load_dotenv()
 # ===========================================================================
 MIN_IMAGE_SIZE_KB = float(os.getenv("MIN_IMAGE_SIZE_KB", "30"))
 
+# Ingestão em lote: número de PDFs processados em paralelo (1 processo por PDF)
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+
+# Escrita no knowledge base: chunks por lote (embeddings + Chroma + docstore)
+WRITE_BATCH_SIZE = int(os.getenv("WRITE_BATCH_SIZE", "100"))
+
+# Reprocessamento incremental: reaproveita chunks inalterados da versão anterior
+# em vez de deletar tudo e re-embedar (ativável também com --incremental)
+INCREMENTAL_REINGEST = os.getenv("INCREMENTAL_REINGEST", "false").lower() == "true"
+
+# Checkpoints por etapa em PERSIST_DIR/checkpoints/<pdf_id> (removidos após sucesso)
+INGEST_CHECKPOINTS = os.getenv("INGEST_CHECKPOINTS", "true").lower() == "true"
+# Retomar da primeira etapa incompleta de uma execução interrompida (também: --resume)
+INGEST_RESUME = os.getenv("INGEST_RESUME", "false").lower() == "true"
+
+# Versões dos prompts da ingestão (parte da chave do cache LLM)
+# ⚠️ Incremente a versão ao alterar o prompt ou o modelo de um stage
+PROMPT_VERSIONS = {
+    "table_vision": "v1",
+    "text_summary": "v1",
+    "table_description": "v1",
+    "image_description": "v1",
+    "contextual_prefix": "v1",
+    "fused_annotation": "v1",
+    "contextual_prefix_batch": "v1",
+}
+
+# ===========================================================================
+# EVENTOS DE PROGRESSO (ingestion_worker / API)
+# ===========================================================================
+_progress_callback = None
+
+
+def set_progress_callback(callback):
+    """
+    Registra quem recebe os eventos de progresso (None = desativar)
+
+    O callback recebe dicts {"stage": ..., "message": ..., **dados}. Usado pelo
+    ingestion_worker para expor o progresso sem depender do stdout.
+    """
+    global _progress_callback
+    _progress_callback = callback
+
+
+def emit_progress(stage, message, **data):
+    """Publica um evento de progresso estruturado (falhas do callback são ignoradas)"""
+    if _progress_callback is None:
+        return
+    try:
+        _progress_callback({"stage": stage, "message": message, **data})
+    except Exception as e:
+        print(f"   ⚠️  Erro no callback de progresso: {str(e)[:80]}")
+
+
 # ===========================================================================
 # METADATA CLEANING FOR CHROMADB 0.5.x
 # ===========================================================================
@@ -54,191 +124,333 @@ def clean_metadata_for_chromadb(metadata: dict) -> dict:
 # ===========================================================================
 # METADATA ENRICHMENT SYSTEM
 # ===========================================================================
-print("🚀 Carregando Metadata Enrichment System...")
-from metadata_extractors import MetadataEnricher
-
-# Inicializar extractors globais (uma vez só para melhor performance)
-enricher = MetadataEnricher()
-print()
-
-if len(sys.argv) < 2:
-    print("Uso: python adicionar_pdf.py arquivo.pdf")
-    print("   ou: python adicionar_pdf.py content/arquivo.pdf")
-    exit(1)
-
-# Aceitar tanto "arquivo.pdf" quanto "content/arquivo.pdf"
-input_path = sys.argv[1]
-
-if os.path.exists(input_path):
-    # Caminho completo fornecido
-    file_path = input_path
-    pdf_filename = os.path.basename(input_path)
-elif os.path.exists(f"./content/{input_path}"):
-    # Só nome do arquivo fornecido
-    file_path = f"./content/{input_path}"
-    pdf_filename = input_path
-else:
-    print(f"❌ PDF não encontrado: {input_path}")
-    print(f"   Tentou também: ./content/{input_path}")
-    exit(1)
-
-print(f"📄 Processando: {pdf_filename}")
-print("⏳ Aguarde 5-10 minutos...\n")
-
-# Vectorstore unificado - Railway Volume
-persist_directory = os.getenv("PERSIST_DIR", "./knowledge")
-persist_directory = os.path.abspath(persist_directory)  # Converter para caminho absoluto
-
-print(f"=" * 70)
-print(f"🔧 CONFIGURAÇÃO DE DIRETÓRIOS")
-print(f"=" * 70)
-print(f"Current working directory: {os.getcwd()}")
-print(f"PERSIST_DIR (env): {os.getenv('PERSIST_DIR', 'NOT SET')}")
-print(f"persist_directory (absoluto): {persist_directory}")
-print(f"Docstore será salvo em: {persist_directory}/docstore.pkl")
-print(f"=" * 70)
-print()
+_enricher = None
 
-# ===========================================================================
-# GERAR PDF_ID E VERIFICAR DUPLICATA
-# ===========================================================================
-print("🔍 Gerando ID do documento...")
-pdf_id = generate_pdf_id(file_path)
-file_size = os.path.getsize(file_path)
-uploaded_at = time.strftime("%Y-%m-%d %H:%M:%S")
-
-print(f"   PDF_ID: {pdf_id[:16]}...")
-print(f"   Tamanho: {file_size / 1024 / 1024:.2f} MB")
-
-# Verificar se PDF já foi processado
-existing_doc = check_duplicate(file_path, persist_directory)
-if existing_doc:
-    print(f"\n⚠️  Este PDF já foi processado!")
-    print(f"   Adicionado em: {existing_doc.get('uploaded_at', 'desconhecido')}")
-    print(f"   Chunks: {existing_doc.get('stats', {}).get('total_chunks', 0)}")
-
-    # Detectar se está em modo não-interativo (Railway, Docker, API)
-    import sys
-    is_non_interactive = not sys.stdin.isatty() or os.getenv("AUTO_REPROCESS") == "true"
-
-    if is_non_interactive:
-        # Modo automático (Railway, API, Docker)
-        print("\n🔄 Modo não-interativo detectado, reprocessando automaticamente...\n")
-    else:
-        # Modo interativo (terminal local)
-        choice = input("\nReprocessar? (s/N): ")
-        if choice.lower() != 's':
-            print("❌ Processamento cancelado.")
-            exit(0)
-        print("\n🔄 Reprocessando documento...\n")
-
-    # ✅ PREVENIR DUPLICAÇÃO: Deletar versão anterior antes de reprocessar
-    print("🗑️  Deletando versão anterior para prevenir duplicação...")
-    from document_manager import delete_document
-    pdf_id = existing_doc.get('pdf_id')
-    delete_result = delete_document(pdf_id, persist_directory)
 
-    if delete_result.get('status') == 'success':
-        print(f"   ✓ {delete_result.get('deleted_chunks', 0)} chunks removidos")
-        print(f"   ✓ Documento anterior deletado com sucesso\n")
-    else:
-        print(f"   ⚠️  Erro ao deletar versão anterior: {delete_result.get('message', 'desconhecido')}")
-        print(f"   ⚠️  Prosseguindo com reprocessamento (pode causar duplicação)\n")
-else:
-    print("✅ Documento novo, prosseguindo...\n")
+def get_enricher():
+    """
+    Retorna o enricher do processo (carregado uma única vez).
+
+    KeyBERT leva alguns segundos para carregar; reutilizar a instância evita
+    esse custo a cada PDF quando vários documentos passam pelo mesmo processo.
+    Por padrão roda em workers com timeout real (ver enrichment_pool.py).
+    """
+    global _enricher
+    if _enricher is None:
+        print("🚀 Carregando Metadata Enrichment System...")
+        from enrichment_pool import get_enrichment_pool
+        _enricher = get_enrichment_pool()
+        print()
+    return _enricher
+
+
+def get_ingestion_cache():
+    """Cache persistente das respostas LLM/Vision (ver llm_cache.py)"""
+    return get_llm_cache(get_persist_directory())
+
+
+def get_ingestion_rate_limiter():
+    """Orçamento de requisições/tokens compartilhado com a API e o modo bulk (ver rate_limiter.py)"""
+    return get_rate_limiter(get_persist_directory())
+
+
+def get_ingestion_image_index():
+    """Índice global de imagens do knowledge base (ver image_index.py)"""
+    return get_image_index(get_persist_directory())
+
+
+async def limited_ainvoke(runnable, value, bucket, tokens):
+    """runnable.ainvoke(value) respeitando o rate limiter do modelo `bucket`"""
+    async with get_ingestion_rate_limiter().aguard(bucket, tokens):
+        return await runnable.ainvoke(value)
+
+
+# Novas tentativas por item nos batches de descrição (além das do cliente OpenAI)
+LLM_ITEM_RETRIES = int(os.getenv("LLM_ITEM_RETRIES", "3"))
+LLM_RETRY_BASE_SECONDS = float(os.getenv("LLM_RETRY_BASE_SECONDS", "1"))
+LLM_RETRY_MAX_SECONDS = 20
+
+
+def is_retryable_error(error):
+    """Erros transitórios (timeout, 429, 5xx, rede); 4xx de requisição inválida não"""
+    if is_rate_limit_error(error):
+        return True
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    return status is None or status in (408, 409) or status >= 500
+
+
+async def limited_ainvoke_retry(runnable, value, bucket, tokens, retries=None):
+    """
+    limited_ainvoke() com novas tentativas e backoff exponencial (com jitter)
+
+    Cada item de um batch tenta sozinho: uma falha transitória não derruba os
+    outros itens. 429 espera o Retry-After quando informado.
+    """
+    import random
+
+    retries = LLM_ITEM_RETRIES if retries is None else retries
+    for attempt in range(retries + 1):
+        try:
+            return await limited_ainvoke(runnable, value, bucket, tokens)
+        except Exception as e:
+            if attempt >= retries or not is_retryable_error(e):
+                raise
+            delay = min(LLM_RETRY_MAX_SECONDS, LLM_RETRY_BASE_SECONDS * 2 ** attempt)
+            delay = retry_after_seconds(e) or delay * random.uniform(0.5, 1.0)
+            await asyncio.sleep(delay)
+
 
 # ===========================================================================
 # EXTRAIR E PROCESSAR PDF
 # ===========================================================================
-from unstructured.partition.pdf import partition_pdf
-
 # Permite alternar a estratégia via variável de ambiente e faz fallback automático
 strategy_env = os.getenv("UNSTRUCTURED_STRATEGY", "hi_res").strip().lower()
 
-def run_partition(strategy: str):
+# Particionamento paralelo por faixas de páginas (PDFs grandes)
+# PARTITION_WORKERS=1 mantém o partition_pdf único sobre o arquivo inteiro
+PARTITION_WORKERS = int(os.getenv("PARTITION_WORKERS", "1"))
+PARTITION_PAGES_PER_RANGE = int(os.getenv("PARTITION_PAGES_PER_RANGE", "25"))
+
+# ✅ CHUNKING OTIMIZADO PARA DOCUMENTOS MÉDICOS
+# Compartilhado pelo partition único e pelo chunking pós-merge do modo paralelo
+# NOTA IMPORTANTE: Tabelas são SEMPRE preservadas inteiras (isoladas)
+# tanto em by_title quanto em basic - ver documentação Unstructured
+CHUNKING_KWARGS = {
+    # Hard maximum: ~2500 tokens - chunks grandes preservam contexto completo
+    "max_characters": 10000,
+
+    # Agrupa elementos pequenos (<4000 chars) no mesmo chunk
+    # Combina múltiplos parágrafos relacionados da mesma seção
+    "combine_text_under_n_chars": 4000,
+
+    # Soft maximum: força quebra em 6000 chars (~1500 tokens)
+    # Balanceia contexto amplo com eficiência de retrieval
+    "new_after_n_chars": 6000,
+}
+
+
+def _partition_kwargs(strategy: str) -> dict:
+    """Parâmetros de extração (sem chunking) usados em todos os modos"""
+    return {
+        "infer_table_structure": True,
+        "strategy": strategy,
+        "extract_image_block_types": ["Image", "Table"],
+        "extract_image_block_to_payload": True,
+        "languages": ["por"],  # ✅ Força OCR em português
+    }
+
+
+def run_partition(file_path: str, strategy: str):
+    """
+    Executa partition_pdf + chunking by_title
+
+    Com PARTITION_WORKERS > 1 e PDFs maiores que PARTITION_PAGES_PER_RANGE
+    páginas, delega para run_partition_parallel().
+    """
+    if PARTITION_WORKERS > 1:
+        page_count = count_pdf_pages(file_path)
+        if page_count > PARTITION_PAGES_PER_RANGE:
+            return run_partition_parallel(file_path, strategy, page_count)
+
+    from unstructured.partition.pdf import partition_pdf
+
     return partition_pdf(
         filename=file_path,
-        infer_table_structure=True,
-        strategy=strategy,
-        extract_image_block_types=["Image", "Table"],
-        extract_image_block_to_payload=True,
-        languages=["por"],  # ✅ Força OCR em português
-
-        # ✅ CHUNKING OTIMIZADO PARA DOCUMENTOS MÉDICOS
-        # NOTA IMPORTANTE: Tabelas são SEMPRE preservadas inteiras (isoladas)
-        # tanto em by_title quanto em basic - ver documentação Unstructured
         chunking_strategy="by_title",
+        **_partition_kwargs(strategy),
+        **CHUNKING_KWARGS,
+    )
 
-        # Hard maximum: ~2500 tokens - chunks grandes preservam contexto completo
-        max_characters=10000,
 
-        # Agrupa elementos pequenos (<4000 chars) no mesmo chunk
-        # Combina múltiplos parágrafos relacionados da mesma seção
-        combine_text_under_n_chars=4000,
+def count_pdf_pages(file_path: str) -> int:
+    """Número de páginas do PDF (0 se não for possível ler)"""
+    try:
+        from pypdf import PdfReader
+        return len(PdfReader(file_path).pages)
+    except Exception as e:
+        print(f"   ⚠️  Não foi possível contar páginas: {str(e)[:80]}")
+        return 0
 
-        # Soft maximum: força quebra em 6000 chars (~1500 tokens)
-        # Balanceia contexto amplo com eficiência de retrieval
-        new_after_n_chars=6000,
-    )
 
-try:
-    # Tenta com a estratégia definida (padrão hi_res)
-    chunks = run_partition(strategy_env)
-    strategy_used = strategy_env
-except Exception as e:
-    # Se falhar por falta de libGL/cv2, faz fallback para 'fast'
-    if "libGL.so.1" in str(e) or "cv2" in str(e) or "detectron2onnx" in str(e):
-        print("⚠️  Falha em hi_res (provável falta de libGL). Usando strategy='fast'.")
-        chunks = run_partition("fast")
-        strategy_used = "fast"
-    else:
-        raise
+def _partition_page_range(file_path: str, start: int, end: int, strategy: str):
+    """
+    Executado em processo separado: particiona as páginas [start, end) SEM chunking
+
+    A faixa é gravada em um PDF temporário; starting_page_number e
+    metadata_filename mantêm page_number e filename iguais aos do arquivo original.
+    """
+    import tempfile
+    from pypdf import PdfReader, PdfWriter
+    from unstructured.partition.pdf import partition_pdf
+
+    reader = PdfReader(file_path)
+    writer = PdfWriter()
+    for page_index in range(start, end):
+        writer.add_page(reader.pages[page_index])
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        range_path = os.path.join(tmp_dir, f"pages_{start + 1}_{end}.pdf")
+        with open(range_path, "wb") as f:
+            writer.write(f)
+
+        return partition_pdf(
+            filename=range_path,
+            metadata_filename=os.path.basename(file_path),
+            starting_page_number=start + 1,
+            **_partition_kwargs(strategy),
+        )
+
+
+def run_partition_parallel(file_path: str, strategy: str, page_count: int):
+    """
+    Particiona faixas de páginas em processos paralelos e aplica by_title no merge
+
+    OCR e detecção de layout (hi_res) são independentes por página, então cada
+    faixa é particionada isoladamente. Os elementos são concatenados na ordem
+    das páginas e só então passam pelo MESMO chunking by_title do modo único.
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    from unstructured.chunking.title import chunk_by_title
+
+    ranges = [
+        (start, min(start + PARTITION_PAGES_PER_RANGE, page_count))
+        for start in range(0, page_count, PARTITION_PAGES_PER_RANGE)
+    ]
+    workers = min(PARTITION_WORKERS, len(ranges))
+    print(f"   ⚡ Partition paralelo: {page_count} páginas em {len(ranges)} faixas ({workers} processos)")
+
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+        futures = [
+            pool.submit(_partition_page_range, file_path, start, end, strategy)
+            for start, end in ranges
+        ]
+        # Resultados coletados na ordem das faixas → elementos em ordem de página
+        elements = []
+        for future in futures:
+            elements.extend(future.result())
+
+    return chunk_by_title(elements, **CHUNKING_KWARGS)
+
+
+def partition_document(file_path: str):
+    """
+    Particiona o PDF com a estratégia configurada (fallback para 'fast')
+
+    Returns:
+        tuple: (chunks, strategy_used)
+    """
+    try:
+        # Tenta com a estratégia definida (padrão hi_res)
+        chunks = run_partition(file_path, strategy_env)
+        strategy_used = strategy_env
+    except Exception as e:
+        # Se falhar por falta de libGL/cv2, faz fallback para 'fast'
+        if "libGL.so.1" in str(e) or "cv2" in str(e) or "detectron2onnx" in str(e):
+            print("⚠️  Falha em hi_res (provável falta de libGL). Usando strategy='fast'.")
+            chunks = run_partition(file_path, "fast")
+            strategy_used = "fast"
+        else:
+            raise
+
+    print(f"1️⃣  Extraído: {len(chunks)} elementos (estratégia: {strategy_used})")
+
+    # DEBUG: Mostrar tipos de elementos
+    element_types = {}
+    for chunk in chunks:
+        chunk_type = str(type(chunk).__name__)
+        element_types[chunk_type] = element_types.get(chunk_type, 0) + 1
+
+    print(f"\n   Tipos de elementos encontrados:")
+    for elem_type, count in sorted(element_types.items()):
+        print(f"     {elem_type}: {count}")
 
-print(f"1️⃣  Extraído: {len(chunks)} elementos (estratégia: {strategy_used})")
-
-# DEBUG: Mostrar tipos de elementos
-element_types = {}
-for chunk in chunks:
-    chunk_type = str(type(chunk).__name__)
-    element_types[chunk_type] = element_types.get(chunk_type, 0) + 1
-
-print(f"\n   Tipos de elementos encontrados:")
-for elem_type, count in sorted(element_types.items()):
-    print(f"     {elem_type}: {count}")
-
-# Separar elementos
-# Com chunking by_title, Unstructured retorna:
-# - CompositeElement: textos agrupados por seção
-# - Table: tabelas isoladas (sempre preservadas inteiras)
-#
-# NOTA: Com parâmetros agressivos de chunking, tabelas podem vir:
-# 1. Como elementos Table de primeira classe (ideal)
-# 2. Dentro de CompositeElement.metadata.orig_elements (com chunking agressivo)
-tables = []
-texts = []
-
-for chunk in chunks:
-    chunk_type = str(type(chunk))
-
-    # Tabelas diretas (primeira classe)
-    if "Table" in chunk_type:
-        tables.append(chunk)
-
-    # CompositeElements (textos agrupados)
-    if "CompositeElement" in chunk_type:
-        texts.append(chunk)
-
-        # CRITICAL: Verificar se há tabelas escondidas em orig_elements
-        # Com chunking agressivo, tabelas podem ser agrupadas aqui
-        if hasattr(chunk, 'metadata') and hasattr(chunk.metadata, 'orig_elements'):
-            if chunk.metadata.orig_elements:
-                for orig_el in chunk.metadata.orig_elements:
-                    if "Table" in str(type(orig_el).__name__):
-                        # Tabela encontrada dentro de CompositeElement
-                        # Adicionar à lista de tabelas
-                        if orig_el not in tables:
-                            tables.append(orig_el)
-                            print(f"   ⚠️  Tabela encontrada em orig_elements (chunk agressivo)")
+    return chunks, strategy_used
+
+
+def element_page(element):
+    """page_number do elemento (ou None)"""
+    metadata = getattr(element, 'metadata', None)
+    return getattr(metadata, 'page_number', None) if metadata is not None else None
+
+
+class ElementIndex:
+    """
+    Índice dos elementos particionados, montado em UMA passada
+
+    - Página → chunks de primeiro nível na ordem do documento (com o tipo)
+    - Textos (CompositeElement) e tabelas, incluindo as escondidas em
+      orig_elements, deduplicadas por (tipo, texto, página) em um set
+
+    Substitui as buscas quadráticas do pós-processamento de tabelas
+    (`orig_el not in tables` e varrer todos os chunks para cada tabela).
+    """
+
+    def __init__(self, chunks):
+        self.texts = []
+        self.tables = []
+        self.nested_tables = 0
+        self._by_page = {}  # página → [(nome do tipo, elemento)]
+        seen_tables = set()
+
+        for chunk in chunks:
+            type_name = type(chunk).__name__
+            self._by_page.setdefault(element_page(chunk), []).append((type_name, chunk))
+
+            # Tabelas diretas (primeira classe)
+            if "Table" in type_name:
+                self.tables.append(chunk)
+                seen_tables.add(self._table_key(chunk))
+
+            # CompositeElements (textos agrupados)
+            if "CompositeElement" in type_name:
+                self.texts.append(chunk)
+
+                # CRITICAL: Verificar se há tabelas escondidas em orig_elements
+                # Com chunking agressivo, tabelas podem ser agrupadas aqui
+                orig_elements = getattr(getattr(chunk, 'metadata', None), 'orig_elements', None) or []
+                for orig_el in orig_elements:
+                    if "Table" in type(orig_el).__name__:
+                        key = self._table_key(orig_el)
+                        if key not in seen_tables:
+                            seen_tables.add(key)
+                            self.tables.append(orig_el)
+                            self.nested_tables += 1
+
+    @staticmethod
+    def _table_key(element):
+        text = element.text if hasattr(element, 'text') else str(element)
+        return type(element).__name__, text, element_page(element)
+
+    def on_page(self, page, type_filter=None):
+        """Chunks de primeiro nível da página, na ordem do documento"""
+        return [
+            element for type_name, element in self._by_page.get(page, [])
+            if type_filter is None or type_filter(type_name)
+        ]
+
+
+def split_elements(chunks, index=None):
+    """
+    Separa os elementos particionados em textos e tabelas
+
+    Returns:
+        tuple: (texts, tables)
+    """
+    # Separar elementos
+    # Com chunking by_title, Unstructured retorna:
+    # - CompositeElement: textos agrupados por seção
+    # - Table: tabelas isoladas (sempre preservadas inteiras)
+    #
+    # NOTA: Com parâmetros agressivos de chunking, tabelas podem vir:
+    # 1. Como elementos Table de primeira classe (ideal)
+    # 2. Dentro de CompositeElement.metadata.orig_elements (com chunking agressivo)
+    index = index or ElementIndex(chunks)
+    if index.nested_tables:
+        print(f"   ⚠️  {index.nested_tables} tabela(s) encontrada(s) em orig_elements (chunk agressivo)")
+
+    return index.texts, index.tables
 
 # ===========================================================================
 # FUNÇÕES DE EXTRAÇÃO DE METADATA MÉDICO
@@ -387,85 +599,15 @@ def infer_document_type(filename):
 
 
 # ===========================================================================
-# CONVERSÃO DE IMAGENS PARA FORMATO SUPORTADO
+# CONVERSÃO DE IMAGENS PARA FORMATO SUPORTADO (ver image_transcode.py)
 # ===========================================================================
-
-def convert_image_to_jpeg_base64(image_base64_str, auto_rotate=False):
-    """
-    Converte qualquer formato de imagem para JPEG (suportado por GPT-4 Vision).
-
-    Formatos não suportados: TIFF, BMP, ICO, etc.
-    Formatos suportados: PNG, JPEG, GIF, WEBP
-
-    Esta função garante que TODAS as imagens sejam JPEG válidas.
-
-    Args:
-        image_base64_str: String base64 da imagem
-        auto_rotate: Se True, detecta e corrige orientação vertical (tabelas rotacionadas)
-
-    Returns:
-        tuple: (jpeg_base64, success, rotation_applied)
-    """
-    try:
-        # Decodificar base64 para bytes
-        image_bytes = b64decode(image_base64_str)
-
-        # Abrir imagem com PIL
-        img = Image.open(io.BytesIO(image_bytes))
-
-        rotation_applied = 0
-
-        # ✅ AUTO-ROTATE: Detectar e corrigir orientação vertical
-        if auto_rotate:
-            width, height = img.size
-
-            # Se altura >> largura, provavelmente está rotacionada
-            # Ratio > 1.5 indica orientação vertical/portrait
-            aspect_ratio = height / width if width > 0 else 1
-
-            if aspect_ratio > 1.5:
-                # Rotacionar -90° (270°) no sentido horário (clockwise)
-                # Tabelas verticais geralmente estão rotacionadas 90° para direita no PDF
-                # Então precisamos rotacionar -90° para corrigir
-                img = img.rotate(-90, expand=True)
-                rotation_applied = -90
-                print(f"      🔄 Imagem rotacionada -90° HORÁRIO (aspect ratio: {aspect_ratio:.2f})")
-
-        # Converter para RGB (remove alpha channel se houver)
-        # Isso é necessário porque JPEG não suporta transparência
-        if img.mode in ('RGBA', 'LA', 'P'):
-            # Criar background branco
-            background = Image.new('RGB', img.size, (255, 255, 255))
-
-            # Converter P (palette) para RGBA primeiro
-            if img.mode == 'P':
-                img = img.convert('RGBA')
-
-            # Colar imagem sobre background branco (preserva transparência)
-            if img.mode in ('RGBA', 'LA'):
-                background.paste(img, mask=img.split()[-1])  # Usa alpha channel como máscara
-            else:
-                background.paste(img)
-
-            img = background
-        elif img.mode != 'RGB':
-            # Outros modos (L, CMYK, etc.) → RGB
-            img = img.convert('RGB')
-
-        # Salvar como JPEG em buffer
-        output = io.BytesIO()
-        img.save(output, format='JPEG', quality=85, optimize=True)
-        jpeg_bytes = output.getvalue()
-
-        # Re-encodar para base64
-        jpeg_base64 = b64encode(jpeg_bytes).decode('utf-8')
-
-        return jpeg_base64, True, rotation_applied
-
-    except Exception as e:
-        # Se conversão falhar, retornar None
-        print(f"      ⚠️  Erro ao converter imagem: {str(e)[:100]}")
-        return None, False, 0
+def is_new_image(jpeg_img, seen_images):
+    """Registra a imagem em seen_images (sha256 dos pixels → imagem) se o conteúdo ainda não foi visto"""
+    key = content_hash(jpeg_img)
+    if key in seen_images:
+        return False
+    seen_images[key] = jpeg_img
+    return True
 
 
 # Extrair imagens base64 dos chunks
@@ -478,9 +620,10 @@ def get_images_base64(chunks):
     Filtra imagens pequenas (<5KB) que geralmente são ícones/decoração
 
     ✅ CONVERTE TODAS AS IMAGENS PARA JPEG (formato suportado por GPT-4 Vision)
+    As conversões rodam juntas no pool de processos (transcode_images).
     """
     images_b64 = []
-    seen_hashes = set()  # Deduplicação
+    seen_images = {}  # Deduplicação: sha256 dos pixels, calculado uma vez por imagem
     filtered_count = 0
     total_found = 0
 
@@ -490,88 +633,50 @@ def get_images_base64(chunks):
     # Imagens >30KB: fluxogramas, diagramas, gráficos importantes, fotos, screenshots
     MIN_IMAGE_SIZE_KB = float(os.getenv("MIN_IMAGE_SIZE_KB", "30"))
 
+    # 1. Coletar as imagens na ordem do documento
+    candidates = []
     for chunk in chunks:
         chunk_type = str(type(chunk))
 
         # CASO 1: Elementos Image de primeira classe
         if "Image" in chunk_type:
+            image_elements = [chunk]
+        # CASO 2: Imagens dentro de CompositeElements
+        elif "CompositeElement" in chunk_type and hasattr(chunk, 'metadata') and hasattr(chunk.metadata, 'orig_elements'):
+            image_elements = [el for el in (chunk.metadata.orig_elements or []) if "Image" in str(type(el))]
+        else:
+            continue
+
+        for el in image_elements:
             total_found += 1
-            if hasattr(chunk, 'metadata') and hasattr(chunk.metadata, 'image_base64'):
-                img = chunk.metadata.image_base64
+            if hasattr(el, 'metadata') and hasattr(el.metadata, 'image_base64'):
+                img = el.metadata.image_base64
                 if img and len(img) > 100:
-                    # ✅ CONVERT TO JPEG BEFORE SIZE CHECK
-                    jpeg_img, success, _ = convert_image_to_jpeg_base64(img, auto_rotate=False)
-                    if not success:
-                        filtered_count += 1
-                        continue
+                    candidates.append(img)
 
-                    size_kb = len(jpeg_img) / 1024
+    # 2. ✅ CONVERT TO JPEG BEFORE SIZE CHECK (em paralelo, cada imagem uma vez)
+    for jpeg_img, success, _ in transcode_images(candidates, auto_rotate=False):
+        if not success:
+            filtered_count += 1
+            continue
 
-                    # Filtrar imagens muito pequenas
-                    if size_kb >= MIN_IMAGE_SIZE_KB:
-                        # Deduplicar por hash
-                        img_hash = hash(jpeg_img[:1000])
-                        if img_hash not in seen_hashes:
-                            seen_hashes.add(img_hash)
-                            images_b64.append(jpeg_img)  # ✅ Use converted JPEG
-                    else:
-                        filtered_count += 1
+        size_kb = len(jpeg_img) / 1024
 
-        # CASO 2: Imagens dentro de CompositeElements
-        elif "CompositeElement" in chunk_type:
-            if hasattr(chunk, 'metadata') and hasattr(chunk.metadata, 'orig_elements'):
-                chunk_els = chunk.metadata.orig_elements
-                if chunk_els:
-                    for el in chunk_els:
-                        if "Image" in str(type(el)):
-                            total_found += 1
-                            if hasattr(el, 'metadata') and hasattr(el.metadata, 'image_base64'):
-                                img = el.metadata.image_base64
-                                if img and len(img) > 100:
-                                    # ✅ CONVERT TO JPEG BEFORE SIZE CHECK
-                                    jpeg_img, success, _ = convert_image_to_jpeg_base64(img, auto_rotate=False)
-                                    if not success:
-                                        filtered_count += 1
-                                        continue
-
-                                    size_kb = len(jpeg_img) / 1024
-
-                                    # Filtrar imagens muito pequenas
-                                    if size_kb >= MIN_IMAGE_SIZE_KB:
-                                        # Deduplicar por hash
-                                        img_hash = hash(jpeg_img[:1000])
-                                        if img_hash not in seen_hashes:
-                                            seen_hashes.add(img_hash)
-                                            images_b64.append(jpeg_img)  # ✅ Use converted JPEG
-                                    else:
-                                        filtered_count += 1
+        # Filtrar imagens muito pequenas
+        if size_kb >= MIN_IMAGE_SIZE_KB:
+            # Deduplicar imagens repetidas
+            if is_new_image(jpeg_img, seen_images):
+                images_b64.append(jpeg_img)  # ✅ Use converted JPEG
+        else:
+            filtered_count += 1
 
     return images_b64, filtered_count, total_found
 
-images, filtered_count, total_images_found = get_images_base64(chunks)
-duplicate_count = 0  # Já deduplicado na função
-
-# Modo debug: mostrar detalhes das imagens
-if os.getenv("DEBUG_IMAGES"):
-    print("\n   [DEBUG] Detalhes das imagens extraídas:")
-    for i, img in enumerate(images):
-        size_kb = len(img) / 1024
-        print(f"     Imagem {i+1}: {size_kb:.1f} KB")
-    print(f"   [DEBUG] Total encontrado: {total_images_found}")
-    print(f"   [DEBUG] Filtradas (muito pequenas): {filtered_count}")
-    print(f"   [DEBUG] Duplicatas removidas: {duplicate_count}")
-
-print(f"   ✓ {len(texts)} textos, {len(tables)} tabelas, {len(images)} imagens")
-if filtered_count > 0:
-    min_size_threshold = float(os.getenv("MIN_IMAGE_SIZE_KB", "30"))
-    print(f"      (detectadas: {total_images_found}, filtradas: {filtered_count} imagens pequenas <{min_size_threshold:.0f}KB)")
-print()
-
 # ===========================================================================
 # EXTRAÇÃO ROBUSTA DE TABELAS COM VISION API
 # ===========================================================================
 from langchain_openai import ChatOpenAI
-from langchain_core.messages import HumanMessage
+from langchain_core.messages import HumanMessage, SystemMessage
 
 def validate_table_completeness(table_text, critical_keywords=None):
     """
@@ -626,8 +731,10 @@ def extract_table_with_vision(table_element, pdf_filename):
     if not image_b64 or len(image_b64) < 100:
         return None, False, {"error": "Image too small"}
 
+    image_key = input_hash(image_b64)  # Hash da imagem original (chave do cache)
+
     # ✅ CONVERT TABLE IMAGE TO JPEG + AUTO-ROTATE vertical tables
-    jpeg_image_b64, success, rotation = convert_image_to_jpeg_base64(image_b64, auto_rotate=True)
+    jpeg_image_b64, success, rotation = convert_image_cached(image_b64, auto_rotate=True)
     if not success:
         return None, False, {"error": "Failed to convert image to JPEG"}
 
@@ -639,6 +746,17 @@ def extract_table_with_vision(table_element, pdf_filename):
 
     page_num = table_element.metadata.page_number if hasattr(table_element.metadata, 'page_number') else '?'
 
+    cache = get_ingestion_cache()
+    vision_text = cache.get("table_vision", "gpt-4o", PROMPT_VERSIONS["table_vision"], image_key)
+    if vision_text is not None:
+        return vision_text, True, {
+            "page": page_num,
+            "length": len(vision_text),
+            "method": "gpt-4o-vision",
+            "rotation_applied": rotation,
+            "cached": True
+        }
+
     try:
         llm = ChatOpenAI(model="gpt-4o", max_tokens=2000, temperature=0)
 
@@ -663,18 +781,24 @@ Forneça a tabela em Markdown, começando com | Coluna1 | Coluna2 | ... |
 
 TABELA:"""
 
+        # Margens recortadas + escala da OpenAI; tabelas sempre em detail high
+        vision_input = optimize_for_vision(image_b64, max_tiles=VISION_TABLE_MAX_TILES, detail="high")
+
         message = HumanMessage(
             content=[
                 {"type": "text", "text": prompt},
                 {
                     "type": "image_url",
-                    "image_url": {"url": f"data:image/jpeg;base64,{image_b64}"}
+                    "image_url": {"url": f"data:image/jpeg;base64,{vision_input['image']}",
+                                  "detail": vision_input["detail"]}
                 }
             ]
         )
 
-        response = llm.invoke([message])
+        with get_ingestion_rate_limiter().guard("gpt-4o", estimate_tokens(prompt, images=1, max_output=2000)):
+            response = llm.invoke([message])
         vision_text = response.content
+        cache.set("table_vision", "gpt-4o", PROMPT_VERSIONS["table_vision"], image_key, vision_text)
 
         return vision_text, True, {
             "page": page_num,
@@ -687,16 +811,122 @@ TABELA:"""
         return None, False, {"error": str(e)[:100]}
 
 
-def extract_table_robust(table_element, pdf_filename, table_index):
+# Modo da extração de tabelas:
+# - lazy: avalia o OCR primeiro e só chama Vision quando há sinais de perda
+# - always: sempre chama Vision e compara com o OCR (comportamento anterior)
+TABLE_VISION_MODE = os.getenv("TABLE_VISION_MODE", "lazy").strip().lower()
+
+# Sinais de perda no OCR (modo lazy)
+TABLE_OCR_MIN_COMPLETENESS = float(os.getenv("TABLE_OCR_MIN_COMPLETENESS", "0.25"))
+TABLE_OCR_MIN_WORDS = 8
+TABLE_RAGGED_ROWS_RATIO = 0.3  # Linhas com menos colunas que o header
+TABLE_EMPTY_CELLS_RATIO = 0.4
+TABLE_SINGLE_CHAR_RATIO = 0.4  # OCR lendo caracteres soltos (tabela rotacionada)
+TABLE_ROTATED_ASPECT_RATIO = 1.5  # Mesmo critério do auto-rotate
+
+
+def html_table_shape(html):
+    """
+    Colunas por linha de um text_as_html (considerando colspan) + células vazias
+
+    Returns:
+        dict {"rows", "columns", "ragged_rows", "empty_cells", "cells"} ou None sem <tr>
+    """
+    import re
+
+    rows = re.findall(r"<tr[^>]*>(.*?)</tr>", html or "", flags=re.S | re.I)
+    if not rows:
+        return None
+
+    row_widths = []
+    empty_cells = 0
+    cells_total = 0
+    for row in rows:
+        width = 0
+        for attrs, content in re.findall(r"<t[dh]([^>]*)>(.*?)</t[dh]>", row, flags=re.S | re.I):
+            colspan = re.search(r"colspan=[\"']?(\d+)", attrs)
+            width += int(colspan.group(1)) if colspan else 1
+            cells_total += 1
+            if not re.sub(r"<[^>]+>|&nbsp;|\s", "", content):
+                empty_cells += 1
+        row_widths.append(width)
+
+    columns = max(row_widths)
+    return {
+        "rows": len(rows),
+        "columns": columns,
+        "ragged_rows": sum(1 for w in row_widths if w < columns),
+        "empty_cells": empty_cells,
+        "cells": cells_total,
+    }
+
+
+def assess_ocr_table(table_element, ocr_text, ocr_validation):
+    """
+    Sinais baratos de que o OCR perdeu conteúdo (sem chamar Vision)
+
+    - Keywords críticos ausentes ou parcialmente presentes (sem validação, sem sinal)
+    - OCR curto demais ou lendo caracteres soltos
+    - text_as_html com uma coluna só, linhas irregulares ou muitas células vazias
+    - Imagem em orientação vertical (tabela rotacionada: OCR falha)
+
+    Returns:
+        tuple: (needs_vision, signals)
+    """
+    signals = []
+    words = ocr_text.split()
+
+    # Sem keywords para validar (ocr_validation ausente) não conta como OCR vazio
+    if ocr_validation and ocr_validation.get("total_keywords"):
+        completeness = ocr_validation["completeness"]
+        if completeness == 0:
+            signals.append("nenhum keyword crítico no OCR")
+        elif completeness < TABLE_OCR_MIN_COMPLETENESS:
+            signals.append(f"keywords parciais ({completeness:.0%})")
+
+    if len(words) < TABLE_OCR_MIN_WORDS:
+        signals.append(f"OCR curto ({len(words)} palavras)")
+    elif sum(1 for w in words if len(w) == 1) / len(words) > TABLE_SINGLE_CHAR_RATIO:
+        signals.append("OCR fragmentado (caracteres soltos)")
+
+    metadata = getattr(table_element, "metadata", None)
+    shape = html_table_shape(getattr(metadata, "text_as_html", None))
+    if shape:
+        if shape["columns"] <= 1:
+            signals.append("HTML com 1 coluna")
+        elif shape["ragged_rows"] / shape["rows"] > TABLE_RAGGED_ROWS_RATIO:
+            signals.append(f"{shape['ragged_rows']}/{shape['rows']} linhas com colunas faltando")
+        if shape["cells"] and shape["empty_cells"] / shape["cells"] > TABLE_EMPTY_CELLS_RATIO:
+            signals.append(f"{shape['empty_cells']}/{shape['cells']} células vazias")
+
+    image_b64 = getattr(metadata, "image_base64", None)
+    if image_b64 and len(image_b64) >= 100:
+        try:
+            # Image.open só lê o header: tamanho sem decodificar os pixels
+            width, height = Image.open(io.BytesIO(b64decode(image_b64))).size
+            if width and height / width > TABLE_ROTATED_ASPECT_RATIO:
+                signals.append(f"imagem vertical (aspect ratio {height / width:.2f})")
+        except Exception:
+            pass
+
+    return bool(signals), signals
+
+
+def extract_table_robust(table_element, pdf_filename, table_index, vision_mode=None):
     """
     EXTRAÇÃO ROBUSTA: OCR + Vision + Validação + Decisão Inteligente
 
     Esta é a função DEFINITIVA para extração de tabelas.
 
+    No modo lazy (padrão) o OCR é avaliado primeiro (assess_ocr_table) e o
+    Vision só é chamado quando há sinais de perda; sem sinais, o texto do
+    OCR é usado direto (método ocr_lazy).
+
     Args:
         table_element: Elemento Table do Unstructured
         pdf_filename: Nome do PDF
         table_index: Índice da tabela (para logging)
+        vision_mode: "lazy" ou "always" (padrão: TABLE_VISION_MODE)
 
     Returns:
         tuple: (final_text, method_used, quality_report)
@@ -704,13 +934,33 @@ def extract_table_robust(table_element, pdf_filename, table_index):
     # 1. Extrair com OCR (Unstructured)
     ocr_text = table_element.text if hasattr(table_element, 'text') else str(table_element)
     ocr_length = len(ocr_text.split())
+    ocr_validation = validate_table_completeness(ocr_text)
+
+    # 1.5. Modo lazy: OCR sem sinais de perda dispensa o Vision
+    vision_mode = vision_mode or TABLE_VISION_MODE
+    signals = []
+    if vision_mode == "lazy":
+        needs_vision, signals = assess_ocr_table(table_element, ocr_text, ocr_validation)
+        if not needs_vision:
+            return ocr_text, "ocr_lazy", {
+                "table_index": table_index,
+                "method_used": "ocr_lazy",
+                "confidence": "high" if ocr_validation["completeness"] > 0.8 else "medium",
+                "ocr": {
+                    "length_words": ocr_length,
+                    "completeness": ocr_validation["completeness"],
+                    "missing": ocr_validation["missing_keywords"]
+                },
+                "vision": {"success": False, "skipped": True},
+                "escalation_signals": [],
+                "final_length": ocr_length
+            }
 
     # 2. Extrair com Vision (GPT-4o)
     vision_text, vision_success, vision_meta = extract_table_with_vision(table_element, pdf_filename)
     vision_length = len(vision_text.split()) if vision_success else 0
 
-    # 3. Validar completude de AMBOS
-    ocr_validation = validate_table_completeness(ocr_text)
+    # 3. Validar completude do Vision (OCR já validado)
     vision_validation = validate_table_completeness(vision_text) if vision_success else {"complete": False, "completeness": 0}
 
     # 4. DECISÃO INTELIGENTE: Qual método usar?
@@ -763,61 +1013,106 @@ def extract_table_robust(table_element, pdf_filename, table_index):
             "completeness": vision_validation["completeness"],
             "missing": vision_validation.get("missing_keywords", [])
         } if vision_success else {"success": False},
+        "escalation_signals": signals,
         "final_length": len(final_text.split())
     }
 
     return final_text, method, quality_report
 
 
-# Processar TODAS as tabelas com extração robusta
-if tables:
-    print(f"\n🔬 Processamento robusto de tabelas (OCR + Vision)...")
+# Tabelas extraídas em paralelo (cada uma pode fazer 1 request gpt-4o Vision)
+TABLE_VISION_CONCURRENCY = int(os.getenv("TABLE_VISION_CONCURRENCY", "4"))
 
-    tables_quality_reports = []
-    vision_used_count = 0
-    ocr_only_count = 0
 
-    for i, table in enumerate(tables):
-        # Extrair com método robusto
-        robust_text, method, quality = extract_table_robust(table, pdf_filename, i)
+class TableWithText:
+    """Wrapper para tabelas sem atributo .text (mantém metadata original)"""
+    def __init__(self, text, metadata):
+        self.text = text
+        self.metadata = metadata
 
-        # Atualizar texto da tabela com versão robusta
-        if hasattr(table, 'text'):
-            table.text = robust_text
-        else:
-            # Criar wrapper se necessário
-            class TableWithText:
-                def __init__(self, text, metadata):
-                    self.text = text
-                    self.metadata = metadata
-
-            original_metadata = table.metadata if hasattr(table, 'metadata') else None
-            tables[i] = TableWithText(robust_text, original_metadata)
-
-        # Tracking
-        tables_quality_reports.append(quality)
-        if "vision" in method:
-            vision_used_count += 1
-        else:
-            ocr_only_count += 1
 
-        # Log progress
-        status_icon = "✅" if quality["confidence"] == "high" else "⚠️"
-        print(f"   [{i+1}/{len(tables)}] {status_icon} {method} (confidence: {quality['confidence']})")
+def process_tables(tables, pdf_filename, concurrency=None):
+    """
+    Processa TODAS as tabelas com extração robusta (atualiza tables in-place)
 
-        # Mostrar warnings
-        if quality["ocr"]["missing"]:
-            print(f"      OCR missing: {', '.join(quality['ocr']['missing'][:3])}")
-        if quality["vision"]["success"] and quality["vision"]["missing"]:
-            print(f"      Vision missing: {', '.join(quality['vision']['missing'][:3])}")
+    As tabelas são extraídas em paralelo (até TABLE_VISION_CONCURRENCY por vez);
+    a decisão OCR vs Vision continua sendo por tabela em extract_table_robust().
 
-        time.sleep(0.5)  # Rate limiting
+    Returns:
+        list: Relatórios de qualidade por tabela (na ordem das tabelas)
+    """
+    from concurrent.futures import ThreadPoolExecutor, as_completed
 
-    print(f"\n   📊 Resumo:")
-    print(f"      Vision usado: {vision_used_count}/{len(tables)} tabelas")
-    print(f"      OCR apenas: {ocr_only_count}/{len(tables)} tabelas")
-    print(f"      Confiança alta: {sum(1 for r in tables_quality_reports if r['confidence'] == 'high')}/{len(tables)}")
-    print()
+    tables_quality_reports = []
+    if tables:
+        concurrency = max(1, concurrency or TABLE_VISION_CONCURRENCY)
+        mode_label = "OCR primeiro, Vision sob demanda" if TABLE_VISION_MODE == "lazy" else "OCR + Vision"
+        print(f"\n🔬 Processamento robusto de tabelas ({mode_label}, {concurrency} em paralelo)...")
+
+        vision_used_count = 0
+        ocr_only_count = 0
+        vision_skipped_count = 0
+        results = [None] * len(tables)
+
+        # Converter todas as imagens de tabela de uma vez no pool de processos:
+        # Vision e screenshots secundários reaproveitam a conversão do memo
+        table_images = [
+            table.metadata.image_base64 for table in tables
+            if hasattr(table, 'metadata') and len(getattr(table.metadata, 'image_base64', None) or "") >= 100
+        ]
+        transcode_images(table_images, auto_rotate=True)
+
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            # Extrair com método robusto
+            futures = {
+                pool.submit(extract_table_robust, table, pdf_filename, i): i
+                for i, table in enumerate(tables)
+            }
+
+            for done, future in enumerate(as_completed(futures), start=1):
+                i = futures[future]
+                robust_text, method, quality = future.result()
+                results[i] = (robust_text, method, quality)
+
+                # Log progress
+                status_icon = "✅" if quality["confidence"] == "high" else "⚠️"
+                print(f"   [{done}/{len(tables)}] Tabela {i+1}: {status_icon} {method} (confidence: {quality['confidence']})")
+
+                # Mostrar warnings
+                if quality["escalation_signals"]:
+                    print(f"      Vision acionado: {'; '.join(quality['escalation_signals'])}")
+                if quality["ocr"]["missing"] and method != "ocr_lazy":
+                    print(f"      OCR missing: {', '.join(quality['ocr']['missing'][:3])}")
+                if quality["vision"]["success"] and quality["vision"]["missing"]:
+                    print(f"      Vision missing: {', '.join(quality['vision']['missing'][:3])}")
+
+        for i, (robust_text, method, quality) in enumerate(results):
+            # Atualizar texto da tabela com versão robusta
+            if hasattr(tables[i], 'text'):
+                tables[i].text = robust_text
+            else:
+                # Criar wrapper se necessário
+                original_metadata = tables[i].metadata if hasattr(tables[i], 'metadata') else None
+                tables[i] = TableWithText(robust_text, original_metadata)
+
+            # Tracking
+            tables_quality_reports.append(quality)
+            if "vision" in method:
+                vision_used_count += 1
+            else:
+                ocr_only_count += 1
+            if quality["vision"].get("skipped"):
+                vision_skipped_count += 1
+
+        print(f"\n   📊 Resumo:")
+        print(f"      Vision usado: {vision_used_count}/{len(tables)} tabelas")
+        print(f"      OCR apenas: {ocr_only_count}/{len(tables)} tabelas")
+        if vision_skipped_count:
+            print(f"      Vision dispensado (OCR sem sinais de perda): {vision_skipped_count}/{len(tables)} tabelas")
+        print(f"      Confiança alta: {sum(1 for r in tables_quality_reports if r['confidence'] == 'high')}/{len(tables)}")
+        print()
+
+    return tables_quality_reports
 
 # ===========================================================================
 # GERAR RESUMOS COM IA - BATCH ASYNC PROCESSING
@@ -826,47 +1121,57 @@ import asyncio
 from langchain_groq import ChatGroq
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
-from langchain_openai import ChatOpenAI
-
-print("2️⃣  Gerando resumos (batch parallel processing)...")
 
 # Upgrade: Llama → GPT-4o-mini para resumos mais precisos (+40% qualidade)
-model = ChatOpenAI(model="gpt-4o-mini", temperature=0.3)  # Era Llama-8b
+_summary_model = None
+
+
+def get_summary_model():
+    """Modelo compartilhado por resumos de textos e descrições de tabelas"""
+    global _summary_model
+    if _summary_model is None:
+        _summary_model = ChatOpenAI(model="gpt-4o-mini", temperature=0.3)  # Era Llama-8b
+    return _summary_model
+
 prompt = ChatPromptTemplate.from_template("Summarize concisely: {element}")
-summarize = {"element": lambda x: x} | prompt | model | StrOutputParser()
 
 # ===========================================================================
 # TEXTOS - RESUMOS LLM (BATCH ASYNC)
 # ===========================================================================
 async def summarize_texts_batch(texts, batch_size=10):
     """Processar resumos de textos em batch paralelo"""
+    summarize = {"element": lambda x: x} | prompt | get_summary_model() | StrOutputParser()
+    cache = get_ingestion_cache()
+    version = PROMPT_VERSIONS["text_summary"]
     all_summaries = []
 
     for i in range(0, len(texts), batch_size):
         batch = texts[i:i+batch_size]
         contents = [text.text if hasattr(text, 'text') else str(text) for text in batch]
 
-        # Processar batch em paralelo
-        tasks = [summarize.ainvoke(content) for content in contents]
-        try:
-            batch_summaries = await asyncio.gather(*tasks)
-            all_summaries.extend(batch_summaries)
-        except Exception as e:
-            # Fallback: usar primeiros 500 chars em caso de erro
-            print(f"\n   ⚠️ Erro no batch {i//batch_size + 1}: {str(e)[:80]}")
-            all_summaries.extend([c[:500] for c in contents])
+        # Cache: só vão para o LLM os textos ainda não resumidos
+        keys = [input_hash(c) for c in contents]
+        batch_summaries = [cache.get("text_summary", "gpt-4o-mini", version, k) for k in keys]
+        missing = [j for j, summary in enumerate(batch_summaries) if summary is None]
+
+        # Processar batch em paralelo (cada item com suas próprias tentativas)
+        tasks = [limited_ainvoke_retry(summarize, contents[j], "gpt-4o-mini",
+                                       estimate_tokens(contents[j], max_output=300))
+                 for j in missing]
+        for j, summary in zip(missing, await asyncio.gather(*tasks, return_exceptions=True)):
+            if isinstance(summary, BaseException):
+                # Fallback só deste item: usar primeiros 500 chars
+                print(f"\n   ⚠️ Erro no resumo do texto {i + j + 1}: {str(summary)[:80]}")
+                batch_summaries[j] = contents[j][:500]
+            else:
+                batch_summaries[j] = summary
+                cache.set("text_summary", "gpt-4o-mini", version, keys[j], summary)
+        all_summaries.extend(batch_summaries)
 
         print(f"   Textos: {len(all_summaries)}/{len(texts)}", end="\r")
 
     return all_summaries
 
-# Executar
-if texts:
-    text_summaries = asyncio.run(summarize_texts_batch(texts, batch_size=10))
-    print(f"   ✓ {len(text_summaries)} textos resumidos (LLM batch parallel)")
-else:
-    text_summaries = []
-
 # ===========================================================================
 # TABELAS - DESCRIÇÕES LLM (BATCH ASYNC) - BEST PRACTICE!
 # ===========================================================================
@@ -885,7 +1190,9 @@ Tabela:
 
 Descrição (foque em: tema principal, estrutura, valores-chave, categorias):""")
 
-    table_chain = table_prompt | model | StrOutputParser()
+    table_chain = table_prompt | get_summary_model() | StrOutputParser()
+    cache = get_ingestion_cache()
+    version = PROMPT_VERSIONS["table_description"]
 
     for i in range(0, len(tables), batch_size):
         batch = tables[i:i+batch_size]
@@ -901,32 +1208,54 @@ Descrição (foque em: tema principal, estrutura, valores-chave, categorias):"""
                 content = str(table)[:2000]
             contents.append(content)
 
-        # Processar batch em paralelo
-        tasks = [table_chain.ainvoke({"table_content": c}) for c in contents]
-        try:
-            batch_descriptions = await asyncio.gather(*tasks)
-            all_descriptions.extend(batch_descriptions)
-        except Exception as e:
-            # Fallback: usar primeiros 500 chars em caso de erro
-            print(f"\n   ⚠️ Erro no batch de tabelas {i//batch_size + 1}: {str(e)[:80]}")
-            all_descriptions.extend([c[:500] for c in contents])
+        # Cache: só vão para o LLM as tabelas ainda não descritas
+        keys = [input_hash(c) for c in contents]
+        batch_descriptions = [cache.get("table_description", "gpt-4o-mini", version, k) for k in keys]
+        missing = [j for j, description in enumerate(batch_descriptions) if description is None]
+
+        # Processar batch em paralelo (cada item com suas próprias tentativas)
+        tasks = [limited_ainvoke_retry(table_chain, {"table_content": contents[j]}, "gpt-4o-mini",
+                                       estimate_tokens(contents[j], max_output=300))
+                 for j in missing]
+        for j, description in zip(missing, await asyncio.gather(*tasks, return_exceptions=True)):
+            if isinstance(description, BaseException):
+                # Fallback só deste item: usar primeiros 500 chars
+                print(f"\n   ⚠️ Erro na descrição da tabela {i + j + 1}: {str(description)[:80]}")
+                batch_descriptions[j] = contents[j][:500]
+            else:
+                batch_descriptions[j] = description
+                cache.set("table_description", "gpt-4o-mini", version, keys[j], description)
+        all_descriptions.extend(batch_descriptions)
 
         print(f"   Tabelas: {len(all_descriptions)}/{len(tables)}", end="\r")
 
     return all_descriptions
 
-# Executar
-if tables:
-    table_summaries = asyncio.run(describe_tables_batch(tables, batch_size=5))
-    print(f"   ✓ {len(table_summaries)} tabelas descritas (LLM batch parallel)")
-else:
-    table_summaries = []
-
 # ===========================================================================
 # IMAGENS - DESCRIÇÕES VISION (BATCH ASYNC)
 # ===========================================================================
-async def describe_images_batch(images, batch_size=3):
-    """Processar descrições de imagens via Vision API em batch paralelo"""
+def label_image_description(description, image_index):
+    """Adicionar número se GPT não incluiu o tipo/número da imagem"""
+    if not any(word in description[:50].upper() for word in ['FIGURA', 'FLUXOGRAMA', 'TABELA', 'GRÁFICO', 'DIAGRAMA']):
+        return f"[Imagem {image_index+1} do documento] {description}"
+    return description
+
+
+def unlabel_image_description(description):
+    """Remove o rótulo de label_image_description() (numeração é de cada documento)"""
+    import re
+    return re.sub(r"^\[Imagem \d+ do documento\] ", "", description)
+
+
+async def describe_images_batch(images, batch_size=3, start_index=0):
+    """
+    Processar descrições de imagens via Vision API em batch paralelo
+
+    Imagens idênticas a uma já descrita em qualquer documento do knowledge
+    base (índice de imagens) reaproveitam a descrição existente.
+
+    start_index: posição da primeira imagem no documento (numeração dos rótulos)
+    """
     import base64
 
     prompt_img = ChatPromptTemplate.from_messages([
@@ -947,12 +1276,17 @@ Então descreva:
 4. Contexto clínico se aplicável
 
 Seja detalhado e específico. SEMPRE responda em português."""},
-            {"type": "image_url", "image_url": {"url": "data:image/jpeg;base64,{image}"}},
+            {"type": "image_url", "image_url": {"url": "data:image/jpeg;base64,{image}", "detail": "{detail}"}},
         ])
     ])
     chain_img = prompt_img | ChatOpenAI(model="gpt-4o-mini") | StrOutputParser()
+    cache = get_ingestion_cache()
+    image_index = get_ingestion_image_index()
+    version = PROMPT_VERSIONS["image_description"]
 
-    all_descriptions = []
+    # Resultado por índice da imagem: descrição i sempre corresponde à imagem i
+    all_descriptions = [None] * len(images)
+    done = 0
 
     for i in range(0, len(images), batch_size):
         batch = images[i:i+batch_size]
@@ -966,174 +1300,211 @@ Seja detalhado e específico. SEMPRE responda em português."""},
                 size_kb = len(img) / 1024
                 if 1 < size_kb < 20000:
                     base64.b64decode(img[:100])  # Validar base64
+                    cached = cache.get("image_description", "gpt-4o-mini", version, input_hash(img))
+                    if cached is None:
+                        match = image_index.find_similar(img, prompt_version=version)
+                        if match:
+                            cached = match["description"]
+                            image_index.reused_descriptions += 1
+                    if cached is not None:
+                        all_descriptions[global_idx] = label_image_description(cached, start_index + global_idx)
+                        continue
                     valid_images.append(img)
                     valid_indices.append(global_idx)
                 else:
-                    all_descriptions.insert(global_idx, f"Imagem {global_idx+1}")
+                    all_descriptions[global_idx] = f"Imagem {start_index + global_idx + 1}"
             except:
-                all_descriptions.insert(global_idx, f"Imagem {global_idx+1} (erro de validação)")
+                all_descriptions[global_idx] = f"Imagem {start_index + global_idx + 1} (erro de validação)"
 
-        # Processar imagens válidas em paralelo
+        # Processar imagens válidas em paralelo (cada item com suas próprias tentativas)
         if valid_images:
-            tasks = [chain_img.ainvoke(img) for img in valid_images]
-            try:
-                batch_descriptions = await asyncio.gather(*tasks)
-
-                # Adicionar número se GPT não incluiu
-                for desc_idx, description in enumerate(batch_descriptions):
-                    if not any(word in description[:50].upper() for word in ['FIGURA', 'FLUXOGRAMA', 'TABELA', 'GRÁFICO', 'DIAGRAMA']):
-                        description = f"[Imagem {valid_indices[desc_idx]+1} do documento] {description}"
-                    all_descriptions.insert(valid_indices[desc_idx], description)
-            except Exception as e:
-                print(f"\n   ⚠️ Erro no batch de imagens {i//batch_size + 1}: {str(e)[:80]}")
-                for idx in valid_indices:
-                    all_descriptions.insert(idx, f"Imagem {idx+1} (erro: {str(e)[:50]})")
+            async def describe_one(img):
+                # Margens recortadas, orçamento de tiles e detail escolhido pelo conteúdo
+                vision_input = await asyncio.to_thread(optimize_for_vision, img)
+                return await limited_ainvoke_retry(
+                    chain_img, {"image": vision_input["image"], "detail": vision_input["detail"]},
+                    "gpt-4o-mini", estimate_tokens(images=1, max_output=600),
+                )
+
+            tasks = [describe_one(img) for img in valid_images]
+            batch_descriptions = await asyncio.gather(*tasks, return_exceptions=True)
+
+            for img, idx, description in zip(valid_images, valid_indices, batch_descriptions):
+                if isinstance(description, BaseException):
+                    # Fallback só desta imagem
+                    print(f"\n   ⚠️ Erro na descrição da imagem {start_index + idx + 1}: {str(description)[:80]}")
+                    all_descriptions[idx] = f"Imagem {start_index + idx + 1} (erro: {str(description)[:50]})"
+                else:
+                    cache.set("image_description", "gpt-4o-mini", version, input_hash(img), description)
+                    # Adicionar número se GPT não incluiu
+                    all_descriptions[idx] = label_image_description(description, start_index + idx)
 
-        print(f"   Imagens: {len(all_descriptions)}/{len(images)}", end="\r")
+        done += len(batch)
+        print(f"   Imagens: {done}/{len(images)}", end="\r")
 
     return all_descriptions
 
-# Executar
-if images:
-    image_summaries = asyncio.run(describe_images_batch(images, batch_size=3))
-    print(f"   ✓ {len(image_summaries)} imagens descritas (Vision batch parallel)\n")
-else:
-    image_summaries = []
 
-# ===========================================================================
-# EXTRAIR SCREENSHOTS DE TABELAS COMO IMAGENS SECUNDÁRIAS
-# ===========================================================================
-print("📸 Extraindo screenshots de tabelas como imagens secundárias...")
-
-# Primeiro, criar um mapa de chunks originais por índice para detectar texto próximo
-chunks_by_index = {i: chunk for i, chunk in enumerate(chunks)}
-
-table_screenshots = []
-table_screenshot_summaries = []
-
-for i, table in enumerate(tables):
-    # Verificar se tabela tem screenshot (image_base64)
-    if hasattr(table, 'metadata') and hasattr(table.metadata, 'image_base64'):
-        table_img = table.metadata.image_base64
-
-        if table_img and len(table_img) > 100:
-            # Converter para JPEG + AUTO-ROTATE tabelas verticais (garantir compatibilidade)
-            jpeg_img, success, rotation_deg = convert_image_to_jpeg_base64(table_img, auto_rotate=True)
-
-            if success:
-                # Adicionar screenshot à lista de imagens
-                table_screenshots.append(jpeg_img)
-
-                # Criar descrição baseada no conteúdo da tabela
-                page_num = table.metadata.page_number if hasattr(table.metadata, 'page_number') else '?'
-
-                # Pegar primeiros 200 chars do texto da tabela para contexto
-                table_preview = table.text[:200] if hasattr(table, 'text') else ''
-
-                # ✅ CAPTURAR TEXTO EXPLICATIVO PRÓXIMO À TABELA
-                # Verificar se há orig_elements (chunking by_title pode agrupar)
-                explanatory_text = ""
-                if hasattr(table, 'metadata') and hasattr(table.metadata, 'orig_elements'):
-                    # Procurar elementos de texto logo após a tabela
-                    orig_els = table.metadata.orig_elements
-                    if orig_els:
-                        # Encontrar índice da tabela nos orig_elements
-                        for idx, el in enumerate(orig_els):
-                            if "Table" in str(type(el).__name__):
-                                # Pegar próximos 1-2 elementos de texto após a tabela
-                                next_elements = orig_els[idx+1:idx+3]
-                                for next_el in next_elements:
-                                    if "Text" in str(type(next_el).__name__) or "NarrativeText" in str(type(next_el).__name__):
-                                        text_content = next_el.text if hasattr(next_el, 'text') else str(next_el)
-                                        # Verificar se é legenda/nota (texto curto e descritivo)
-                                        if 50 < len(text_content) < 500:  # Legendas geralmente têm 50-500 chars
-                                            explanatory_text += f" {text_content}"
-                                break
-
-                # Se não encontrou em orig_elements, tentar buscar nos chunks originais
-                # (buscar elementos logo após a tabela na sequência do PDF)
-                if not explanatory_text and hasattr(table, 'metadata'):
-                    # Tentar encontrar elementos adjacentes pela coordenada da página
-                    table_page = table.metadata.page_number if hasattr(table.metadata, 'page_number') else None
-                    if table_page:
-                        # Buscar chunks de texto da mesma página que vêm logo depois
-                        for chunk in chunks:
-                            if hasattr(chunk, 'metadata') and hasattr(chunk.metadata, 'page_number'):
-                                if chunk.metadata.page_number == table_page:
-                                    chunk_type = str(type(chunk).__name__)
-                                    if "Text" in chunk_type or "Narrative" in chunk_type:
-                                        text_content = chunk.text if hasattr(chunk, 'text') else str(chunk)
-                                        # Verificar se parece ser legenda (contém palavras-chave)
-                                        text_lower = text_content.lower()
-                                        if any(kw in text_lower for kw in ['fonte:', 'nota:', 'legenda:', 'adaptado', '*', '†']):
-                                            if 50 < len(text_content) < 500:
-                                                explanatory_text += f" {text_content}"
-                                                break
-
-                # Adicionar texto explicativo à descrição se encontrado
-                if explanatory_text:
-                    description = f"TABELA {i+1} (Página {page_num}): Screenshot da tabela. Conteúdo: {table_preview}... Nota explicativa: {explanatory_text[:200]}"
-                    # ✅ IMPORTANTE: Adicionar texto explicativo à tabela também (para OCR)
-                    if hasattr(table, 'text'):
-                        table.text = f"{table.text}\n\n[NOTA EXPLICATIVA]\n{explanatory_text}"
-                else:
-                    description = f"TABELA {i+1} (Página {page_num}): Screenshot da tabela. Conteúdo: {table_preview}..."
+def generate_summaries(texts, tables, images):
+    """
+    Gera resumos de textos, descrições de tabelas e descrições de imagens
 
-                table_screenshot_summaries.append(description)
+    Returns:
+        tuple: (text_summaries, table_summaries, image_summaries)
+    """
+    print("2️⃣  Gerando resumos (batch parallel processing)...")
 
-                rotation_msg = f" (rotacionada {rotation_deg}°)" if rotation_deg > 0 else ""
-                print(f"   ✓ Screenshot da tabela {i+1} extraído (página {page_num}){rotation_msg}{' + texto explicativo' if explanatory_text else ''}")
+    if texts:
+        text_summaries = asyncio.run(summarize_texts_batch(texts, batch_size=10))
+        print(f"   ✓ {len(text_summaries)} textos resumidos (LLM batch parallel)")
+    else:
+        text_summaries = []
 
-if table_screenshots:
-    print(f"   ✓ {len(table_screenshots)} screenshots de tabelas extraídos\n")
+    if tables:
+        table_summaries = asyncio.run(describe_tables_batch(tables, batch_size=5))
+        print(f"   ✓ {len(table_summaries)} tabelas descritas (LLM batch parallel)")
+    else:
+        table_summaries = []
 
-    # Adicionar screenshots às listas de imagens principais
-    images.extend(table_screenshots)
-    image_summaries.extend(table_screenshot_summaries)
+    if images:
+        image_summaries = asyncio.run(describe_images_batch(images, batch_size=3))
+        print(f"   ✓ {len(image_summaries)} imagens descritas (Vision batch parallel)\n")
+    else:
+        image_summaries = []
 
-    print(f"   📊 Total de imagens agora: {len(images)} (figuras + screenshots de tabelas)\n")
-else:
-    print(f"   ℹ️  Nenhuma tabela tinha screenshot disponível\n")
+    return text_summaries, table_summaries, image_summaries
 
 # ===========================================================================
-# INFERIR TIPO DE DOCUMENTO (necessário para Contextual Retrieval)
+# EXTRAIR SCREENSHOTS DE TABELAS COMO IMAGENS SECUNDÁRIAS
 # ===========================================================================
-document_type = infer_document_type(pdf_filename)
-print(f"   Tipo de documento detectado: {document_type}")
+def extract_table_screenshots(tables, chunks, index=None):
+    """
+    Extrai screenshots das tabelas como imagens secundárias
 
-# ===========================================================================
-# CONTEXTUAL RETRIEVAL (Anthropic) - Reduz failure rate em 49%
-# ===========================================================================
-print("\n2️⃣.5 Gerando contexto situacional dos chunks (Contextual Retrieval)...")
+    Também anexa notas explicativas encontradas perto da tabela ao texto da
+    própria tabela (para OCR). Legendas são buscadas só nos chunks da mesma
+    página (ElementIndex), não no documento inteiro para cada tabela.
 
-def add_contextual_prefix(chunk_text, chunk_index, chunk_type, pdf_metadata, section_name=None):
+    Returns:
+        tuple: (table_screenshots, table_screenshot_summaries)
     """
-    Gera contexto situacional para um chunk usando LLM.
+    print("📸 Extraindo screenshots de tabelas como imagens secundárias...")
 
-    Baseado em: Anthropic's Contextual Retrieval (2024)
-    - Reduz erros de retrieval em 67%
-    - Contextual Embeddings + BM25: -49% failure rate
+    table_screenshots = []
+    table_screenshot_summaries = []
+    index = index or ElementIndex(chunks)
 
-    Args:
-        chunk_text: Texto do chunk
-        chunk_index: Índice do chunk no documento
-        chunk_type: "text", "table", ou "image"
-        pdf_metadata: Dict com filename, document_type
-        section_name: Nome da seção (se disponível)
+    for i, table in enumerate(tables):
+        # Verificar se tabela tem screenshot (image_base64)
+        if hasattr(table, 'metadata') and hasattr(table.metadata, 'image_base64'):
+            table_img = table.metadata.image_base64
+
+            if table_img and len(table_img) > 100:
+                # Converter para JPEG + AUTO-ROTATE tabelas verticais (garantir compatibilidade)
+                # (mesma conversão já feita para o Vision em process_tables: vem do memo)
+                jpeg_img, success, rotation_deg = convert_image_cached(table_img, auto_rotate=True)
+
+                if success:
+                    # Adicionar screenshot à lista de imagens
+                    table_screenshots.append(jpeg_img)
+
+                    # Criar descrição baseada no conteúdo da tabela
+                    page_num = table.metadata.page_number if hasattr(table.metadata, 'page_number') else '?'
+
+                    # Pegar primeiros 200 chars do texto da tabela para contexto
+                    table_preview = table.text[:200] if hasattr(table, 'text') else ''
+
+                    # ✅ CAPTURAR TEXTO EXPLICATIVO PRÓXIMO À TABELA
+                    # Verificar se há orig_elements (chunking by_title pode agrupar)
+                    explanatory_text = ""
+                    if hasattr(table, 'metadata') and hasattr(table.metadata, 'orig_elements'):
+                        # Procurar elementos de texto logo após a tabela
+                        orig_els = table.metadata.orig_elements
+                        if orig_els:
+                            # Encontrar índice da tabela nos orig_elements
+                            for idx, el in enumerate(orig_els):
+                                if "Table" in str(type(el).__name__):
+                                    # Pegar próximos 1-2 elementos de texto após a tabela
+                                    next_elements = orig_els[idx+1:idx+3]
+                                    for next_el in next_elements:
+                                        if "Text" in str(type(next_el).__name__) or "NarrativeText" in str(type(next_el).__name__):
+                                            text_content = next_el.text if hasattr(next_el, 'text') else str(next_el)
+                                            # Verificar se é legenda/nota (texto curto e descritivo)
+                                            if 50 < len(text_content) < 500:  # Legendas geralmente têm 50-500 chars
+                                                explanatory_text += f" {text_content}"
+                                    break
+
+                    # Se não encontrou em orig_elements, tentar buscar nos chunks originais
+                    # (buscar elementos logo após a tabela na sequência do PDF)
+                    if not explanatory_text and hasattr(table, 'metadata'):
+                        # Tentar encontrar elementos adjacentes pela coordenada da página
+                        table_page = table.metadata.page_number if hasattr(table.metadata, 'page_number') else None
+                        if table_page:
+                            # Buscar chunks de texto da mesma página que vêm logo depois
+                            page_texts = index.on_page(table_page, lambda name: "Text" in name or "Narrative" in name)
+                            for chunk in page_texts:
+                                text_content = chunk.text if hasattr(chunk, 'text') else str(chunk)
+                                # Verificar se parece ser legenda (contém palavras-chave)
+                                text_lower = text_content.lower()
+                                if any(kw in text_lower for kw in ['fonte:', 'nota:', 'legenda:', 'adaptado', '*', '†']):
+                                    if 50 < len(text_content) < 500:
+                                        explanatory_text += f" {text_content}"
+                                        break
+
+                    # Adicionar texto explicativo à descrição se encontrado
+                    if explanatory_text:
+                        description = f"TABELA {i+1} (Página {page_num}): Screenshot da tabela. Conteúdo: {table_preview}... Nota explicativa: {explanatory_text[:200]}"
+                        # ✅ IMPORTANTE: Adicionar texto explicativo à tabela também (para OCR)
+                        if hasattr(table, 'text'):
+                            table.text = f"{table.text}\n\n[NOTA EXPLICATIVA]\n{explanatory_text}"
+                    else:
+                        description = f"TABELA {i+1} (Página {page_num}): Screenshot da tabela. Conteúdo: {table_preview}..."
 
-    Returns:
-        str: Chunk com contexto prepended
-    """
-    try:
-        # Construir prompt para geração de contexto
-        chunk_type_pt = {"text": "trecho de texto", "table": "tabela", "image": "imagem"}
-        type_display = chunk_type_pt.get(chunk_type, "elemento")
+                    table_screenshot_summaries.append(description)
 
-        section_info = f", seção '{section_name}'" if section_name else ""
+                    rotation_msg = f" (rotacionada {rotation_deg}°)" if rotation_deg > 0 else ""
+                    print(f"   ✓ Screenshot da tabela {i+1} extraído (página {page_num}){rotation_msg}{' + texto explicativo' if explanatory_text else ''}")
 
-        prompt = f"""Você é um assistente que gera contexto situacional para chunks de documentos médicos.
+    reset_transcode_memo()  # Último uso das conversões deste documento
 
-DOCUMENTO:
+    if table_screenshots:
+        print(f"   ✓ {len(table_screenshots)} screenshots de tabelas extraídos\n")
+    else:
+        print(f"   ℹ️  Nenhuma tabela tinha screenshot disponível\n")
+
+    return table_screenshots, table_screenshot_summaries
+
+# ===========================================================================
+# CONTEXTUAL RETRIEVAL (Anthropic) - Reduz failure rate em 49%
+# ===========================================================================
+# Quantas chamadas de contextualização ficam em voo ao mesmo tempo
+CONTEXT_CONCURRENCY = int(os.getenv("CONTEXT_CONCURRENCY", "8"))
+# Chunks por chamada de contextualização (1 = uma chamada por chunk)
+CONTEXT_BATCH_SIZE = max(1, int(os.getenv("CONTEXT_BATCH_SIZE", "1")))
+# Linhas do sumário do documento enviado no prefixo das chamadas em lote
+OUTLINE_MAX_ENTRIES = 60
+
+_context_model = None
+
+
+def get_context_model():
+    """Usar GPT-4o-mini para economia (contextualização não requer GPT-4o)"""
+    global _context_model
+    if _context_model is None:
+        _context_model = ChatOpenAI(model="gpt-4o-mini", temperature=0.2, max_tokens=100)
+    return _context_model
+
+
+def build_context_prompt(chunk_text, chunk_index, chunk_type, pdf_metadata, section_name=None):
+    """Monta o prompt de contexto situacional de um chunk"""
+    chunk_type_pt = {"text": "trecho de texto", "table": "tabela", "image": "imagem"}
+    type_display = chunk_type_pt.get(chunk_type, "elemento")
+
+    section_info = f", seção '{section_name}'" if section_name else ""
+
+    return f"""Você é um assistente que gera contexto situacional para chunks de documentos médicos.
+
+DOCUMENTO:
 - Arquivo: {pdf_metadata['filename']}
 - Tipo: {pdf_metadata['document_type']}
 
@@ -1155,619 +1526,2165 @@ EXEMPLO DE BOA CONTEXTUALIZAÇÃO:
 
 CONTEXTO:"""
 
-        # Usar GPT-4o-mini para economia (contextualização não requer GPT-4o)
-        context_model = ChatOpenAI(model="gpt-4o-mini", temperature=0.2, max_tokens=100)
-        context = context_model.invoke(prompt).content.strip()
 
-        # Retornar chunk contextualizado
-        contextualized = f"[CONTEXTO]\n{context}\n\n[CONTEÚDO]\n{chunk_text}"
+def add_contextual_prefix(chunk_text, chunk_index, chunk_type, pdf_metadata, section_name=None):
+    """
+    Gera contexto situacional para um chunk usando LLM.
 
-        return contextualized
+    Baseado em: Anthropic's Contextual Retrieval (2024)
+    - Reduz erros de retrieval em 67%
+    - Contextual Embeddings + BM25: -49% failure rate
+
+    Args:
+        chunk_text: Texto do chunk
+        chunk_index: Índice do chunk no documento
+        chunk_type: "text", "table", ou "image"
+        pdf_metadata: Dict com filename, document_type
+        section_name: Nome da seção (se disponível)
+
+    Returns:
+        str: Chunk com contexto prepended
+    """
+    try:
+        prompt = build_context_prompt(chunk_text, chunk_index, chunk_type, pdf_metadata, section_name)
+        cache = get_ingestion_cache()
+        key = input_hash(prompt)
+        context = cache.get("contextual_prefix", "gpt-4o-mini", PROMPT_VERSIONS["contextual_prefix"], key)
+        if context is None:
+            with get_ingestion_rate_limiter().guard("gpt-4o-mini", estimate_tokens(prompt, max_output=100)):
+                context = get_context_model().invoke(prompt).content.strip()
+            cache.set("contextual_prefix", "gpt-4o-mini", PROMPT_VERSIONS["contextual_prefix"], key, context)
+
+        # Retornar chunk contextualizado
+        return f"[CONTEXTO]\n{context}\n\n[CONTEÚDO]\n{chunk_text}"
 
     except Exception as e:
         # Se falhar, retornar chunk original
         print(f"      ⚠️  Erro ao gerar contexto para chunk {chunk_index}: {str(e)[:80]}")
         return chunk_text
 
-# Contextualizar textos
-print(f"   Contextualizando {len(texts)} chunks de texto...")
-contextualized_texts = []
-for i, text in enumerate(texts):
-    content = text.text if hasattr(text, 'text') else str(text)
-    section = extract_section_heading(text)
-
-    contextualized = add_contextual_prefix(
-        chunk_text=content,
-        chunk_index=i,
-        chunk_type="text",
-        pdf_metadata={"filename": pdf_filename, "document_type": document_type},
-        section_name=section
+
+async def add_contextual_prefix_async(chunk_text, chunk_index, chunk_type, pdf_metadata, section_name=None):
+    """Versão async de add_contextual_prefix() (mesmo prompt, mesmo fallback)"""
+    try:
+        prompt = build_context_prompt(chunk_text, chunk_index, chunk_type, pdf_metadata, section_name)
+        cache = get_ingestion_cache()
+        key = input_hash(prompt)
+        context = cache.get("contextual_prefix", "gpt-4o-mini", PROMPT_VERSIONS["contextual_prefix"], key)
+        if context is None:
+            response = await limited_ainvoke(get_context_model(), prompt, "gpt-4o-mini",
+                                             estimate_tokens(prompt, max_output=100))
+            context = response.content.strip()
+            cache.set("contextual_prefix", "gpt-4o-mini", PROMPT_VERSIONS["contextual_prefix"], key, context)
+        return f"[CONTEXTO]\n{context}\n\n[CONTEÚDO]\n{chunk_text}"
+
+    except Exception as e:
+        # Fallback por item: só este chunk fica sem contexto
+        print(f"\n      ⚠️  Erro ao gerar contexto para chunk {chunk_index}: {str(e)[:80]}")
+        return chunk_text
+
+
+def build_document_outline(texts, tables, max_entries=OUTLINE_MAX_ENTRIES):
+    """
+    Sumário do documento: página + seção/primeira linha de cada chunk
+
+    Vai UMA vez no prefixo das chamadas de contexto em lote, para o modelo
+    situar cada chunk no documento inteiro (não só pelo nome do arquivo).
+    """
+    entries = []
+    for label, items in (("Texto", texts), ("Tabela", tables)):
+        for i, item in enumerate(items):
+            content = item.text if hasattr(item, 'text') else str(item)
+            first_line = next((line.strip() for line in content.splitlines() if line.strip()), "")
+            heading = extract_section_heading(item) or first_line[:100]
+            if heading:
+                entries.append((element_page(item) or 0, f"{label} #{i + 1}", heading))
+
+    entries.sort(key=lambda entry: entry[0])
+    if len(entries) > max_entries:
+        # Amostra uniforme: o sumário cobre o documento todo com tamanho fixo
+        step = len(entries) / max_entries
+        entries = [entries[int(k * step)] for k in range(max_entries)]
+
+    return "\n".join(
+        f"- p.{page} {ref}: {heading}" if page else f"- {ref}: {heading}"
+        for page, ref, heading in entries
     )
 
-    contextualized_texts.append(contextualized)
-    print(f"   Textos: {i+1}/{len(texts)}", end="\r")
-    time.sleep(0.3)  # Rate limiting mais agressivo (GPT-4o-mini aguenta mais QPS)
 
-print(f"   ✓ {len(contextualized_texts)} textos contextualizados")
+_batch_context_model = None
 
-# Contextualizar tabelas
-contextualized_tables = []
-if tables:
-    print(f"   Contextualizando {len(tables)} tabelas...")
-    for i, table in enumerate(tables):
-        content = table.text if hasattr(table, 'text') else str(table)
-        section = extract_section_heading(table)
 
-        # Para tabelas, usar preview menor (tabelas são grandes)
-        contextualized = add_contextual_prefix(
-            chunk_text=content[:1000],  # Primeiros 1000 chars da tabela para contexto
-            chunk_index=i,
-            chunk_type="table",
-            pdf_metadata={"filename": pdf_filename, "document_type": document_type},
-            section_name=section
+def get_batch_context_model():
+    """GPT-4o-mini em modo JSON para contextos de vários chunks por chamada"""
+    global _batch_context_model
+    if _batch_context_model is None:
+        _batch_context_model = ChatOpenAI(
+            model="gpt-4o-mini", temperature=0.2, max_tokens=100 * CONTEXT_BATCH_SIZE + 50,
+            model_kwargs={"response_format": {"type": "json_object"}},
         )
+    return _batch_context_model
 
-        contextualized_tables.append(contextualized)
-        print(f"   Tabelas: {i+1}/{len(tables)}", end="\r")
-        time.sleep(0.3)
-
-    print(f"   ✓ {len(contextualized_tables)} tabelas contextualizadas")
-
-# Contextualizar imagens
-contextualized_images = []
-if image_summaries:
-    print(f"   Contextualizando {len(image_summaries)} imagens...")
-    for i, summary in enumerate(image_summaries):
-        # Para imagens, não há section heading detectável, usar None
-        contextualized = add_contextual_prefix(
-            chunk_text=summary,  # Descrição da imagem gerada por GPT-4o
-            chunk_index=i,
-            chunk_type="image",
-            pdf_metadata={"filename": pdf_filename, "document_type": document_type},
-            section_name=None  # Imagens geralmente não têm seção
-        )
 
-        contextualized_images.append(contextualized)
-        print(f"   Imagens: {i+1}/{len(image_summaries)}", end="\r")
-        time.sleep(0.3)
-
-    print(f"   ✓ {len(contextualized_images)} imagens contextualizadas")
-
-# ✅ METADATA ENRICHMENT: Pré-processar TODOS os metadados ANTES do loop de vectorstore
-# Isso evita travamento por rodar KeyBERT dentro do loop
-print(f"\n2️⃣.6 Enriquecendo metadados (KeyBERT + Medical NER + Numerical)...")
-
-enriched_texts_metadata = []
-if texts:
-    print(f"   Enriquecendo {len(texts)} textos...")
-    for i, text in enumerate(texts):
-        original_text = text.text if hasattr(text, 'text') else str(text)
-        enriched = enricher.enrich(original_text)
-        enriched_texts_metadata.append(enriched)
-        print(f"   Textos: {i+1}/{len(texts)}", end="\r")
-    print(f"   ✓ {len(enriched_texts_metadata)} textos enriquecidos")
-
-enriched_tables_metadata = []
-if tables:
-    print(f"   Enriquecendo {len(tables)} tabelas...")
-    for i, table in enumerate(tables):
-        original_table_text = table.text if hasattr(table, 'text') else str(table)
-        enriched = enricher.enrich(original_table_text)
-        enriched_tables_metadata.append(enriched)
-        print(f"   Tabelas: {i+1}/{len(tables)}", end="\r")
-    print(f"   ✓ {len(enriched_tables_metadata)} tabelas enriquecidas")
+def build_batch_context_prefix(pdf_metadata):
+    """
+    Prefixo ESTÁVEL das chamadas em lote (instruções + sumário do documento)
+
+    Idêntico em todas as chamadas do documento e enviado antes dos chunks:
+    o prompt caching do provedor reaproveita esses tokens entre as chamadas.
+    """
+    return f"""Você é um assistente que gera contexto situacional para chunks de documentos médicos.
+
+DOCUMENTO:
+- Arquivo: {pdf_metadata['filename']}
+- Tipo: {pdf_metadata['document_type']}
+
+SUMÁRIO DO DOCUMENTO:
+{pdf_metadata.get('outline') or '(indisponível)'}
+
+TAREFA:
+Para CADA chunk recebido, escreva 1-2 sentenças CONCISAS de contexto situando o chunk dentro do documento.
+
+INSTRUÇÕES:
+- Identifique: qual seção/tópico do documento (use o sumário)
+- Descreva: sobre o que é o chunk
+- Seja específico mas conciso (máximo 2 sentenças por chunk)
+- Use terminologia médica apropriada
+- NÃO repita o conteúdo do chunk, apenas CONTEXTUALIZE
+
+FORMATO DA RESPOSTA:
+Apenas um objeto JSON {{"contexts": [{{"id": <id do chunk>, "context": "<contexto>"}}]}}
+com exatamente um item para cada chunk recebido.
+
+EXEMPLO DE BOA CONTEXTUALIZAÇÃO:
+"Este trecho faz parte da seção de Estratificação de Risco Cardiovascular da Diretriz Brasileira de Diabetes 2025, especificamente sobre critérios de classificação de pacientes em risco muito alto."
+"""
+
+
+def build_batch_chunk_block(item):
+    """Bloco de um chunk na parte variável da chamada em lote (id = índice do chunk)"""
+    chunk_type_pt = {"text": "trecho de texto", "table": "tabela", "image": "imagem"}
+    type_display = chunk_type_pt.get(item["type"], "elemento")
+    section_info = f", seção '{item['section']}'" if item.get("section") else ""
+    return f"""CHUNK id={item['index']} ({type_display} #{item['index'] + 1}{section_info}):
+{item['text'][:800]}"""
+
+
+def parse_batch_contexts(content, expected_ids):
+    """
+    Separa a resposta em lote por chunk, validando ids e textos
+
+    Returns:
+        dict: id → contexto (só ids esperados com contexto não vazio)
+    """
+    try:
+        data = json.loads(content)
+    except (TypeError, ValueError):
+        return {}
+    entries = data.get("contexts") if isinstance(data, dict) else None
+    if not isinstance(entries, list):
+        return {}
+
+    contexts = {}
+    for entry in entries:
+        if not isinstance(entry, dict):
+            continue
+        try:
+            chunk_id = int(entry.get("id"))
+        except (TypeError, ValueError):
+            continue
+        context = entry.get("context")
+        if chunk_id in expected_ids and chunk_id not in contexts and isinstance(context, str) and context.strip():
+            contexts[chunk_id] = context.strip()
+    return contexts
+
+
+async def contextualize_multi(items, pdf_metadata, label, batch_size=None, concurrency=None):
+    """
+    Contextualiza vários chunks por chamada, com prefixo compartilhado
+
+    - Prefixo estável (instruções + sumário do documento) como system message
+    - Até CONTEXT_BATCH_SIZE chunks por chamada, resposta em JSON por id
+    - Chunks ausentes/inválidos na resposta: chamada individual (add_contextual_prefix_async)
+    - Cache por chunk: reprocessar não repete chunks já contextualizados
+
+    Returns:
+        list: Chunks contextualizados, na mesma ordem de items
+    """
+    batch_size = batch_size or CONTEXT_BATCH_SIZE
+    semaphore = asyncio.Semaphore(concurrency or CONTEXT_CONCURRENCY)
+    cache = get_ingestion_cache()
+    version = PROMPT_VERSIONS["contextual_prefix_batch"]
+    prefix = build_batch_context_prefix(pdf_metadata)
+    blocks = [build_batch_chunk_block(item) for item in items]
+    keys = [input_hash(prefix, block) for block in blocks]
+    results = [None] * len(items)
+    done = 0
+
+    def wrap(context, item):
+        return f"[CONTEXTO]\n{context}\n\n[CONTEÚDO]\n{item['text']}"
+
+    for k, item in enumerate(items):
+        context = cache.get("contextual_prefix_batch", "gpt-4o-mini", version, keys[k])
+        if context is not None:
+            results[k] = wrap(context, item)
+    missing = [k for k, result in enumerate(results) if result is None]
+
+    async def contextualize_group(group):
+        nonlocal done
+        expected = {items[k]["index"] for k in group}
+        body = "\n\n".join(blocks[k] for k in group)
+        messages = [SystemMessage(content=prefix), HumanMessage(content=body)]
+        contexts = {}
+        try:
+            async with semaphore:
+                response = await limited_ainvoke(get_batch_context_model(), messages, "gpt-4o-mini",
+                                                 estimate_tokens(prefix, body, max_output=100 * len(group)))
+            contexts = parse_batch_contexts(response.content, expected)
+        except Exception as e:
+            print(f"\n      ⚠️  Erro no lote de contexto ({label}): {str(e)[:80]}")
+
+        async def fallback(k):
+            # Fallback por item: chamada individual, no mesmo limite de concorrência dos lotes
+            item = items[k]
+            async with semaphore:
+                results[k] = await add_contextual_prefix_async(
+                    item["text"], item["index"], item["type"], pdf_metadata, item.get("section")
+                )
+
+        fallbacks = []
+        for k in group:
+            item = items[k]
+            context = contexts.get(item["index"])
+            if context is not None:
+                cache.set("contextual_prefix_batch", "gpt-4o-mini", version, keys[k], context)
+                results[k] = wrap(context, item)
+            else:
+                fallbacks.append(fallback(k))
+        await asyncio.gather(*fallbacks)
+        done += len(group)
+        print(f"   {label}: {done}/{len(missing)} (lotes de {batch_size})", end="\r")
+
+    groups = [missing[g:g + batch_size] for g in range(0, len(missing), batch_size)]
+    await asyncio.gather(*(contextualize_group(group) for group in groups))
+    return results
+
+
+async def contextualize_batch(items, pdf_metadata, label, concurrency=None):
+    """
+    Contextualiza uma lista de chunks com concorrência limitada
+
+    Args:
+        items: Lista de dicts {"text", "index", "type", "section"}
+        pdf_metadata: Dict com filename, document_type
+        label: Nome exibido no progresso ("Textos", "Tabelas", "Imagens")
+        concurrency: Chamadas simultâneas (padrão: CONTEXT_CONCURRENCY)
+
+    Returns:
+        list: Chunks contextualizados, na mesma ordem de items
+    """
+    if CONTEXT_BATCH_SIZE > 1:
+        # Vários chunks por chamada, com sumário do documento no prefixo
+        return await contextualize_multi(items, pdf_metadata, label, concurrency=concurrency)
+
+    semaphore = asyncio.Semaphore(concurrency or CONTEXT_CONCURRENCY)
+    done = 0
+
+    async def contextualize_one(item):
+        nonlocal done
+        async with semaphore:
+            result = await add_contextual_prefix_async(
+                chunk_text=item["text"],
+                chunk_index=item["index"],
+                chunk_type=item["type"],
+                pdf_metadata=pdf_metadata,
+                section_name=item.get("section"),
+            )
+        done += 1
+        print(f"   {label}: {done}/{len(items)}", end="\r")
+        return result
+
+    # gather preserva a ordem de items
+    return await asyncio.gather(*(contextualize_one(item) for item in items))
+
+
+def contextualize_chunks(texts, tables, image_summaries, pdf_filename, document_type, outline_texts=None):
+    """
+    Gera contexto situacional para textos, tabelas e imagens
+
+    Args:
+        outline_texts: Textos do documento para o sumário dos lotes (padrão:
+            `texts`; no modo fused os textos já vêm contextualizados e `texts`
+            fica vazio, mas o sumário precisa das seções deles)
+
+    Returns:
+        tuple: (contextualized_texts, contextualized_tables, contextualized_images)
+    """
+    print("\n2️⃣.5 Gerando contexto situacional dos chunks (Contextual Retrieval)...")
+    print(f"   Concorrência: {CONTEXT_CONCURRENCY} chamadas simultâneas")
+
+    pdf_metadata = {"filename": pdf_filename, "document_type": document_type}
+    if CONTEXT_BATCH_SIZE > 1:
+        pdf_metadata["outline"] = build_document_outline(texts if outline_texts is None else outline_texts, tables)
+        print(f"   Lotes de {CONTEXT_BATCH_SIZE} chunks por chamada (sumário do documento no prefixo)")
+
+    # Contextualizar textos
+    print(f"   Contextualizando {len(texts)} chunks de texto...")
+    text_items = [
+        {
+            "text": text.text if hasattr(text, 'text') else str(text),
+            "index": i,
+            "type": "text",
+            "section": extract_section_heading(text),
+        }
+        for i, text in enumerate(texts)
+    ]
+    contextualized_texts = asyncio.run(contextualize_batch(text_items, pdf_metadata, "Textos")) if text_items else []
+    print(f"   ✓ {len(contextualized_texts)} textos contextualizados")
+
+    # Contextualizar tabelas
+    contextualized_tables = []
+    if tables:
+        print(f"   Contextualizando {len(tables)} tabelas...")
+        table_items = [
+            {
+                # Para tabelas, usar preview menor (tabelas são grandes)
+                "text": (table.text if hasattr(table, 'text') else str(table))[:1000],
+                "index": i,
+                "type": "table",
+                "section": extract_section_heading(table),
+            }
+            for i, table in enumerate(tables)
+        ]
+        contextualized_tables = asyncio.run(contextualize_batch(table_items, pdf_metadata, "Tabelas"))
+        print(f"   ✓ {len(contextualized_tables)} tabelas contextualizadas")
+
+    # Contextualizar imagens
+    contextualized_images = []
+    if image_summaries:
+        print(f"   Contextualizando {len(image_summaries)} imagens...")
+        # Para imagens, não há section heading detectável
+        image_items = [
+            {"text": summary, "index": i, "type": "image", "section": None}
+            for i, summary in enumerate(image_summaries)
+        ]
+        contextualized_images = asyncio.run(contextualize_batch(image_items, pdf_metadata, "Imagens"))
+        print(f"   ✓ {len(contextualized_images)} imagens contextualizadas")
+
+    return list(contextualized_texts), list(contextualized_tables), list(contextualized_images)
 
-print()  # Linha em branco
 
 # ===========================================================================
-# ADICIONAR AO KNOWLEDGE BASE
+# ANOTAÇÃO ÚNICA: RESUMO + CONTEXTO + KEYWORDS EM UMA CHAMADA
 # ===========================================================================
-print("3️⃣  Adicionando ao knowledge base...")
+# separate = resumo e contexto em chamadas separadas + keywords do KeyBERT
+# fused = UMA chamada gpt-4o-mini por chunk de texto, JSON com os três
+ANNOTATION_MODE = os.getenv("ANNOTATION_MODE", "separate").strip().lower()
 
-import uuid
-from langchain_chroma import Chroma
-from langchain.storage import InMemoryStore
-from langchain.schema.document import Document
-from langchain_openai import OpenAIEmbeddings
-from langchain.retrievers.multi_vector import MultiVectorRetriever
-import pickle
-
-os.makedirs(persist_directory, exist_ok=True)
-
-vectorstore = Chroma(
-    collection_name="knowledge_base",
-    embedding_function=OpenAIEmbeddings(model="text-embedding-3-large"),  # Upgrade para melhor semântica
-    persist_directory=persist_directory
-)
-
-docstore_path = f"{persist_directory}/docstore.pkl"
-
-# ✅ CRÍTICO: Criar InMemoryStore e carregar dados ANTES de passar ao retriever
-store = InMemoryStore()
-if os.path.exists(docstore_path):
-    with open(docstore_path, 'rb') as f:
-        loaded_data = pickle.load(f)
-        # Garantir que carregamos no store.store (dict interno)
-        if isinstance(loaded_data, dict):
-            store.store = loaded_data
+FUSED_MAX_KEYWORDS = 8
+
+_annotation_model = None
+
+
+def get_annotation_model():
+    """GPT-4o-mini em modo JSON (resumo + contexto + keywords)"""
+    global _annotation_model
+    if _annotation_model is None:
+        _annotation_model = ChatOpenAI(
+            model="gpt-4o-mini", temperature=0.2, max_tokens=600,
+            model_kwargs={"response_format": {"type": "json_object"}},
+        )
+    return _annotation_model
+
+
+def build_fused_annotation_prompt(chunk_text, chunk_index, pdf_metadata, section_name=None):
+    """Monta o prompt da anotação única de um chunk de texto"""
+    section_info = f", seção '{section_name}'" if section_name else ""
+
+    return f"""Você é um assistente que anota chunks de documentos médicos para busca semântica.
+
+DOCUMENTO:
+- Arquivo: {pdf_metadata['filename']}
+- Tipo: {pdf_metadata['document_type']}
+
+CHUNK (trecho de texto #{chunk_index + 1}{section_info}):
+{chunk_text}
+
+TAREFA:
+Responda APENAS com um objeto JSON com as chaves:
+- "summary": resumo conciso do trecho
+- "context": 1-2 sentenças CONCISAS situando este trecho dentro do documento
+  (qual seção/tópico e sobre o que é; NÃO repita o conteúdo, apenas CONTEXTUALIZE)
+- "keywords": lista de até {FUSED_MAX_KEYWORDS} termos-chave do trecho (palavras ou expressões curtas)
+
+Use terminologia médica apropriada.
+
+EXEMPLO DE BOM CONTEXTO:
+"Este trecho faz parte da seção de Estratificação de Risco Cardiovascular da Diretriz Brasileira de Diabetes 2025, especificamente sobre critérios de classificação de pacientes em risco muito alto."
+"""
+
+
+def parse_fused_annotation(content):
+    """
+    JSON da anotação única → (summary, context, keywords)
+
+    Returns:
+        tuple ou None se a resposta não tiver resumo e contexto válidos
+    """
+    try:
+        data = json.loads(content)
+    except (TypeError, ValueError):
+        return None
+    if not isinstance(data, dict):
+        return None
+
+    summary, context = data.get("summary"), data.get("context")
+    if not isinstance(summary, str) or not summary.strip() or not isinstance(context, str) or not context.strip():
+        return None
+
+    keywords = data.get("keywords") or []
+    if isinstance(keywords, str):
+        keywords = keywords.split(",")
+    keywords = [k.strip() for k in keywords if isinstance(k, str) and k.strip()][:FUSED_MAX_KEYWORDS]
+    return summary.strip(), context.strip(), keywords
+
+
+async def annotate_texts_fused(texts, pdf_metadata, start_index=0, concurrency=None):
+    """
+    Resumo + contexto situacional + keywords de cada chunk de texto em UMA chamada
+
+    O texto do chunk entra no prompt uma vez só (antes: resumo e contexto cada
+    um com sua cópia). O chunk contextualizado tem o mesmo layout do modo
+    separado ([CONTEXTO] ... [CONTEÚDO] ...), então combined_content não muda.
+    Respostas sem JSON válido caem nas chamadas separadas, só para aquele chunk.
+
+    Returns:
+        tuple: (summaries, contextualized, keywords) na ordem de texts;
+            keywords é None nos chunks que caíram no fallback (ficam com KeyBERT)
+    """
+    cache = get_ingestion_cache()
+    version = PROMPT_VERSIONS["fused_annotation"]
+    semaphore = asyncio.Semaphore(concurrency or CONTEXT_CONCURRENCY)
+    done = 0
+
+    async def annotate_one(j, text):
+        nonlocal done
+        index = start_index + j
+        content = text.text if hasattr(text, 'text') else str(text)
+        section = extract_section_heading(text)
+        prompt = build_fused_annotation_prompt(content, index, pdf_metadata, section)
+        key = input_hash(prompt)
+
+        annotation = parse_fused_annotation(cache.get("fused_annotation", "gpt-4o-mini", version, key))
+        if annotation is None:
+            try:
+                async with semaphore:
+                    response = await limited_ainvoke(get_annotation_model(), prompt, "gpt-4o-mini",
+                                                     estimate_tokens(prompt, max_output=600))
+                annotation = parse_fused_annotation(response.content)
+                if annotation is not None:
+                    cache.set("fused_annotation", "gpt-4o-mini", version, key, response.content)
+            except Exception as e:
+                print(f"\n      ⚠️  Erro na anotação do chunk {index}: {str(e)[:80]}")
+
+        if annotation is None:
+            # Fallback por item: resumo e contexto em chamadas separadas
+            summary = (await summarize_texts_batch([text], batch_size=1))[0]
+            contextualized = await add_contextual_prefix_async(content, index, "text", pdf_metadata, section)
+            result = (summary, contextualized, None)
         else:
-            print(f"   ⚠️  Docstore carregado não é dict: {type(loaded_data)}")
-            store.store = {}
+            summary, context, keywords = annotation
+            result = (summary, f"[CONTEXTO]\n{context}\n\n[CONTEÚDO]\n{content}", keywords)
+
+        done += 1
+        print(f"   Textos (anotação única): {done}/{len(texts)}", end="\r")
+        return result
+
+    # gather preserva a ordem de texts
+    results = await asyncio.gather(*(annotate_one(j, text) for j, text in enumerate(texts)))
+    return [r[0] for r in results], [r[1] for r in results], [r[2] for r in results]
+
+
+def enrich_with_llm_keywords(enricher, contents, keywords_per_text):
+    """
+    Enriquecimento dos textos anotados no modo fused: keywords vêm do LLM
+    (sem passada do KeyBERT); entidades e medições continuam do enricher.
+    Chunks sem keywords do LLM (fallback) passam pelo KeyBERT normalmente.
+    """
+    with_keywords = [i for i, keywords in enumerate(keywords_per_text) if keywords is not None]
+    without_keywords = [i for i, keywords in enumerate(keywords_per_text) if keywords is None]
+
+    enriched = [None] * len(contents)
+    if with_keywords:
+        batch = enricher.enrich_batch([contents[i] for i in with_keywords], extract_keywords=False)
+        for i, item in zip(with_keywords, batch):
+            item["keywords"] = keywords_per_text[i]
+            item["keywords_str"] = ", ".join(keywords_per_text[i])
+            enriched[i] = item
+    if without_keywords:
+        for i, item in zip(without_keywords, enricher.enrich_batch([contents[i] for i in without_keywords])):
+            enriched[i] = item
+    return enriched
+
+
+def enrich_chunks(texts, tables, enricher, text_keywords=None):
+    """
+    Pré-processa TODOS os metadados enriquecidos ANTES da escrita no vectorstore
+
+    Args:
+        text_keywords: Keywords dos textos já geradas pela anotação única
+            (ANNOTATION_MODE=fused); nesse caso o KeyBERT só roda nas tabelas
+
+    Returns:
+        tuple: (enriched_texts_metadata, enriched_tables_metadata)
+    """
+    # ✅ METADATA ENRICHMENT: Pré-processar TODOS os metadados ANTES do loop de vectorstore
+    # Isso evita travamento por rodar KeyBERT dentro do loop
+    print(f"\n2️⃣.6 Enriquecendo metadados (KeyBERT + Medical NER + Numerical)...")
+
+    # ⚡ Textos e tabelas em UM batch: KeyBERT embeda chunks e candidatos em
+    # poucas chamadas grandes (candidatos compartilhados entre chunks)
+    if text_keywords is not None:
+        # Keywords dos textos já vieram do LLM: KeyBERT só para as tabelas
+        contents = [text.text if hasattr(text, 'text') else str(text) for text in texts]
+        enriched_texts_metadata = enrich_with_llm_keywords(enricher, contents, text_keywords) if texts else []
+        enriched_tables_metadata = enricher.enrich_batch([
+            table.text if hasattr(table, 'text') else str(table) for table in tables
+        ]) if tables else []
+    else:
+        items = list(texts) + list(tables)
+        if items:
+            print(f"   Enriquecendo {len(texts)} textos + {len(tables)} tabelas em batch...")
+        enriched_all = enricher.enrich_batch([
+            item.text if hasattr(item, 'text') else str(item) for item in items
+        ]) if items else []
+
+        enriched_texts_metadata = enriched_all[:len(texts)]
+        enriched_tables_metadata = enriched_all[len(texts):]
+    if texts:
+        print(f"   ✓ {len(enriched_texts_metadata)} textos enriquecidos")
+    if tables:
+        print(f"   ✓ {len(enriched_tables_metadata)} tabelas enriquecidas")
+
+    print()  # Linha em branco
+
+    return enriched_texts_metadata, enriched_tables_metadata
+
+
+def print_vision_input_stats():
+    """Tokens de imagem estimados economizados pelo vision_input no documento"""
+    stats = vision_stats()
+    if not stats["images"]:
+        return
+    saved_pct = 100 * stats["tokens_saved"] / stats["tokens_before"] if stats["tokens_before"] else 0
+    print(f"   🔭 Vision: {stats['images']} imagens, ~{stats['tokens_before']} → ~{stats['tokens_after']} "
+          f"tokens de imagem ({stats['tokens_saved']} economizados, {saved_pct:.0f}%)")
+    print(f"      ({stats['trimmed']} com margens recortadas, {stats['low_detail']} em detail low)\n")
+
+
+def print_llm_cache_stats():
+    """Hits/misses do cache LLM por stage (acumulados no processo)"""
+    cache_stats = get_ingestion_cache().stats()
+    if not cache_stats["stages"]:
+        return
+    print("   💾 Cache LLM/Vision:")
+    for stage, counters in sorted(cache_stats["stages"].items()):
+        print(f"      {stage}: {counters['hits']} hits, {counters['misses']} misses")
+    print(f"      ({cache_stats['entries']} entradas, {cache_stats['size_bytes'] / 1024 / 1024:.1f}MB)\n")
 
-retriever = MultiVectorRetriever(
-    vectorstore=vectorstore,
-    docstore=store,  # Passa store já carregado
-    id_key="doc_id",
-)
 
 # ===========================================================================
-# 🛡️ ROLLBACK PROTECTION: Rastrear chunks para deletar em caso de erro
+# PIPELINE: PREPARAR DOCUMENTO (etapas caras, sem tocar no knowledge base)
 # ===========================================================================
-chunk_ids = []  # Para tracking E rollback
-rollback_needed = False
-
-try:
-    # Adicionar com metadados
-    print(f"   Adicionando {len(text_summaries)} textos ao vectorstore...")
-    for i, summary in enumerate(text_summaries):
-        doc_id = str(uuid.uuid4())
-        chunk_ids.append(doc_id)
-    
-        # Extrair page_number se disponível
-        page_num = None
-        if hasattr(texts[i], 'metadata') and hasattr(texts[i].metadata, 'page_number'):
-            page_num = texts[i].metadata.page_number
-    
-        # Extrair section heading (contexto médico)
-        section = extract_section_heading(texts[i])
-    
-        # ✅ CONTEXTUAL RETRIEVAL: Usar chunk contextualizado para embedding
-        # Isso melhora retrieval em 49% segundo Anthropic
-        contextualized_chunk = contextualized_texts[i]
-    
-        # ✅ METADATA ENRICHMENT: Usar metadados pré-processados (muito mais rápido!)
-        enriched_metadata = enriched_texts_metadata[i] if i < len(enriched_texts_metadata) else {}
-    
-        # Print progresso
-        print(f"   Textos: {i+1}/{len(text_summaries)}", end="\r")
-    
-        # ✅ FASE 3: EMBEDDING DUPLO (resumo + original)
-        # Best practice: Embedar AMBOS para retrieval preciso + contexto rico
-        # Esperado ganho: +15-30% qualidade segundo pesquisas
-        original_text = texts[i].text if hasattr(texts[i], 'text') else str(texts[i])
-        combined_content = f"{contextualized_chunk}\n\n[RESUMO]\n{summary}\n\n[ORIGINAL]\n{original_text}"
-
-        # Preparar metadata (antes de limpar)
-        raw_metadata = {
-            "doc_id": doc_id,
-            "pdf_id": pdf_id,  # ✅ ID do PDF
-            "source": pdf_filename,
-            "filename": pdf_filename,  # ✅ CRÍTICO: Adicionar filename para evitar chunks órfãos
-            "type": "text",
-            "index": i,
-            "page_number": page_num,
-            "uploaded_at": uploaded_at,
-            "section": section,              # ✅ Seção do documento
-            "document_type": document_type,  # ✅ Tipo de documento
-            "summary": summary,              # ✅ Resumo separado
-
-            # ✅ METADADOS ENRIQUECIDOS (KeyBERT + Medical NER + Numerical)
-            # IMPORTANTE: ChromaDB não aceita listas em metadata, apenas str/int/float/bool
-            # Convertemos listas para strings separadas por vírgula
-            "keywords_str": enriched_metadata.get("keywords_str", ""),
-            "entities_diseases_str": ", ".join(enriched_metadata.get("entities_diseases", [])),
-            "entities_medications_str": ", ".join(enriched_metadata.get("entities_medications", [])),
-            "entities_procedures_str": ", ".join(enriched_metadata.get("entities_procedures", [])),
-            "has_medical_entities": enriched_metadata.get("has_medical_entities", False),
-            "measurements_count": len(enriched_metadata.get("measurements", [])),
-            "has_measurements": enriched_metadata.get("has_measurements", False),
-        }
+def extract_elements(file_path, pdf_filename):
+    """
+    Partition + separação de textos/tabelas/imagens + extração robusta de tabelas
 
-        # ✅ CRITICAL: Limpar metadados para ChromaDB 0.5.x (remove None values)
-        cleaned_metadata = clean_metadata_for_chromadb(raw_metadata)
+    Etapa comum ao pipeline em fases (prepare_document) e em streaming
+    (stream_document).
+
+    Returns:
+        dict: Documento parcial (pdf_id, chunks, texts, tables, images, ...)
+    """
+    pdf_id = generate_pdf_id(file_path)
+    file_size = os.path.getsize(file_path)
+    uploaded_at = time.strftime("%Y-%m-%d %H:%M:%S")
+    reset_transcode_memo()  # Conversões de imagem valem para um documento
+    reset_vision_stats()
+
+    chunks, strategy_used = partition_document(file_path)
+    texts, tables = split_elements(chunks)
+
+    images, filtered_count, total_images_found = get_images_base64(chunks)
+    duplicate_count = 0  # Já deduplicado na função
+
+    if os.getenv("DEBUG_IMAGES"):
+        print("\n   [DEBUG] Detalhes das imagens extraídas:")
+        for i, img in enumerate(images):
+            size_kb = len(img) / 1024
+            print(f"     Imagem {i+1}: {size_kb:.1f} KB")
+        print(f"   [DEBUG] Total encontrado: {total_images_found}")
+        print(f"   [DEBUG] Filtradas (muito pequenas): {filtered_count}")
+        print(f"   [DEBUG] Duplicatas removidas: {duplicate_count}")
+
+    print(f"   ✓ {len(texts)} textos, {len(tables)} tabelas, {len(images)} imagens")
+    emit_progress("partition", f"✓ {len(texts)} textos, {len(tables)} tabelas, {len(images)} imagens",
+                  texts=len(texts), tables=len(tables), images=len(images), strategy=strategy_used)
+    if filtered_count > 0:
+        min_size_threshold = float(os.getenv("MIN_IMAGE_SIZE_KB", "30"))
+        print(f"      (detectadas: {total_images_found}, filtradas: {filtered_count} imagens pequenas <{min_size_threshold:.0f}KB)")
+    print()
+
+    tables_quality_reports = process_tables(tables, pdf_filename)
+    if tables:
+        emit_progress("tables", f"✓ {len(tables)} tabelas extraídas", tables=len(tables))
+
+    return {
+        "pdf_id": pdf_id,
+        "pdf_filename": pdf_filename,
+        "file_path": file_path,
+        "file_size": file_size,
+        "uploaded_at": uploaded_at,
+        "strategy_used": strategy_used,
+        "chunks": chunks,
+        "texts": texts,
+        "tables": tables,
+        "images": images,
+        "filtered_count": filtered_count,
+        "tables_quality_reports": tables_quality_reports,
+    }
+
+
+def prepare_document(file_path, pdf_filename, enricher=None, checkpoint=None):
+    """
+    Executa todas as etapas de extração/LLM/enriquecimento de um PDF.
+
+    Não escreve nada no knowledge base: o resultado é um dict com tudo que
+    write_to_knowledge_base() precisa. Isso permite preparar vários PDFs em
+    processos paralelos e manter a escrita serializada em um único processo.
+
+    Args:
+        file_path: Caminho do PDF
+        pdf_filename: Nome do arquivo (usado como source)
+        enricher: MetadataEnricher já carregado (padrão: get_enricher())
+        checkpoint: Checkpoints do documento (open_checkpoint); etapas já
+            concluídas são carregadas em vez de reprocessadas
+
+    Returns:
+        dict: Documento preparado
+    """
+    if enricher is None:
+        enricher = get_enricher()
+    if checkpoint is None:
+        checkpoint = get_checkpoint(enabled=False)
+
+    if checkpoint.stage is not None:
+        prepared = checkpoint.load()
+        print(f"♻️  Retomando do checkpoint (etapa concluída: {checkpoint.stage})\n")
+        emit_progress("resume", f"♻️ Retomando do checkpoint (etapa concluída: {checkpoint.stage})",
+                      stage_done=checkpoint.stage)
+    else:
+        prepared = extract_elements(file_path, pdf_filename)
+        checkpoint.save("extract", prepared)
+
+    texts = prepared["texts"]
+    tables = prepared["tables"]
+    images = prepared["images"]
 
-        doc = Document(
-            page_content=combined_content,  # ✅ CONTEXTUALIZADO + RESUMO + ORIGINAL
-            metadata=cleaned_metadata
+    if not checkpoint.is_done("summaries"):
+        fused = ANNOTATION_MODE == "fused" and bool(texts)
+        text_summaries, table_summaries, image_summaries = generate_summaries(
+            [] if fused else texts, tables, images
         )
-        
-        # Adicionar source ao documento original
-        original = texts[i]
-        
-        # Criar metadata dict se não existir
-        if not hasattr(original, 'metadata'):
-            # Criar um objeto simples com metadata
-            class DocWithMetadata:
-                def __init__(self, text, metadata):
-                    self.text = text
-                    self.metadata = metadata
-            original = DocWithMetadata(original.text if hasattr(original, 'text') else str(original), {'source': pdf_filename})
-        elif isinstance(original.metadata, dict):
-            original.metadata['source'] = pdf_filename
-        else:
-            # ElementMetadata object
-            if not hasattr(original.metadata, 'source'):
-                original.metadata.source = pdf_filename
-        
-        # 🔥 CRITICAL FIX: Pass ids= to ensure vectorstore and docstore use SAME ID
-        retriever.vectorstore.add_documents([doc], ids=[doc_id])
-        retriever.docstore.mset([(doc_id, original)])
-
-    print(f"   ✓ {len(text_summaries)} textos adicionados")
-    
-    print(f"   Adicionando {len(table_summaries)} tabelas ao vectorstore...")
-    for i, summary in enumerate(table_summaries):
-        doc_id = str(uuid.uuid4())
-        chunk_ids.append(doc_id)
-    
-        # Extrair page_number se disponível
-        page_num = None
-        if hasattr(tables[i], 'metadata') and hasattr(tables[i].metadata, 'page_number'):
-            page_num = tables[i].metadata.page_number
-    
-        # Extrair section heading (tabelas geralmente têm context)
-        section = extract_section_heading(tables[i])
-    
-        # ✅ CONTEXTUAL RETRIEVAL: Usar tabela contextualizada
-        contextualized_table = contextualized_tables[i]
-    
-        # ✅ METADATA ENRICHMENT: Usar metadados pré-processados (muito mais rápido!)
-        enriched_table_metadata = enriched_tables_metadata[i] if i < len(enriched_tables_metadata) else {}
-    
-        # Print progresso
-        print(f"   Tabelas: {i+1}/{len(table_summaries)}", end="\r")
-    
-        # ✅ FASE 3: EMBEDDING DUPLO para tabelas (resumo + original + HTML)
-        # Best practice: Embedar AMBOS para retrieval preciso + contexto rico
-        original_table_text = tables[i].text if hasattr(tables[i], 'text') else str(tables[i])
-
-        # Se houver HTML da tabela, incluir também
-        table_html = ""
-        if hasattr(tables[i], 'metadata') and hasattr(tables[i].metadata, 'text_as_html'):
-            table_html = f"\n\n[HTML]\n{tables[i].metadata.text_as_html}"
-
-        # Combined content: contexto + resumo + original + HTML
-        combined_table_content = f"{contextualized_table}\n\n[RESUMO]\n{summary}\n\n[ORIGINAL]\n{original_table_text}{table_html}"
-
-        # Preparar metadata para tabelas (antes de limpar)
-        raw_table_metadata = {
-            "doc_id": doc_id,
-            "pdf_id": pdf_id,  # ✅ ID do PDF
-            "source": pdf_filename,
-            "filename": pdf_filename,  # ✅ CRÍTICO: Adicionar filename para evitar chunks órfãos
-            "type": "table",  # ✅ Tipo correto: tabela (frontend detecta image_base64 para exibição)
-            "index": i,
-            "page_number": page_num,
-            "uploaded_at": uploaded_at,
-            "section": section,              # ✅ Seção do documento
-            "document_type": document_type,  # ✅ Tipo de documento
-            "summary": summary,              # ✅ Resumo separado
-
-            # ✅ METADADOS ENRIQUECIDOS (tabelas são especialmente ricas!)
-            # IMPORTANTE: ChromaDB não aceita listas em metadata, apenas str/int/float/bool
-            "keywords_str": enriched_table_metadata.get("keywords_str", ""),
-            "entities_diseases_str": ", ".join(enriched_table_metadata.get("entities_diseases", [])),
-            "entities_medications_str": ", ".join(enriched_table_metadata.get("entities_medications", [])),
-            "entities_procedures_str": ", ".join(enriched_table_metadata.get("entities_procedures", [])),
-            "has_medical_entities": enriched_table_metadata.get("has_medical_entities", False),
-            "measurements_count": len(enriched_table_metadata.get("measurements", [])),
-            "has_measurements": enriched_table_metadata.get("has_measurements", False),
-        }
+        if fused:
+            # Resumo + contexto + keywords dos textos em UMA chamada por chunk
+            pdf_metadata = {"filename": pdf_filename, "document_type": infer_document_type(pdf_filename)}
+            text_summaries, fused_contextualized, fused_keywords = asyncio.run(
+                annotate_texts_fused(texts, pdf_metadata)
+            )
+            print(f"   ✓ {len(text_summaries)} textos anotados (resumo + contexto + keywords, 1 chamada/chunk)")
+            prepared.update({"fused_contextualized_texts": fused_contextualized, "text_keywords": fused_keywords})
+        emit_progress("summaries", "✓ Resumos gerados",
+                      texts=len(text_summaries), tables=len(table_summaries), images=len(image_summaries))
+
+        table_screenshots, table_screenshot_summaries = extract_table_screenshots(tables, prepared.pop("chunks"))
+        if table_screenshots:
+            # Adicionar screenshots às listas de imagens principais
+            images.extend(table_screenshots)
+            image_summaries.extend(table_screenshot_summaries)
+
+            print(f"   📊 Total de imagens agora: {len(images)} (figuras + screenshots de tabelas)\n")
+
+        # INFERIR TIPO DE DOCUMENTO (necessário para Contextual Retrieval)
+        document_type = infer_document_type(pdf_filename)
+        print(f"   Tipo de documento detectado: {document_type}")
+
+        prepared.update({
+            "document_type": document_type,
+            "table_screenshots_count": len(table_screenshots),
+            "text_summaries": text_summaries,
+            "table_summaries": table_summaries,
+            "image_summaries": image_summaries,
+        })
+        checkpoint.save("summaries", prepared)
+
+    if not checkpoint.is_done("context"):
+        fused_contextualized = prepared.get("fused_contextualized_texts")
+        contextualized_texts, contextualized_tables, contextualized_images = contextualize_chunks(
+            [] if fused_contextualized is not None else texts,
+            tables, prepared["image_summaries"], pdf_filename, prepared["document_type"],
+            outline_texts=texts,
+        )
+        if fused_contextualized is not None:
+            contextualized_texts = fused_contextualized
+        emit_progress("context", "✓ Contexto situacional gerado")
+        prepared.update({
+            "contextualized_texts": contextualized_texts,
+            "contextualized_tables": contextualized_tables,
+            "contextualized_images": contextualized_images,
+        })
+        checkpoint.save("context", prepared)
+
+    if not checkpoint.is_done("enrichment"):
+        enriched_texts_metadata, enriched_tables_metadata = enrich_chunks(
+            texts, tables, enricher, text_keywords=prepared.get("text_keywords")
+        )
+        emit_progress("enrichment", "✓ Metadados enriquecidos")
+        prepared.update({
+            "enriched_texts_metadata": enriched_texts_metadata,
+            "enriched_tables_metadata": enriched_tables_metadata,
+        })
+        checkpoint.save("enrichment", prepared)
+
+    print_vision_input_stats()
+    print_llm_cache_stats()
+    return prepared
+
+
+# ===========================================================================
+# REPROCESSAMENTO INCREMENTAL (diff de chunks)
+# ===========================================================================
+def chunk_fingerprint(doc):
+    """Fingerprint do chunk: tipo + conteúdo embedado (mudou → precisa re-embedar)"""
+    return input_hash(doc.metadata.get("type", ""), doc.page_content)
+
+
+def load_previous_chunks(vectorstore, previous_doc):
+    """
+    Carrega os fingerprints dos chunks gravados pela versão anterior
+
+    Returns:
+        dict: {doc_id: fingerprint}
+    """
+    chunk_ids = previous_doc.get("chunk_ids") or []
+    if chunk_ids:
+        results = vectorstore.get(ids=chunk_ids, include=["documents", "metadatas"])
+    else:
+        # Documentos antigos sem chunk_ids registrados
+        results = vectorstore.get(where={"pdf_id": previous_doc.get("pdf_id")}, include=["documents", "metadatas"])
+
+    previous_chunks = {}
+    for doc_id, content, meta in zip(results["ids"], results["documents"], results["metadatas"]):
+        meta = meta or {}
+        # Chunks gravados antes do content_hash: recalcular a partir do conteúdo
+        previous_chunks[doc_id] = meta.get("content_hash") or input_hash(meta.get("type", ""), content)
+    return previous_chunks
+
+
+# ===========================================================================
+# ADICIONAR AO KNOWLEDGE BASE
+# ===========================================================================
+class DocWithMetadata:
+    """Objeto simples com metadata para originais que não têm .metadata"""
+    def __init__(self, text, metadata):
+        self.text = text
+        self.metadata = metadata
+
+
+def attach_source(original, pdf_filename):
+    """Adicionar source ao elemento original que vai para o docstore"""
+    # Criar metadata dict se não existir
+    if not hasattr(original, 'metadata'):
+        return DocWithMetadata(original.text if hasattr(original, 'text') else str(original), {'source': pdf_filename})
+    elif isinstance(original.metadata, dict):
+        original.metadata['source'] = pdf_filename
+    else:
+        # ElementMetadata object
+        if not hasattr(original.metadata, 'source'):
+            original.metadata.source = pdf_filename
+    return original
+
+
+def enriched_metadata_fields(enriched_metadata):
+    """
+    Metadados enriquecidos (KeyBERT + Medical NER + Numerical) no formato do Chroma
+
+    IMPORTANTE: ChromaDB não aceita listas em metadata, apenas str/int/float/bool
+    Convertemos listas para strings separadas por vírgula
+    """
+    return {
+        "keywords_str": enriched_metadata.get("keywords_str", ""),
+        "entities_diseases_str": ", ".join(enriched_metadata.get("entities_diseases", [])),
+        "entities_medications_str": ", ".join(enriched_metadata.get("entities_medications", [])),
+        "entities_procedures_str": ", ".join(enriched_metadata.get("entities_procedures", [])),
+        "has_medical_entities": enriched_metadata.get("has_medical_entities", False),
+        "measurements_count": len(enriched_metadata.get("measurements", [])),
+        "has_measurements": enriched_metadata.get("has_measurements", False),
+        "enrichment_fallback": enriched_metadata.get("enrichment_fallback", False),
+    }
+
+
+def build_text_entry(doc_meta, i, text, summary, contextualized_chunk, enriched_metadata):
+    """
+    Monta (doc_id, Document, original) de um chunk de texto
+
+    Args:
+        doc_meta: Dict com pdf_id, pdf_filename, uploaded_at, document_type
+    """
+    from langchain.schema.document import Document
+
+    doc_id = str(uuid.uuid4())
+
+    # Extrair page_number se disponível
+    page_num = None
+    if hasattr(text, 'metadata') and hasattr(text.metadata, 'page_number'):
+        page_num = text.metadata.page_number
+
+    # ✅ FASE 3: EMBEDDING DUPLO (resumo + original)
+    # Best practice: Embedar AMBOS para retrieval preciso + contexto rico
+    # ✅ CONTEXTUAL RETRIEVAL: Usar chunk contextualizado para embedding
+    original_text = text.text if hasattr(text, 'text') else str(text)
+    combined_content = f"{contextualized_chunk}\n\n[RESUMO]\n{summary}\n\n[ORIGINAL]\n{original_text}"
+
+    # Preparar metadata (antes de limpar)
+    raw_metadata = {
+        "doc_id": doc_id,
+        "pdf_id": doc_meta["pdf_id"],  # ✅ ID do PDF
+        "source": doc_meta["pdf_filename"],
+        "filename": doc_meta["pdf_filename"],  # ✅ CRÍTICO: Adicionar filename para evitar chunks órfãos
+        "type": "text",
+        "index": i,
+        "page_number": page_num,
+        "uploaded_at": doc_meta["uploaded_at"],
+        "section": extract_section_heading(text),  # ✅ Seção do documento
+        "document_type": doc_meta["document_type"],  # ✅ Tipo de documento
+        "summary": summary,              # ✅ Resumo separado
+        **enriched_metadata_fields(enriched_metadata or {}),
+    }
 
+    doc = Document(
+        page_content=combined_content,  # ✅ CONTEXTUALIZADO + RESUMO + ORIGINAL
         # ✅ CRITICAL: Limpar metadados para ChromaDB 0.5.x (remove None values)
-        cleaned_table_metadata = clean_metadata_for_chromadb(raw_table_metadata)
+        metadata=clean_metadata_for_chromadb(raw_metadata)
+    )
+    return doc_id, doc, attach_source(text, doc_meta["pdf_filename"])
+
+
+def build_table_entry(doc_meta, i, table, summary, contextualized_table, enriched_metadata):
+    """Monta (doc_id, Document, original) de uma tabela"""
+    from langchain.schema.document import Document
+
+    doc_id = str(uuid.uuid4())
+
+    # Extrair page_number se disponível
+    page_num = None
+    if hasattr(table, 'metadata') and hasattr(table.metadata, 'page_number'):
+        page_num = table.metadata.page_number
+
+    # ✅ FASE 3: EMBEDDING DUPLO para tabelas (resumo + original + HTML)
+    original_table_text = table.text if hasattr(table, 'text') else str(table)
+
+    # Se houver HTML da tabela, incluir também
+    table_html = ""
+    if hasattr(table, 'metadata') and hasattr(table.metadata, 'text_as_html'):
+        table_html = f"\n\n[HTML]\n{table.metadata.text_as_html}"
+
+    # Combined content: contexto + resumo + original + HTML
+    combined_table_content = f"{contextualized_table}\n\n[RESUMO]\n{summary}\n\n[ORIGINAL]\n{original_table_text}{table_html}"
+
+    # Preparar metadata para tabelas (antes de limpar)
+    raw_table_metadata = {
+        "doc_id": doc_id,
+        "pdf_id": doc_meta["pdf_id"],  # ✅ ID do PDF
+        "source": doc_meta["pdf_filename"],
+        "filename": doc_meta["pdf_filename"],  # ✅ CRÍTICO: Adicionar filename para evitar chunks órfãos
+        "type": "table",  # ✅ Tipo correto: tabela (frontend detecta image_base64 para exibição)
+        "index": i,
+        "page_number": page_num,
+        "uploaded_at": doc_meta["uploaded_at"],
+        "section": extract_section_heading(table),  # ✅ Seção do documento
+        "document_type": doc_meta["document_type"],  # ✅ Tipo de documento
+        "summary": summary,              # ✅ Resumo separado
+        # ✅ METADADOS ENRIQUECIDOS (tabelas são especialmente ricas!)
+        **enriched_metadata_fields(enriched_metadata or {}),
+    }
 
-        doc = Document(
-            page_content=combined_table_content,  # ✅ CONTEXTUALIZADO + RESUMO + ORIGINAL + HTML
-            metadata=cleaned_table_metadata
-        )
-        
-        # Adicionar source à tabela original
-        original = tables[i]
-        
-        # Criar metadata dict se não existir
-        if not hasattr(original, 'metadata'):
-            # Criar um objeto simples com metadata
-            class DocWithMetadata:
-                def __init__(self, text, metadata):
-                    self.text = text
-                    self.metadata = metadata
-            original = DocWithMetadata(original.text if hasattr(original, 'text') else str(original), {'source': pdf_filename})
-        elif isinstance(original.metadata, dict):
-            original.metadata['source'] = pdf_filename
-        else:
-            # ElementMetadata object
-            if not hasattr(original.metadata, 'source'):
-                original.metadata.source = pdf_filename
-        
-        # 🔥 CRITICAL FIX: Pass ids= to ensure vectorstore and docstore use SAME ID
-        retriever.vectorstore.add_documents([doc], ids=[doc_id])
-        retriever.docstore.mset([(doc_id, original)])
-
-    print(f"   ✓ {len(table_summaries)} tabelas adicionadas")
-    
-    print(f"   Adicionando {len(image_summaries)} imagens ao vectorstore...")
-    for i, summary in enumerate(image_summaries):
-        doc_id = str(uuid.uuid4())
-        chunk_ids.append(doc_id)
-    
-        # Print progresso
-        print(f"   Imagens: {i+1}/{len(image_summaries)}", end="\r")
-    
+    doc = Document(
+        page_content=combined_table_content,  # ✅ CONTEXTUALIZADO + RESUMO + ORIGINAL + HTML
+        metadata=clean_metadata_for_chromadb(raw_table_metadata)
+    )
+    return doc_id, doc, attach_source(table, doc_meta["pdf_filename"])
+
+
+def build_image_entry(doc_meta, i, image, summary, contextualized_chunk):
+    """Monta (doc_id, Document, imagem base64) de uma imagem"""
+    from langchain.schema.document import Document
+
+    doc_id = str(uuid.uuid4())
+
+    # Preparar metadata para imagens (antes de limpar)
+    raw_image_metadata = {
+        "doc_id": doc_id,
+        "pdf_id": doc_meta["pdf_id"],  # ✅ ID do PDF
+        "source": doc_meta["pdf_filename"],
+        "filename": doc_meta["pdf_filename"],  # ✅ CRÍTICO: Adicionar filename para evitar chunks órfãos
+        "type": "image",
+        "index": i,
+        "page_number": None,  # Imagens geralmente não têm page_number
+        "uploaded_at": doc_meta["uploaded_at"],
+        "section": None,                 # Imagens geralmente não têm seção detectável
+        "document_type": doc_meta["document_type"],
+        "summary": summary[:500],  # Primeiros 500 chars do summary original (útil para debug)
+    }
+
+    doc = Document(
         # ✅ CONTEXTUAL RETRIEVAL: Usar imagem contextualizada para embedding
-        # Isso melhora retrieval de imagens médicas em ~49% segundo Anthropic
-        contextualized_chunk = contextualized_images[i] if i < len(contextualized_images) else summary
-    
-        # Preparar metadata para imagens (antes de limpar)
-        raw_image_metadata = {
-            "doc_id": doc_id,
-            "pdf_id": pdf_id,  # ✅ ID do PDF
-            "source": pdf_filename,
-            "filename": pdf_filename,  # ✅ CRÍTICO: Adicionar filename para evitar chunks órfãos
-            "type": "image",
-            "index": i,
-            "page_number": None,  # Imagens geralmente não têm page_number
-            "uploaded_at": uploaded_at,
-            "section": None,                 # Imagens geralmente não têm seção detectável
-            "document_type": document_type,  # ✅ NOVO: Tipo de documento
-            # ✅ NOVO: Adicionar summary original como metadata (útil para debug)
-            "summary": summary[:500],  # Primeiros 500 chars do summary original
-        }
+        page_content=contextualized_chunk if contextualized_chunk is not None else summary,
+        metadata=clean_metadata_for_chromadb(raw_image_metadata)
+    )
+    # Salvar imagem original no docstore (base64)
+    return doc_id, doc, image
 
-        # ✅ CRITICAL: Limpar metadados para ChromaDB 0.5.x (remove None values)
-        cleaned_image_metadata = clean_metadata_for_chromadb(raw_image_metadata)
 
-        doc = Document(
-            page_content=contextualized_chunk,  # ✅ Usar versão contextualizada
-            metadata=cleaned_image_metadata
+class KnowledgeBaseWriter:
+    """
+    Escrita de um documento no vectorstore (Chroma) + docstore + metadata.pkl
+
+    Os chunks podem chegar todos de uma vez (write_to_knowledge_base) ou em
+    lotes conforme ficam prontos (pipeline em streaming). Só commit() registra
+    o documento em metadata.pkl; rollback() remove tudo que foi adicionado.
+
+    Uso:
+        writer = KnowledgeBaseWriter(persist_directory, previous_doc)
+        writer.write(entries)   # quantas vezes for preciso
+        doc_info = writer.commit(prepared)
+    """
+
+    def __init__(self, persist_directory, previous_doc=None):
+        from langchain_chroma import Chroma
+        from langchain.storage import InMemoryStore
+        from langchain.retrievers.multi_vector import MultiVectorRetriever
+        from embedding_cache import get_cached_embeddings
+        import pickle
+
+        os.makedirs(persist_directory, exist_ok=True)
+        self.persist_directory = persist_directory
+        self.previous_doc = previous_doc
+
+        self.embeddings = get_cached_embeddings(persist_directory, model="text-embedding-3-large", chunk_size=WRITE_BATCH_SIZE)
+        self.vectorstore = Chroma(
+            collection_name="knowledge_base",
+            # Upgrade para melhor semântica; chunk_size agrupa os textos de cada lote em poucos requests
+            # Cache por conteúdo: chunks idênticos de reprocessamentos não são re-embedados
+            embedding_function=self.embeddings,
+            persist_directory=persist_directory
+        )
+
+        self.docstore_path = f"{persist_directory}/docstore.pkl"
+
+        # ✅ CRÍTICO: Criar InMemoryStore e carregar dados ANTES de passar ao retriever
+        store = InMemoryStore()
+        if os.path.exists(self.docstore_path):
+            with open(self.docstore_path, 'rb') as f:
+                loaded_data = pickle.load(f)
+                # Garantir que carregamos no store.store (dict interno)
+                if isinstance(loaded_data, dict):
+                    store.store = loaded_data
+                else:
+                    print(f"   ⚠️  Docstore carregado não é dict: {type(loaded_data)}")
+                    store.store = {}
+
+        self.retriever = MultiVectorRetriever(
+            vectorstore=self.vectorstore,
+            docstore=store,  # Passa store já carregado
+            id_key="doc_id",
         )
-    
-        # Salvar imagem original no docstore (base64)
-        print(f"      🖼️  Salvando imagem {i+1}/{len(image_summaries)}: doc_id={doc_id}, type={doc.metadata.get('type')}")
-        # 🔥 CRITICAL FIX: Pass ids= to ensure vectorstore and docstore use SAME ID
-        retriever.vectorstore.add_documents([doc], ids=[doc_id])
-        print(f"         ✓ Imagem adicionada ao vectorstore")
-        retriever.docstore.mset([(doc_id, images[i])])
-        print(f"         ✓ Imagem adicionada ao docstore")
-
-    print(f"   ✓ {len(image_summaries)} imagens adicionadas com sucesso")
-    
-    # Salvar
-    print(f"   Salvando docstore...")
-    print(f"   DEBUG: retriever.docstore id = {id(retriever.docstore)}")
-    print(f"   DEBUG: store id = {id(store)}")
-    print(f"   DEBUG: São o mesmo objeto? {retriever.docstore is store}")
-    print(f"   DEBUG: retriever.docstore.store tem {len(retriever.docstore.store)} itens")
-    print(f"   DEBUG: store.store tem {len(store.store)} itens")
-
-    with open(docstore_path, 'wb') as f:
-        # ✅ CRÍTICO: Salvar retriever.docstore.store (não store.store)
-        # retriever.docstore é o que foi atualizado por mset()
-        data_to_save = dict(retriever.docstore.store)
-        pickle.dump(data_to_save, f)
-        print(f"   DEBUG: Salvando {len(data_to_save)} itens no pickle")
-
-    # 🔥 FORCE CACHE INVALIDATION: Atualizar mtime explicitamente
-    import time
-    os.utime(docstore_path, (time.time(), time.time()))
-    print(f"   🔄 Mtime atualizado para forçar invalidação de cache")
-
-    # Verificar que foi salvo
-    file_size = os.path.getsize(docstore_path)
-    print(f"   ✓ Docstore salvo ({len(retriever.docstore.store)} itens, {file_size} bytes)")
-
-    # Metadados
+
+        # =======================================================================
+        # 🛡️ ROLLBACK PROTECTION: Rastrear chunks para deletar em caso de erro
+        # =======================================================================
+        self.chunk_ids = []  # Para tracking E rollback (apenas chunks NOVOS)
+        self.kept_ids = []   # Incremental: chunks reaproveitados da versão anterior
+        self.pending_keep = []  # Incremental: (doc_id, Document, original) atualizados no commit
+        self.available = {}  # Incremental: fingerprint → [doc_ids antigos ainda sem par]
+        self.previous_count = 0
+
+        # Índice perceptual global: imagens registradas só no commit
+        self.image_index = get_image_index(persist_directory)
+        self.written_images = []  # (doc_id, base64, descrição)
+
+        if previous_doc:
+            previous_chunks = load_previous_chunks(self.vectorstore, previous_doc)
+            self.previous_count = len(previous_chunks)
+            for doc_id, fingerprint in previous_chunks.items():
+                self.available.setdefault(fingerprint, []).append(doc_id)
+
+    def write(self, entries):
+        """
+        Grava uma leva de (doc_id, Document, original)
+
+        Com previous_doc, chunks com fingerprint idêntico a um chunk anterior
+        herdam o doc_id antigo e só têm os metadados atualizados, no commit().
+
+        Imagens (e metadata.image_base64 de tabelas/elementos) vão para o blob
+        store; o docstore guarda só a referência. Imagens idênticas a uma já
+        armazenada reaproveitam o blob existente.
+        """
+        to_add, to_keep = [], []
+        for doc_id, doc, original in entries:
+            doc.metadata["content_hash"] = chunk_fingerprint(doc)
+            matches = self.available.get(doc.metadata["content_hash"])
+            if matches:
+                old_id = matches.pop()
+                doc.metadata["doc_id"] = old_id
+                to_keep.append((old_id, doc, original))
+            else:
+                to_add.append((doc_id, doc, original))
+
+        for doc_id, doc, original in to_add + to_keep:
+            if doc.metadata.get("type") == "image" and isinstance(original, str) and not is_blob_ref(original):
+                description = doc.page_content.split("[CONTEÚDO]\n", 1)[-1]
+                self.written_images.append((doc_id, original, unlabel_image_description(description)))
+
+        # 🗄️ Bytes das imagens no blob store, referências no docstore
+        to_add = [(doc_id, doc, self._store_original(doc, original)) for doc_id, doc, original in to_add]
+        to_keep = [(doc_id, doc, self._store_original(doc, original, reuse=False)) for doc_id, doc, original in to_keep]
+
+        # ✅ ESCRITA EM LOTES: 1 request de embeddings + 1 transação Chroma por lote
+        # chunk_ids recebe os IDs ANTES de cada lote → rollback cobre lotes parciais
+        for start in range(0, len(to_add), WRITE_BATCH_SIZE):
+            batch = to_add[start:start + WRITE_BATCH_SIZE]
+            batch_ids = [doc_id for doc_id, _, _ in batch]
+            self.chunk_ids.extend(batch_ids)
+
+            # 🔥 CRITICAL FIX: Pass ids= to ensure vectorstore and docstore use SAME ID
+            self.retriever.vectorstore.add_documents([doc for _, doc, _ in batch], ids=batch_ids)
+            self.retriever.docstore.mset([(doc_id, original) for doc_id, _, original in batch])
+
+        # Chunks inalterados: metadados (index, pdf_id, uploaded_at...) só no commit,
+        # para um erro ou kill no meio não deixar a versão anterior com o pdf_id novo
+        self.pending_keep.extend(to_keep)
+        self.kept_ids.extend(doc_id for doc_id, _, _ in to_keep)
+
+        return len(to_add), len(to_keep)
+
+    def _update_kept(self):
+        """Aplica os metadados novos aos chunks reaproveitados (chamado no commit)"""
+        for start in range(0, len(self.pending_keep), WRITE_BATCH_SIZE):
+            batch = self.pending_keep[start:start + WRITE_BATCH_SIZE]
+            self.vectorstore._collection.update(
+                ids=[doc_id for doc_id, _, _ in batch],
+                metadatas=[doc.metadata for _, doc, _ in batch],
+            )
+        self.retriever.docstore.mset([(doc_id, original) for doc_id, _, original in self.pending_keep])
+        self.pending_keep = []
+
+    def _store_original(self, doc, original, reuse=True):
+        """Valor que vai para o docstore: referência de blob no lugar do base64"""
+        if doc.metadata.get("type") == "image" and isinstance(original, str):
+            if reuse:
+                original = self._reuse_image_blob(original, doc) or original
+            return put_base64(self.persist_directory, original)
+        return externalize_element_images(self.persist_directory, original)
+
+    def _reuse_image_blob(self, image_b64, doc):
+        """Imagem idêntica a uma já no docstore: valor armazenado dela (ou None)"""
+        store = self.retriever.docstore.store
+        match = self.image_index.find_similar(image_b64, exists=lambda doc_id: isinstance(store.get(doc_id), str))
+        if not match:
+            return None
+
+        # Mesma referência de blob: os bytes da imagem ficam gravados uma vez só
+        doc.metadata["duplicate_of"] = match["doc_id"]
+        self.image_index.reused_blobs += 1
+        return store[match["doc_id"]]
+
+    def save_docstore(self):
+        """Persiste docstore.pkl (torna os chunks já gravados consultáveis pela API)"""
+        import pickle
+
+        with open(self.docstore_path, 'wb') as f:
+            # ✅ CRÍTICO: Salvar retriever.docstore.store (não store.store)
+            # retriever.docstore é o que foi atualizado por mset()
+            pickle.dump(dict(self.retriever.docstore.store), f)
+
+        # 🔥 FORCE CACHE INVALIDATION: Atualizar mtime explicitamente
+        os.utime(self.docstore_path, (time.time(), time.time()))
+
+    def commit(self, prepared):
+        """
+        Remove chunks obsoletos, salva docstore + metadata.pkl e registra o documento
+
+        Returns:
+            dict: doc_info registrado em metadata.pkl
+        """
+        import pickle
+
+        pdf_id = prepared["pdf_id"]
+        stale_ids = [doc_id for ids in self.available.values() for doc_id in ids]
+
+        if self.previous_doc:
+            print(f"   🔁 Incremental: {len(self.kept_ids)} inalterados, {len(self.chunk_ids)} novos/alterados, "
+                  f"{len(stale_ids)} obsoletos (de {self.previous_count} anteriores)")
+
+        self._update_kept()
+
+        if stale_ids:
+            # Por último: até aqui a versão anterior continuava completa
+            self.vectorstore.delete(ids=stale_ids)
+            self.retriever.docstore.mdelete(stale_ids)
+            self.image_index.remove(stale_ids)
+            print(f"   ✓ {len(stale_ids)} chunks obsoletos removidos")
+
+        if hasattr(self.embeddings, "stats"):
+            cache_stats = self.embeddings.stats()
+            print(f"   💾 Embedding cache: {cache_stats['hits']} hits, {cache_stats['misses']} embedados "
+                  f"({cache_stats['entries']} entradas, {cache_stats['size_bytes'] / 1024 / 1024:.1f}MB)")
+
+        # Salvar
+        print(f"   Salvando docstore...")
+        self.save_docstore()
+        docstore_size = os.path.getsize(self.docstore_path)
+        print(f"   ✓ Docstore salvo ({len(self.retriever.docstore.store)} itens, {docstore_size} bytes)")
+
+        removed_blobs = collect_garbage(self.persist_directory, self.retriever.docstore.store.values())
+        if removed_blobs:
+            print(f"   ✓ {removed_blobs} blobs de imagem sem referência removidos")
+
+        # Metadados
+        metadata_path = f"{self.persist_directory}/metadata.pkl"
+        metadata = {}
+        if os.path.exists(metadata_path):
+            with open(metadata_path, 'rb') as f:
+                metadata = pickle.load(f)
+
+        if 'documents' not in metadata:
+            metadata['documents'] = {}
+
+        processed_at = time.strftime("%Y-%m-%d %H:%M:%S")
+        all_chunk_ids = self.kept_ids + self.chunk_ids
+
+        # Informações do documento
+        doc_info = {
+            "pdf_id": pdf_id,
+            "filename": prepared["pdf_filename"],
+            "original_filename": os.path.basename(prepared["file_path"]),
+            "file_size": prepared["file_size"],
+            "hash": pdf_id,
+            "uploaded_at": prepared["uploaded_at"],
+            "processed_at": processed_at,
+            "stats": {
+                "texts": len(prepared["texts"]),
+                "tables": len(prepared["tables"]),
+                "images": len(prepared["images"]),
+                "total_chunks": len(all_chunk_ids)
+            },
+            "chunk_ids": all_chunk_ids,
+            "incremental": {
+                "kept": len(self.kept_ids),
+                "added": len(self.chunk_ids),
+                "removed": len(stale_ids),
+            } if self.previous_doc else None,
+            "status": "processed",
+            "error": None
+        }
+
+        # Atualizar ou adicionar
+        print(f"   Salvando metadados do documento...")
+        metadata['documents'][pdf_id] = doc_info
+        if self.previous_doc and self.previous_doc.get('pdf_id') != pdf_id:
+            # Nova edição (conteúdo diferente → pdf_id diferente) substitui a anterior
+            metadata['documents'].pop(self.previous_doc.get('pdf_id'), None)
+
+        with open(metadata_path, 'wb') as f:
+            pickle.dump(metadata, f)
+
+        print(f"   ✓ Metadados salvos")
+
+        # Imagens deste documento passam a servir de referência para os próximos
+        image_version = PROMPT_VERSIONS["image_description"]
+        for doc_id, image_b64, description in self.written_images:
+            self.image_index.add(doc_id, pdf_id, image_b64, description, image_version)
+        if self.written_images:
+            index_stats = self.image_index.stats()
+            print(f"   🖼️  Índice de imagens: {index_stats['entries']} imagens "
+                  f"({index_stats['reused_descriptions']} descrições e {index_stats['reused_blobs']} blobs reaproveitados)")
+
+        # 🔥 CRITICAL: Force ChromaDB persistence (0.5.x may not auto-persist)
+        print(f"   💾 Forçando persistência do ChromaDB...")
+        try:
+            # ChromaDB 0.5.x requires explicit persist call
+            if hasattr(self.retriever.vectorstore, 'persist'):
+                self.retriever.vectorstore.persist()
+                print(f"   ✓ ChromaDB persistido com sucesso!")
+            elif hasattr(self.retriever.vectorstore, '_client'):
+                # Alternative: persist via client
+                self.retriever.vectorstore._client.persist()
+                print(f"   ✓ ChromaDB persistido via client!")
+            else:
+                print(f"   ⚠️  Método .persist() não disponível (pode ser auto-persistente)")
+        except Exception as persist_error:
+            print(f"   ⚠️  Aviso ao persistir: {str(persist_error)}")
+            print(f"   (ChromaDB pode estar em modo auto-persist)")
+
+        print(f"   ✓ Adicionado!\n")
+        emit_progress("commit", f"✓ Documento registrado ({len(all_chunk_ids)} chunks)",
+                      pdf_id=pdf_id, chunks=len(all_chunk_ids))
+        return doc_info
+
+    def discard(self, doc_ids):
+        """Remove chunks que nunca foram registrados (streaming interrompido por kill)"""
+        doc_ids = list(doc_ids)
+        print(f"🧹 Removendo {len(doc_ids)} chunks órfãos de uma ingestão interrompida...")
+        self.vectorstore.delete(ids=doc_ids)
+        for doc_id in doc_ids:
+            self.retriever.docstore.store.pop(doc_id, None)
+        self.save_docstore()
+
+    def rollback(self, error):
+        """🛡️ ROLLBACK: Deletar todos os chunks adicionados (documento não é registrado)"""
+        chunk_ids = self.chunk_ids
+        print(f"\n❌ ERRO durante processamento: {str(error)}")
+        print(f"🔄 Executando ROLLBACK para remover {len(chunk_ids)} chunks parciais...")
+        emit_progress("rollback", f"🔄 Erro: {str(error)[:200]} - removendo {len(chunk_ids)} chunks parciais",
+                      error=str(error), chunks=len(chunk_ids))
+
+        try:
+            # 1. Deletar do vectorstore (Chroma)
+            if chunk_ids:
+                self.vectorstore.delete(ids=chunk_ids)
+                print(f"   ✓ {len(chunk_ids)} chunks deletados do vectorstore")
+
+            # 2. Deletar do docstore
+            for chunk_id in chunk_ids:
+                if chunk_id in self.retriever.docstore.store:
+                    del self.retriever.docstore.store[chunk_id]
+
+            # Salvar docstore limpo
+            self.save_docstore()
+            print(f"   ✓ Docstore limpo")
+
+            # 3. NÃO salvar metadata.pkl (não adicionar documento com erro)
+            print(f"   ✓ Metadata NÃO foi salvo (documento não foi registrado)")
+
+            print(f"\n✅ ROLLBACK concluído com sucesso!")
+            print(f"   Vectorstore permanece consistente (documento com erro não foi salvo)")
+
+        except Exception as rollback_error:
+            print(f"\n❌ ERRO durante rollback: {str(rollback_error)}")
+            print(f"   ⚠️  ATENÇÃO: Vectorstore pode estar inconsistente!")
+            print(f"   Execute: curl 'https://comfortable-tenderness-production.up.railway.app/debug-volume?clean_orphans=true'")
+
+        # ===========================================================================
+        # 🛡️ LIMPEZA GARANTIDA: Executar cleanup mesmo se rollback falhar
+        # ===========================================================================
+        if chunk_ids:
+            print("\n🔧 Verificando consistência final do vectorstore...")
+            try:
+                # Tentar deletar chunks órfãos novamente (garantia extra)
+                current_count = self.vectorstore._collection.count()
+                if current_count > 0:
+                    # Verificar se há chunks sem filename (órfãos)
+                    all_results = self.vectorstore.get(include=['metadatas'])
+                    orphan_ids = []
+                    for i, meta in enumerate(all_results.get('metadatas', [])):
+                        chunk_filename = meta.get('filename')
+                        if chunk_filename is None or chunk_filename == '':
+                            orphan_ids.append(all_results['ids'][i])
+
+                    if orphan_ids:
+                        print(f"   ⚠️  Encontrados {len(orphan_ids)} chunks órfãos, removendo...")
+                        self.vectorstore.delete(ids=orphan_ids)
+                        print(f"   ✓ Chunks órfãos removidos")
+                    else:
+                        print(f"   ✓ Nenhum chunk órfão encontrado")
+                else:
+                    print(f"   ✓ Vectorstore vazio (estado consistente)")
+            except Exception as cleanup_error:
+                print(f"   ⚠️  Erro durante limpeza final: {str(cleanup_error)[:100]}")
+                # Não falhar - apenas logar
+
+
+def remove_unregistered_chunks(persist_directory, doc_ids):
+    """Remove do Chroma/docstore chunks gravados sem commit (ver IngestionCheckpoint.orphan_ids)"""
+    import pickle
+
+    if not doc_ids:
+        return
     metadata_path = f"{persist_directory}/metadata.pkl"
-    metadata = {}
     if os.path.exists(metadata_path):
         with open(metadata_path, 'rb') as f:
-            metadata = pickle.load(f)
-    
-    # Migrar estrutura antiga se necessário
-    if 'pdfs' in metadata and 'documents' not in metadata:
-        metadata['documents'] = {}
-        # Converter estrutura antiga
-        for old_pdf in metadata.get('pdfs', []):
-            # Não temos pdf_id nos dados antigos, usar filename como chave temporária
-            pass
-    
-    if 'documents' not in metadata:
-        metadata['documents'] = {}
-    
-    processed_at = time.strftime("%Y-%m-%d %H:%M:%S")
-    
-    # Informações do documento
-    doc_info = {
-        "pdf_id": pdf_id,
-        "filename": pdf_filename,
-        "original_filename": os.path.basename(file_path),
-        "file_size": file_size,
-        "hash": pdf_id,
-        "uploaded_at": uploaded_at,
-        "processed_at": processed_at,
-        "stats": {
-            "texts": len(texts),
-            "tables": len(tables),
-            "images": len(images),
-            "total_chunks": len(chunk_ids)
-        },
-        "chunk_ids": chunk_ids,
-        "status": "processed",
-        "error": None
-    }
-    
-    # Atualizar ou adicionar
-    print(f"   Salvando metadados do documento...")
-    metadata['documents'][pdf_id] = doc_info
+            documents = pickle.load(f).get('documents', {})
+        # Processo morto entre o commit e a limpeza do checkpoint: chunks registrados ficam
+        registered = {chunk_id for doc in documents.values() for chunk_id in doc.get('chunk_ids', [])}
+        doc_ids = [doc_id for doc_id in doc_ids if doc_id not in registered]
+    if doc_ids:
+        KnowledgeBaseWriter(persist_directory).discard(doc_ids)
 
-    with open(metadata_path, 'wb') as f:
-        pickle.dump(metadata, f)
 
-    print(f"   ✓ Metadados salvos")
+def write_to_knowledge_base(prepared, persist_directory, previous_doc=None):
+    """
+    Escreve um documento preparado no vectorstore + docstore + metadata.pkl
 
-    # 🔥 CRITICAL: Force ChromaDB persistence (0.5.x may not auto-persist)
-    print(f"   💾 Forçando persistência do ChromaDB...")
-    try:
-        # ChromaDB 0.5.x requires explicit persist call
-        if hasattr(retriever.vectorstore, 'persist'):
-            retriever.vectorstore.persist()
-            print(f"   ✓ ChromaDB persistido com sucesso!")
-        elif hasattr(retriever.vectorstore, '_client'):
-            # Alternative: persist via client
-            retriever.vectorstore._client.persist()
-            print(f"   ✓ ChromaDB persistido via client!")
-        else:
-            print(f"   ⚠️  Método .persist() não disponível (pode ser auto-persistente)")
-    except Exception as persist_error:
-        print(f"   ⚠️  Aviso ao persistir: {str(persist_error)}")
-        print(f"   (ChromaDB pode estar em modo auto-persist)")
+    Em caso de erro, faz ROLLBACK de todos os chunks adicionados e re-levanta
+    a exceção original.
 
-    print(f"   ✓ Adicionado!\n")
+    Args:
+        prepared: Resultado de prepare_document()
+        persist_directory: Diretório do knowledge base
+        previous_doc: Versão anterior (metadata.pkl) para reprocessamento
+            incremental: chunks inalterados são mantidos, só o diff é gravado
 
-except Exception as e:
-    # ===========================================================================
-    # 🛡️ ROLLBACK: Deletar todos os chunks adicionados se der erro
-    # ===========================================================================
-    rollback_needed = True
-    print(f"\n❌ ERRO durante processamento: {str(e)}")
-    print(f"🔄 Executando ROLLBACK para remover {len(chunk_ids)} chunks parciais...")
+    Returns:
+        dict: doc_info registrado em metadata.pkl
+    """
+    print("3️⃣  Adicionando ao knowledge base...")
+
+    writer = KnowledgeBaseWriter(persist_directory, previous_doc)
+    doc_meta = {
+        "pdf_id": prepared["pdf_id"],
+        "pdf_filename": prepared["pdf_filename"],
+        "uploaded_at": prepared["uploaded_at"],
+        "document_type": prepared["document_type"],
+    }
+    texts = prepared["texts"]
+    tables = prepared["tables"]
+    images = prepared["images"]
+    enriched_texts_metadata = prepared["enriched_texts_metadata"]
+    enriched_tables_metadata = prepared["enriched_tables_metadata"]
+    contextualized_images = prepared["contextualized_images"]
 
     try:
-        # 1. Deletar do vectorstore (Chroma)
-        if chunk_ids:
-            vectorstore.delete(ids=chunk_ids)
-            print(f"   ✓ {len(chunk_ids)} chunks deletados do vectorstore")
+        # Monta TODOS os Documents primeiro; a escrita acontece em lotes
+        pending = []  # (doc_id, Document, original para o docstore)
 
-        # 2. Deletar do docstore
-        for chunk_id in chunk_ids:
-            if chunk_id in retriever.docstore.store:
-                del retriever.docstore.store[chunk_id]
+        print(f"   Preparando {len(texts)} textos, {len(tables)} tabelas, {len(images)} imagens...")
+        for i, summary in enumerate(prepared["text_summaries"]):
+            # ✅ METADATA ENRICHMENT: Usar metadados pré-processados (muito mais rápido!)
+            enriched = enriched_texts_metadata[i] if i < len(enriched_texts_metadata) else {}
+            pending.append(build_text_entry(doc_meta, i, texts[i], summary, prepared["contextualized_texts"][i], enriched))
 
-        # Salvar docstore limpo
-        with open(docstore_path, 'wb') as f:
-            # ✅ CRÍTICO: Salvar retriever.docstore.store (não store.store)
-            pickle.dump(dict(retriever.docstore.store), f)
-        print(f"   ✓ Docstore limpo")
+        for i, summary in enumerate(prepared["table_summaries"]):
+            enriched = enriched_tables_metadata[i] if i < len(enriched_tables_metadata) else {}
+            pending.append(build_table_entry(doc_meta, i, tables[i], summary, prepared["contextualized_tables"][i], enriched))
+
+        for i, summary in enumerate(prepared["image_summaries"]):
+            contextualized = contextualized_images[i] if i < len(contextualized_images) else None
+            pending.append(build_image_entry(doc_meta, i, images[i], summary, contextualized))
+
+        print(f"   Gravando {len(pending)} chunks em lotes de {WRITE_BATCH_SIZE}...")
+        added, kept = writer.write(pending)
+        emit_progress("write", f"✍️  Gravados: {len(pending)}/{len(pending)} chunks", done=len(pending), total=len(pending))
+        print(f"   ✓ {added} chunks adicionados com sucesso" + (f" (+{kept} reaproveitados)" if kept else ""))
 
-        # 3. NÃO salvar metadata.pkl (não adicionar documento com erro)
-        print(f"   ✓ Metadata NÃO foi salvo (documento não foi registrado)")
+        return writer.commit(prepared)
 
-        print(f"\n✅ ROLLBACK concluído com sucesso!")
-        print(f"   Vectorstore permanece consistente (documento com erro não foi salvo)")
+    except Exception as e:
+        writer.rollback(e)
+        # Re-raise exception original para que o upload endpoint retorne erro
+        raise
+
+# ===========================================================================
+# PIPELINE EM STREAMING (etapas sobrepostas com filas limitadas)
+# ===========================================================================
+# Pipeline em streaming no processamento de um PDF (false = etapas em fases)
+STREAMING_PIPELINE = os.getenv("STREAMING_PIPELINE", "false").lower() == "true"
+# Chunks por unidade de trabalho que atravessa as etapas
+PIPELINE_BATCH_SIZE = int(os.getenv("PIPELINE_BATCH_SIZE", "10"))
+# Unidades em espera entre duas etapas (backpressure: limita memória)
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "4"))
+# Intervalo mínimo entre publicações do docstore.pkl durante o streaming
+PIPELINE_PUBLISH_SECONDS = float(os.getenv("PIPELINE_PUBLISH_SECONDS", "30"))
+
+_PIPELINE_DONE = object()
+
+
+def build_pipeline_units(texts, tables, images, image_summaries):
+    """
+    Divide o documento em unidades de até PIPELINE_BATCH_SIZE chunks do mesmo tipo
+
+    image_summaries: descrições já conhecidas (screenshots de tabelas) alinhadas
+    ao FINAL de images; as demais imagens passam pelo Vision.
+    """
+    units = []
+    n_figures = len(images) - len(image_summaries)
+    for kind, items in (("table", tables), ("text", texts), ("image", images[:n_figures])):
+        for start in range(0, len(items), PIPELINE_BATCH_SIZE):
+            units.append({"kind": kind, "start": start, "items": items[start:start + PIPELINE_BATCH_SIZE]})
+
+    for start in range(0, len(image_summaries), PIPELINE_BATCH_SIZE):
+        units.append({
+            "kind": "image",
+            "start": n_figures + start,
+            "items": images[n_figures + start:n_figures + start + PIPELINE_BATCH_SIZE],
+            "summaries": image_summaries[start:start + PIPELINE_BATCH_SIZE],
+        })
+    return units
+
+
+async def annotate_unit(unit, pdf_metadata):
+    """Etapa de rede: resumo/descrição + contexto situacional de uma unidade"""
+    kind, start, items = unit["kind"], unit["start"], unit["items"]
+
+    if kind == "text" and ANNOTATION_MODE == "fused":
+        # Resumo + contexto + keywords em UMA chamada por chunk
+        summaries, contextualized, keywords = await annotate_texts_fused(items, pdf_metadata, start_index=start)
+        unit["summaries"] = list(summaries)
+        unit["contextualized"] = list(contextualized)
+        unit["keywords"] = list(keywords)
+        return unit
+
+    if kind == "text":
+        summaries = await summarize_texts_batch(items, batch_size=len(items))
+        context_texts = [text.text if hasattr(text, 'text') else str(text) for text in items]
+    elif kind == "table":
+        summaries = await describe_tables_batch(items, batch_size=len(items))
+        # Para tabelas, usar preview menor (tabelas são grandes)
+        context_texts = [(table.text if hasattr(table, 'text') else str(table))[:1000] for table in items]
+    else:
+        summaries = unit.get("summaries") or await describe_images_batch(items, batch_size=3, start_index=start)
+        context_texts = summaries
+
+    context_items = [
+        {
+            "text": text,
+            "index": start + j,
+            "type": kind,
+            "section": extract_section_heading(items[j]) if kind != "image" else None,
+        }
+        for j, text in enumerate(context_texts)
+    ]
+    label = {"text": "Textos", "table": "Tabelas", "image": "Imagens"}[kind]
+    unit["summaries"] = list(summaries)
+    unit["contextualized"] = list(await contextualize_batch(context_items, pdf_metadata, label))
+    return unit
 
-    except Exception as rollback_error:
-        print(f"\n❌ ERRO durante rollback: {str(rollback_error)}")
-        print(f"   ⚠️  ATENÇÃO: Vectorstore pode estar inconsistente!")
-        print(f"   Execute: curl 'https://comfortable-tenderness-production.up.railway.app/debug-volume?clean_orphans=true'")
 
-    # Re-raise exception original para que o upload endpoint retorne erro
-    raise e
+def _pipeline_stage(func, inbox, outbox, stop):
+    """
+    Thread de uma etapa: consome inbox, produz em outbox
+
+    Exceções viajam pelo pipeline como itens; após um erro (stop), as unidades
+    restantes são descartadas mas o sinal de fim continua sendo repassado.
+    """
+    while True:
+        unit = inbox.get()
+        if unit is _PIPELINE_DONE:
+            outbox.put(_PIPELINE_DONE)
+            return
+        if isinstance(unit, Exception):
+            outbox.put(unit)
+            continue
+        if stop.is_set():
+            continue
+        try:
+            outbox.put(func(unit))
+        except Exception as e:
+            stop.set()
+            outbox.put(e)
+
+
+def stream_document(file_path, pdf_filename, persist_directory, previous_doc=None, enricher=None, checkpoint=None):
+    """
+    Processa e grava um PDF em streaming
+
+    Depois da extração, os chunks fluem em unidades por filas limitadas:
+
+        anotação (LLM: resumo + contexto) → enriquecimento (KeyBERT, CPU) → escrita (embeddings + Chroma)
+
+    Cada etapa roda na sua thread, então o KeyBERT de uma unidade sobrepõe a
+    latência da OpenAI da seguinte, e os primeiros chunks ficam consultáveis
+    (docstore publicado a cada PIPELINE_PUBLISH_SECONDS) antes dos últimos
+    serem processados. O documento só é registrado em metadata.pkl no final;
+    em caso de erro, o ROLLBACK remove tudo que foi gravado. Se o processo
+    morrer antes disso, os doc_ids de cada unidade (registrados no checkpoint
+    antes da escrita) são removidos na execução seguinte, retomada ou não.
+
+    Args:
+        file_path: Caminho do PDF
+        pdf_filename: Nome do arquivo (usado como source)
+        persist_directory: Diretório do knowledge base
+        previous_doc: Versão anterior: substituída por diff de chunks no commit
+        enricher: MetadataEnricher já carregado (padrão: get_enricher())
+        checkpoint: Checkpoints do documento (open_checkpoint); extração e
+            unidades já processadas são carregadas em vez de reprocessadas
+
+    Returns:
+        tuple: (prepared, doc_info)
+    """
+    import queue
+    import threading
+
+    if enricher is None:
+        enricher = get_enricher()
+    if checkpoint is None:
+        checkpoint = get_checkpoint(enabled=False)
+
+    if checkpoint.is_done("stream_extract"):
+        prepared = checkpoint.load()
+        print(f"♻️  Retomando do checkpoint (extração concluída)\n")
+        emit_progress("resume", "♻️ Retomando do checkpoint (extração concluída)", stage_done="stream_extract")
+    else:
+        prepared = extract_elements(file_path, pdf_filename)
+        chunks = prepared.pop("chunks")
+
+        # Screenshots antes do streaming: as notas explicativas entram no texto das tabelas
+        table_screenshots, table_screenshot_summaries = extract_table_screenshots(prepared["tables"], chunks)
+        prepared["images"].extend(table_screenshots)
+
+        # INFERIR TIPO DE DOCUMENTO (necessário para Contextual Retrieval)
+        prepared["document_type"] = infer_document_type(pdf_filename)
+        prepared["table_screenshots_count"] = len(table_screenshots)
+        prepared["table_screenshot_summaries"] = table_screenshot_summaries
+        checkpoint.save("stream_extract", prepared)
+
+    texts, tables, images = prepared["texts"], prepared["tables"], prepared["images"]
+    table_screenshot_summaries = prepared["table_screenshot_summaries"]
+    document_type = prepared["document_type"]
+    print(f"   Tipo de documento detectado: {document_type}")
+
+    pdf_metadata = {"filename": pdf_filename, "document_type": document_type}
+    if CONTEXT_BATCH_SIZE > 1:
+        pdf_metadata["outline"] = build_document_outline(texts, tables)
+    doc_meta = {
+        "pdf_id": prepared["pdf_id"],
+        "pdf_filename": pdf_filename,
+        "uploaded_at": prepared["uploaded_at"],
+        "document_type": document_type,
+    }
+
+    units = build_pipeline_units(texts, tables, images, table_screenshot_summaries)
+    total_chunks = len(texts) + len(tables) + len(images)
+    print(f"\n2️⃣  Pipeline em streaming: {total_chunks} chunks em {len(units)} unidades "
+          f"(resumo+contexto → enriquecimento → escrita)")
+
+    def unit_key(unit):
+        return f"{unit['kind']}_{unit['start']}"
+
+    def annotate(unit):
+        if "contextualized" in unit:
+            return unit  # Retomada: unidade já anotada em execução anterior
+        return asyncio.run(annotate_unit(unit, pdf_metadata))
+
+    def save_unit(unit, written_ids=None):
+        data = {
+            "summaries": unit["summaries"],
+            "contextualized": unit["contextualized"],
+            "enriched": unit["enriched"],
+        }
+        if written_ids is not None:
+            data["written_ids"] = written_ids
+        checkpoint.save_unit(unit_key(unit), data)
+
+    def enrich(unit):
+        if "enriched" in unit:
+            return unit
+        if unit["kind"] == "image":
+            unit["enriched"] = [None] * len(unit["items"])
+        elif unit.get("keywords") is not None:
+            unit["enriched"] = enrich_with_llm_keywords(enricher, [
+                item.text if hasattr(item, 'text') else str(item)
+                for item in unit["items"]
+            ], unit["keywords"])
+        else:
+            unit["enriched"] = enricher.enrich_batch([
+                item.text if hasattr(item, 'text') else str(item)
+                for item in unit["items"]
+            ])
+        save_unit(unit)
+        return unit
+
+    # Retomada: unidades prontas voltam do checkpoint; o que elas já tinham gravado
+    # (sem commit) sai do knowledge base antes de ser regravado
+    orphan_ids = list(checkpoint.orphan_ids)
+    for unit in units:
+        saved = checkpoint.load_unit(unit_key(unit))
+        if saved:
+            orphan_ids.extend(saved.pop("written_ids", []))
+            unit.update(saved)
+    remove_unregistered_chunks(persist_directory, orphan_ids)
+
+    writer = KnowledgeBaseWriter(persist_directory, previous_doc)
+
+    stop = threading.Event()
+    to_annotate = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    to_enrich = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    to_write = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+
+    def feed():
+        for unit in units:
+            if stop.is_set():
+                break
+            to_annotate.put(unit)
+        to_annotate.put(_PIPELINE_DONE)
+
+    threads = [
+        threading.Thread(target=feed, name="pipeline-feed", daemon=True),
+        threading.Thread(target=_pipeline_stage, args=(annotate, to_annotate, to_enrich, stop),
+                         name="pipeline-annotate", daemon=True),
+        threading.Thread(target=_pipeline_stage, args=(enrich, to_enrich, to_write, stop),
+                         name="pipeline-enrich", daemon=True),
+    ]
+    for thread in threads:
+        thread.start()
+
+    # Etapa de escrita no processo principal: Chroma/docstore têm um único escritor
+    results = {"text": {}, "table": {}, "image": {}}
+    error = None
+    written = 0
+    last_publish = time.time()
+    while True:
+        unit = to_write.get()
+        if unit is _PIPELINE_DONE:
+            break
+        if error is not None:
+            continue  # Drenar a fila até o fim para liberar as threads
+        if isinstance(unit, Exception):
+            error = unit
+            stop.set()
+            continue
 
-finally:
-    # ===========================================================================
-    # 🛡️ LIMPEZA GARANTIDA: Executar cleanup mesmo se rollback falhar
-    # ===========================================================================
-    if rollback_needed and chunk_ids:
-        print("\n🔧 Verificando consistência final do vectorstore...")
         try:
-            # Tentar deletar chunks órfãos novamente (garantia extra)
-            current_count = vectorstore._collection.count()
-            if current_count > 0:
-                # Verificar se há chunks sem filename (órfãos)
-                all_results = vectorstore.get(include=['metadatas'])
-                orphan_ids = []
-                for i, meta in enumerate(all_results.get('metadatas', [])):
-                    chunk_filename = meta.get('filename')
-                    if chunk_filename is None or chunk_filename == '':
-                        orphan_ids.append(all_results['ids'][i])
-
-                if orphan_ids:
-                    print(f"   ⚠️  Encontrados {len(orphan_ids)} chunks órfãos, removendo...")
-                    vectorstore.delete(ids=orphan_ids)
-                    print(f"   ✓ Chunks órfãos removidos")
+            kind, start = unit["kind"], unit["start"]
+            entries = []
+            for j, item in enumerate(unit["items"]):
+                index = start + j
+                summary = unit["summaries"][j]
+                contextualized = unit["contextualized"][j]
+                if kind == "text":
+                    entries.append(build_text_entry(doc_meta, index, item, summary, contextualized, unit["enriched"][j]))
+                elif kind == "table":
+                    entries.append(build_table_entry(doc_meta, index, item, summary, contextualized, unit["enriched"][j]))
                 else:
-                    print(f"   ✓ Nenhum chunk órfão encontrado")
-            else:
-                print(f"   ✓ Vectorstore vazio (estado consistente)")
-        except Exception as cleanup_error:
-            print(f"   ⚠️  Erro durante limpeza final: {str(cleanup_error)[:100]}")
-            # Não falhar - apenas logar
+                    entries.append(build_image_entry(doc_meta, index, item, summary, contextualized))
+                results[kind][index] = (summary, contextualized, unit["enriched"][j])
+
+            # Write-ahead: doc_ids no checkpoint antes do Chroma/docstore
+            save_unit(unit, [doc_id for doc_id, _, _ in entries])
+            writer.write(entries)
+            written += len(entries)
+            print(f"   ✍️  Gravados: {written}/{total_chunks} chunks", end="\r")
+            emit_progress("write", f"✍️  Gravados: {written}/{total_chunks} chunks", done=written, total=total_chunks)
+
+            if time.time() - last_publish >= PIPELINE_PUBLISH_SECONDS:
+                writer.save_docstore()
+                last_publish = time.time()
+        except Exception as e:
+            error = e
+            stop.set()
+
+    for thread in threads:
+        thread.join()
+
+    if error is not None:
+        writer.rollback(error)
+        raise error
+
+    print(f"\n   ✓ {written} chunks processados em streaming\n")
+    print_vision_input_stats()
+    print_llm_cache_stats()
+
+    def ordered(kind, field):
+        return [results[kind][i][field] for i in sorted(results[kind])]
+
+    # Mesmo formato de prepare_document() (relatório de qualidade)
+    prepared.update({
+        "text_summaries": ordered("text", 0),
+        "table_summaries": ordered("table", 0),
+        "image_summaries": ordered("image", 0),
+        "contextualized_texts": ordered("text", 1),
+        "contextualized_tables": ordered("table", 1),
+        "contextualized_images": ordered("image", 1),
+        "enriched_texts_metadata": ordered("text", 2),
+        "enriched_tables_metadata": ordered("table", 2),
+    })
+
+    print("3️⃣  Registrando documento no knowledge base...")
+    try:
+        doc_info = writer.commit(prepared)
+    except Exception as e:
+        writer.rollback(e)
+        raise
+
+    return prepared, doc_info
+
 
 # ===========================================================================
 # RELATÓRIO DE QUALIDADE
 # ===========================================================================
-print("=" * 70)
-print("📊 RELATÓRIO DE QUALIDADE DO PROCESSAMENTO")
-print("=" * 70)
-
-print(f"\n🔧 Configuração:")
-print(f"   Estratégia OCR: {strategy_used}")
-print(f"   Idioma: Português (por)")
-print(f"   Chunking: by_title (max: 10000 chars, ~2500 tokens)")
-print(f"   Combine under: 4000 chars | Soft max: 6000 chars")
-print(f"   Tabelas: Sempre preservadas inteiras (isoladas)")
-
-print(f"\n📄 Arquivo:")
-print(f"   Nome: {pdf_filename}")
-print(f"   Tamanho: {file_size / 1024 / 1024:.2f} MB")
-print(f"   Tipo detectado: {document_type}")
-
-print(f"\n📦 Elementos extraídos:")
-print(f"   Textos (CompositeElement): {len(texts)}")
-print(f"   Tabelas (isoladas): {len(tables)}")
-print(f"   Imagens: {len(images)} (figuras + {len(table_screenshots)} screenshots de tabelas)")
-if filtered_count > 0:
-    print(f"   (filtradas: {filtered_count} imagens pequenas <{MIN_IMAGE_SIZE_KB:.0f}KB - ícones/decorações)")
-
-print(f"\n💾 Knowledge Base:")
-print(f"   PDF_ID: {pdf_id[:32]}...")
-print(f"   Chunks totais: {len(chunk_ids)} ({len(texts)}T + {len(tables)}Tab + {len(images)}I)")
-print(f"   Processado em: {processed_at}")
-
-# Estatísticas de metadados enriquecidos
-print(f"\n🔍 Metadados Enriquecidos (KeyBERT + Medical NER + Numerical):")
-# Coletar todos os vectorstore documents para contar metadados
-total_with_keywords = 0
-total_with_entities = 0
-total_with_measurements = 0
-unique_diseases = set()
-unique_medications = set()
-unique_procedures = set()
-
-# Iterar sobre os documentos que acabamos de adicionar
-# (Nota: Isso é uma aproximação - idealmente consultaríamos o vectorstore)
-# Mas como acabamos de processar, podemos estimar
-print(f"   Keywords extraídas: ✓ (KeyBERT multilingual)")
-print(f"   Entidades médicas: ✓ (Regex-based NER)")
-print(f"   Valores numéricos: ✓ (Pattern matching)")
-
-# Listar tabelas extraídas
-if tables:
-    print(f"\n📋 Tabelas encontradas ({len(tables)}):")
-    for i, table in enumerate(tables):
-        table_preview = table.text[:80] if hasattr(table, 'text') else str(table)[:80]
-        page_num = table.metadata.page_number if hasattr(table, 'metadata') and hasattr(table.metadata, 'page_number') else '?'
-        print(f"   [{i+1}] Página {page_num}: {table_preview}...")
-
-# Detectar possível problema de OCR (muito inglês em PDF português)
-all_text_content = " ".join([t.text for t in texts if hasattr(t, 'text')])
-if len(all_text_content) > 100:
-    # Palavras comuns em inglês
-    english_indicators = ['the ', ' and ', ' or ', ' with ', ' from ', ' this ', ' that ']
-    english_count = sum(all_text_content.lower().count(word) for word in english_indicators)
-    words_total = len(all_text_content.split())
-    english_ratio = english_count / max(words_total, 1) * 100
-
-    if english_ratio > 15:
-        print(f"\n⚠️  AVISO: Detectado {english_ratio:.1f}% de indicadores de inglês")
-        print(f"   O PDF pode ter sido mal processado.")
-        print(f"   Considere verificar se o conteúdo está correto.")
-
-print("\n" + "=" * 70)
-
-print(f"\n✅ Pronto! Use:")
-print(f"   - python consultar.py (terminal)")
-print(f"   - /chat (web UI)")
-print(f"   - /manage (gerenciar documentos)")
-print()
+def print_quality_report(prepared, doc_info):
+    """Imprime o relatório de qualidade do processamento"""
+    pdf_filename = prepared["pdf_filename"]
+    file_size = prepared["file_size"]
+    document_type = prepared["document_type"]
+    strategy_used = prepared["strategy_used"]
+    texts = prepared["texts"]
+    tables = prepared["tables"]
+    images = prepared["images"]
+    filtered_count = prepared["filtered_count"]
+    table_screenshots_count = prepared["table_screenshots_count"]
+    pdf_id = doc_info["pdf_id"]
+    processed_at = doc_info["processed_at"]
+    chunk_ids = doc_info["chunk_ids"]
+    incremental = doc_info.get("incremental")
+
+    print("=" * 70)
+    print("📊 RELATÓRIO DE QUALIDADE DO PROCESSAMENTO")
+    print("=" * 70)
+
+    print(f"\n🔧 Configuração:")
+    print(f"   Estratégia OCR: {strategy_used}")
+    print(f"   Idioma: Português (por)")
+    print(f"   Chunking: by_title (max: 10000 chars, ~2500 tokens)")
+    print(f"   Combine under: 4000 chars | Soft max: 6000 chars")
+    print(f"   Tabelas: Sempre preservadas inteiras (isoladas)")
+
+    print(f"\n📄 Arquivo:")
+    print(f"   Nome: {pdf_filename}")
+    print(f"   Tamanho: {file_size / 1024 / 1024:.2f} MB")
+    print(f"   Tipo detectado: {document_type}")
+
+    print(f"\n📦 Elementos extraídos:")
+    print(f"   Textos (CompositeElement): {len(texts)}")
+    print(f"   Tabelas (isoladas): {len(tables)}")
+    print(f"   Imagens: {len(images)} (figuras + {table_screenshots_count} screenshots de tabelas)")
+    if filtered_count > 0:
+        print(f"   (filtradas: {filtered_count} imagens pequenas <{MIN_IMAGE_SIZE_KB:.0f}KB - ícones/decorações)")
+
+    print(f"\n💾 Knowledge Base:")
+    print(f"   PDF_ID: {pdf_id[:32]}...")
+    print(f"   Chunks totais: {len(chunk_ids)} ({len(texts)}T + {len(tables)}Tab + {len(images)}I)")
+    if incremental:
+        print(f"   Incremental: {incremental['kept']} reaproveitados, {incremental['added']} novos, "
+              f"{incremental['removed']} removidos")
+    print(f"   Processado em: {processed_at}")
+
+    # Estatísticas de metadados enriquecidos
+    print(f"\n🔍 Metadados Enriquecidos (KeyBERT + Medical NER + Numerical):")
+    # Coletar todos os vectorstore documents para contar metadados
+    total_with_keywords = 0
+    total_with_entities = 0
+    total_with_measurements = 0
+    unique_diseases = set()
+    unique_medications = set()
+    unique_procedures = set()
+
+    # Iterar sobre os documentos que acabamos de adicionar
+    # (Nota: Isso é uma aproximação - idealmente consultaríamos o vectorstore)
+    # Mas como acabamos de processar, podemos estimar
+    print(f"   Keywords extraídas: ✓ (KeyBERT multilingual)")
+    print(f"   Entidades médicas: ✓ (Regex-based NER)")
+    print(f"   Valores numéricos: ✓ (Pattern matching)")
+
+    # Listar tabelas extraídas
+    if tables:
+        print(f"\n📋 Tabelas encontradas ({len(tables)}):")
+        for i, table in enumerate(tables):
+            table_preview = table.text[:80] if hasattr(table, 'text') else str(table)[:80]
+            page_num = table.metadata.page_number if hasattr(table, 'metadata') and hasattr(table.metadata, 'page_number') else '?'
+            print(f"   [{i+1}] Página {page_num}: {table_preview}...")
+
+    # Detectar possível problema de OCR (muito inglês em PDF português)
+    all_text_content = " ".join([t.text for t in texts if hasattr(t, 'text')])
+    if len(all_text_content) > 100:
+        # Palavras comuns em inglês
+        english_indicators = ['the ', ' and ', ' or ', ' with ', ' from ', ' this ', ' that ']
+        english_count = sum(all_text_content.lower().count(word) for word in english_indicators)
+        words_total = len(all_text_content.split())
+        english_ratio = english_count / max(words_total, 1) * 100
+
+        if english_ratio > 15:
+            print(f"\n⚠️  AVISO: Detectado {english_ratio:.1f}% de indicadores de inglês")
+            print(f"   O PDF pode ter sido mal processado.")
+            print(f"   Considere verificar se o conteúdo está correto.")
+
+    print("\n" + "=" * 70)
+
+    print(f"\n✅ Pronto! Use:")
+    print(f"   - python consultar.py (terminal)")
+    print(f"   - /chat (web UI)")
+    print(f"   - /manage (gerenciar documentos)")
+    print()
+
+
+# ===========================================================================
+# ORQUESTRAÇÃO: UM PDF
+# ===========================================================================
+def resolve_pdf_path(input_path):
+    """
+    Aceita tanto "arquivo.pdf" quanto "content/arquivo.pdf"
+
+    Returns:
+        tuple: (file_path, pdf_filename)
+
+    Raises:
+        FileNotFoundError: Se o PDF não existir em nenhum dos caminhos
+    """
+    if os.path.exists(input_path):
+        # Caminho completo fornecido
+        return input_path, os.path.basename(input_path)
+    if os.path.exists(f"./content/{input_path}"):
+        # Só nome do arquivo fornecido
+        return f"./content/{input_path}", input_path
+    raise FileNotFoundError(f"PDF não encontrado: {input_path} (tentou também: ./content/{input_path})")
+
+
+def get_persist_directory():
+    """Vectorstore unificado - Railway Volume (sempre caminho absoluto)"""
+    return os.path.abspath(os.getenv("PERSIST_DIR", "./knowledge"))
+
+
+def open_checkpoint(pdf_id, persist_directory, resume=False, streaming=False):
+    """
+    Checkpoints do documento, válidos só para a mesma configuração de ingestão
+
+    A chave inclui versões dos prompts, chunking, estratégia, modo das tabelas,
+    modo da anotação e modo do pipeline:
+    artefatos de outra configuração são descartados em vez de reaproveitados.
+    """
+    config_key = input_hash(
+        PROMPT_VERSIONS, CHUNKING_KWARGS, strategy_env, MIN_IMAGE_SIZE_KB, TABLE_VISION_MODE, ANNOTATION_MODE,
+        CONTEXT_BATCH_SIZE, "streaming" if streaming else "phased", PIPELINE_BATCH_SIZE,
+    )
+    return get_checkpoint(persist_directory, pdf_id, config_key, resume=resume, enabled=INGEST_CHECKPOINTS)
+
+
+def delete_previous_version(existing_doc, persist_directory):
+    """✅ PREVENIR DUPLICAÇÃO: Deletar versão anterior antes de gravar a nova"""
+    print("🗑️  Deletando versão anterior para prevenir duplicação...")
+    from document_manager import delete_document
+    delete_result = delete_document(existing_doc.get('pdf_id'), persist_directory)
+
+    if delete_result.get('status') == 'success':
+        print(f"   ✓ {delete_result.get('deleted_chunks', 0)} chunks removidos")
+        print(f"   ✓ Documento anterior deletado com sucesso\n")
+    else:
+        print(f"   ⚠️  Erro ao deletar versão anterior: {delete_result.get('message', 'desconhecido')}")
+        print(f"   ⚠️  Prosseguindo com reprocessamento (pode causar duplicação)\n")
+
+
+def find_previous_version(file_path, persist_directory, incremental=False):
+    """
+    Procura uma versão já processada do PDF
+
+    Sempre por hash do conteúdo (mesmo arquivo). No modo incremental também por
+    nome de arquivo, para que uma nova edição reaproveite as seções inalteradas.
+    """
+    existing_doc = check_duplicate(file_path, persist_directory)
+    if existing_doc is None and incremental:
+        existing_doc = find_document_by_filename(os.path.basename(file_path), persist_directory)
+    return existing_doc
+
+
+def replace_previous_version(prepared, existing_doc, persist_directory, incremental=False):
+    """Grava a nova versão: diff de chunks (incremental) ou delete + escrita completa"""
+    if existing_doc and incremental:
+        print("🔁 Reprocessamento incremental: comparando chunks com a versão anterior...")
+        return write_to_knowledge_base(prepared, persist_directory, previous_doc=existing_doc)
+
+    # A versão anterior continua consultável até a nova estar pronta para escrita
+    if existing_doc:
+        delete_previous_version(existing_doc, persist_directory)
+    return write_to_knowledge_base(prepared, persist_directory)
+
+
+def process_pdf(input_path, persist_directory=None, interactive=None, enricher=None, incremental=None, resume=None):
+    """
+    Processa um PDF completo: extração → resumos → contexto → enriquecimento → escrita
+
+    Args:
+        input_path: "arquivo.pdf" ou "content/arquivo.pdf"
+        persist_directory: Diretório do knowledge base (padrão: PERSIST_DIR)
+        interactive: Perguntar antes de reprocessar (padrão: detecta TTY)
+        enricher: MetadataEnricher já carregado (padrão: get_enricher())
+        incremental: Reaproveitar chunks inalterados da versão anterior
+            (padrão: INCREMENTAL_REINGEST)
+        resume: Retomar de checkpoints de uma execução interrompida
+            (padrão: INGEST_RESUME)
+
+    Returns:
+        dict: doc_info registrado, ou None se o usuário cancelou
+    """
+    file_path, pdf_filename = resolve_pdf_path(input_path)
+    if persist_directory is None:
+        persist_directory = get_persist_directory()
+    if interactive is None:
+        # Detectar se está em modo não-interativo (Railway, Docker, API)
+        interactive = sys.stdin.isatty() and os.getenv("AUTO_REPROCESS") != "true"
+    if incremental is None:
+        incremental = INCREMENTAL_REINGEST
+    if resume is None:
+        resume = INGEST_RESUME
+
+    print(f"📄 Processando: {pdf_filename}")
+    print("⏳ Aguarde 5-10 minutos...\n")
+    emit_progress("start", f"📄 Processando: {pdf_filename}", filename=pdf_filename)
+
+    print(f"=" * 70)
+    print(f"🔧 CONFIGURAÇÃO DE DIRETÓRIOS")
+    print(f"=" * 70)
+    print(f"Current working directory: {os.getcwd()}")
+    print(f"PERSIST_DIR (env): {os.getenv('PERSIST_DIR', 'NOT SET')}")
+    print(f"persist_directory (absoluto): {persist_directory}")
+    print(f"Docstore será salvo em: {persist_directory}/docstore.pkl")
+    print(f"=" * 70)
+    print()
+
+    # GERAR PDF_ID E VERIFICAR DUPLICATA
+    print("🔍 Gerando ID do documento...")
+    pdf_id = generate_pdf_id(file_path)
+    print(f"   PDF_ID: {pdf_id[:16]}...")
+    print(f"   Tamanho: {os.path.getsize(file_path) / 1024 / 1024:.2f} MB")
+
+    existing_doc = find_previous_version(file_path, persist_directory, incremental)
+    if existing_doc and existing_doc.get('pdf_id') != pdf_id:
+        print(f"\n📝 Nova edição de um PDF já processado ({existing_doc.get('pdf_id', '')[:16]}...)")
+        print(f"   Chunks anteriores: {existing_doc.get('stats', {}).get('total_chunks', 0)}")
+        print("   Chunks inalterados serão reaproveitados\n")
+    elif existing_doc:
+        print(f"\n⚠️  Este PDF já foi processado!")
+        print(f"   Adicionado em: {existing_doc.get('uploaded_at', 'desconhecido')}")
+        print(f"   Chunks: {existing_doc.get('stats', {}).get('total_chunks', 0)}")
+
+        if not interactive:
+            # Modo automático (Railway, API, Docker)
+            print("\n🔄 Modo não-interativo detectado, reprocessando automaticamente...\n")
+            emit_progress("duplicate", "⚠️ Este PDF já foi processado, reprocessando...", pdf_id=existing_doc.get('pdf_id'))
+        else:
+            # Modo interativo (terminal local)
+            choice = input("\nReprocessar? (s/N): ")
+            if choice.lower() != 's':
+                print("❌ Processamento cancelado.")
+                return None
+            print("\n🔄 Reprocessando documento...\n")
+    else:
+        print("✅ Documento novo, prosseguindo...\n")
+
+    checkpoint = open_checkpoint(pdf_id, persist_directory, resume=resume, streaming=STREAMING_PIPELINE)
+    try:
+        if STREAMING_PIPELINE:
+            if existing_doc and incremental:
+                # Substituída por diff no commit: segue consultável durante o streaming
+                print("🔁 Reprocessamento incremental: comparando chunks com a versão anterior...")
+                previous_doc = existing_doc
+            else:
+                # Mesmo comportamento do modo em fases: delete + escrita completa
+                if existing_doc:
+                    delete_previous_version(existing_doc, persist_directory)
+                previous_doc = None
+            prepared, doc_info = stream_document(
+                file_path, pdf_filename, persist_directory,
+                previous_doc=previous_doc, enricher=enricher, checkpoint=checkpoint,
+            )
+        else:
+            remove_unregistered_chunks(persist_directory, checkpoint.orphan_ids)
+            prepared = prepare_document(file_path, pdf_filename, enricher=enricher, checkpoint=checkpoint)
+            doc_info = replace_previous_version(prepared, existing_doc, persist_directory, incremental)
+    except Exception:
+        if checkpoint.stage is not None:
+            print(f"\n💾 Checkpoint mantido (etapa concluída: {checkpoint.stage})")
+            print(f"   Para retomar: python adicionar_pdf.py {input_path} --resume")
+        raise
+
+    # Documento registrado: artefatos intermediários não são mais necessários
+    checkpoint.clear()
+    print_quality_report(prepared, doc_info)
+    emit_progress("done", f"✅ {pdf_filename}: {len(doc_info['chunk_ids'])} chunks no knowledge base",
+                  pdf_id=doc_info["pdf_id"], chunks=len(doc_info["chunk_ids"]))
+    return doc_info
+
+
+# ===========================================================================
+# ORQUESTRAÇÃO: INGESTÃO EM LOTE (pool de processos)
+# ===========================================================================
+def collect_pdf_paths(pattern):
+    """
+    Expande um diretório ou glob em uma lista ordenada de PDFs
+
+    Args:
+        pattern: Diretório ("content/") ou glob ("content/*diretriz*.pdf")
+
+    Returns:
+        list: Caminhos de PDFs encontrados
+    """
+    import glob
+
+    if os.path.isdir(pattern):
+        pattern = os.path.join(pattern, "*.pdf")
+    paths = glob.glob(pattern, recursive=True)
+    return sorted(p for p in paths if p.lower().endswith(".pdf") and os.path.isfile(p))
+
+
+def _init_bulk_worker():
+    """
+    Inicializador de cada worker do pool: carrega modelos UMA vez por processo
+
+    - MetadataEnricher (KeyBERT + NER + numerical)
+    - Modelo de layout do Unstructured (hi_res), quando disponível
+    """
+    get_enricher()
+
+    if strategy_env == "hi_res":
+        try:
+            from unstructured.partition.pdf import partition_pdf  # noqa: F401
+            from unstructured_inference.models.base import get_model
+            get_model()  # Cacheado pelo unstructured_inference dentro do processo
+        except Exception as e:
+            print(f"⚠️  Modelo de layout não pré-carregado: {str(e)[:100]}")
+
+
+def _init_bulk_process():
+    """Inicializador dos processos do modo bulk: sem pool de conversão aninhado"""
+    set_transcode_workers(1)  # O paralelismo já vem dos workers do bulk
+    _init_bulk_worker()
+
+
+def _prepare_in_worker(file_path, persist_directory, resume=False):
+    """Executado no worker: prepara um PDF sem escrever no knowledge base"""
+    started = time.time()
+    checkpoint = open_checkpoint(generate_pdf_id(file_path), persist_directory, resume=resume)
+    prepared = prepare_document(file_path, os.path.basename(file_path), checkpoint=checkpoint)
+    # Órfãos de um streaming interrompido: removidos pelo processo principal (único escritor)
+    prepared["orphan_ids"] = list(checkpoint.orphan_ids)
+    # Medido aqui: no processo principal o relógio incluiria o tempo na fila do pool
+    prepared["prepare_seconds"] = time.time() - started
+    return prepared
+
+
+def ingest_bulk(paths, workers=None, persist_directory=None, incremental=None, resume=None):
+    """
+    Processa vários PDFs em paralelo com um pool de processos
+
+    As etapas caras (partition, Vision, LLM, KeyBERT) rodam nos workers. A
+    escrita no knowledge base acontece no processo principal, um documento por
+    vez, porque Chroma local e docstore.pkl não suportam escritores concorrentes.
+
+    Args:
+        paths: Lista de caminhos de PDFs
+        workers: Número de PDFs processados simultaneamente (padrão: INGEST_WORKERS)
+        persist_directory: Diretório do knowledge base (padrão: PERSIST_DIR)
+        incremental: Reaproveitar chunks inalterados (padrão: INCREMENTAL_REINGEST)
+        resume: Retomar PDFs interrompidos a partir dos checkpoints (padrão: INGEST_RESUME)
+
+    Returns:
+        list: [{"file": ..., "status": "success|error", "pdf_id": ..., "chunks": N, "error": ..., "seconds": N}]
+            (seconds: preparo no worker + escrita; None se o worker falhou)
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    if persist_directory is None:
+        persist_directory = get_persist_directory()
+    workers = max(1, min(workers or INGEST_WORKERS, len(paths)))
+    if incremental is None:
+        incremental = INCREMENTAL_REINGEST
+    if resume is None:
+        resume = INGEST_RESUME
+
+    print(f"📚 Ingestão em lote: {len(paths)} PDFs, {workers} workers")
+    print(f"   persist_directory: {persist_directory}\n")
+
+    results = []
+
+    # spawn: workers não herdam estado de threads/modelos do processo principal
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_init_bulk_process) as pool:
+        futures = {pool.submit(_prepare_in_worker, path, persist_directory, resume): path for path in paths}
+
+        for future in as_completed(futures):
+            path = futures[future]
+            result = {"file": path, "status": "success", "pdf_id": None, "chunks": 0, "error": None, "seconds": None}
+            prepare_seconds = None
+            try:
+                prepared = future.result()
+                write_started = time.time()
+                result["pdf_id"] = prepared["pdf_id"]
+                prepare_seconds = prepared.pop("prepare_seconds")
+                remove_unregistered_chunks(persist_directory, prepared.pop("orphan_ids", []))
+
+                existing_doc = find_previous_version(path, persist_directory, incremental)
+                doc_info = replace_previous_version(prepared, existing_doc, persist_directory, incremental)
+                result["chunks"] = len(doc_info["chunk_ids"])
+                open_checkpoint(prepared["pdf_id"], persist_directory, resume=True).clear()
+            except Exception as e:
+                result["status"] = "error"
+                result["error"] = str(e)[:300]
+                print(f"\n❌ {os.path.basename(path)}: {result['error']}")
+
+            if prepare_seconds is not None:
+                result["seconds"] = round(prepare_seconds + time.time() - write_started, 1)
+
+            results.append(result)
+            print(f"\n📦 [{len(results)}/{len(paths)}] {os.path.basename(path)}: {result['status']}\n")
+
+    print_bulk_summary(results)
+    return results
+
+
+def print_bulk_summary(results):
+    """Imprime resumo de sucesso/falha por documento"""
+    succeeded = [r for r in results if r["status"] == "success"]
+    failed = [r for r in results if r["status"] != "success"]
+
+    print("=" * 70)
+    print("📊 RESUMO DA INGESTÃO EM LOTE")
+    print("=" * 70)
+    for r in sorted(results, key=lambda r: r["file"]):
+        if r["status"] == "success":
+            print(f"   ✅ {os.path.basename(r['file'])}: {r['chunks']} chunks ({r['seconds']}s)")
+        else:
+            print(f"   ❌ {os.path.basename(r['file'])}: {r['error']}")
+    print(f"\n   Sucesso: {len(succeeded)}/{len(results)} | Falhas: {len(failed)}/{len(results)}")
+    print(f"   Chunks adicionados: {sum(r['chunks'] for r in succeeded)}")
+    print("=" * 70)
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Adicionar PDF(s) ao knowledge base")
+    parser.add_argument("paths", nargs="+", help="PDF, diretório ou glob (ex: 'content/*.pdf')")
+    parser.add_argument("--workers", type=int, default=None,
+                        help=f"PDFs processados em paralelo no modo lote (padrão: INGEST_WORKERS={INGEST_WORKERS})")
+    parser.add_argument("--incremental", action="store_true", default=None,
+                        help="Reaproveitar chunks inalterados da versão anterior (padrão: INCREMENTAL_REINGEST)")
+    parser.add_argument("--resume", action="store_true", default=None,
+                        help="Retomar da primeira etapa incompleta de uma execução interrompida (padrão: INGEST_RESUME)")
+    args = parser.parse_args(argv)
+
+    # Um único PDF → fluxo original; diretório, glob ou vários arquivos → modo lote
+    target = args.paths[0]
+    if len(args.paths) == 1 and not os.path.isdir(target) and not any(ch in target for ch in "*?["):
+        try:
+            process_pdf(target, incremental=args.incremental, resume=args.resume)
+        except FileNotFoundError as e:
+            print(f"❌ {e}")
+            sys.exit(1)
+        return
+
+    pdf_paths = []
+    for pattern in args.paths:
+        pdf_paths.extend(collect_pdf_paths(pattern))
+    pdf_paths = sorted(set(pdf_paths))
+
+    if not pdf_paths:
+        print(f"❌ Nenhum PDF encontrado em: {', '.join(args.paths)}")
+        sys.exit(1)
+
+    results = ingest_bulk(pdf_paths, workers=args.workers, incremental=args.incremental, resume=args.resume)
+    if any(r["status"] != "success" for r in results):
+        sys.exit(1)
+
 
+if __name__ == "__main__":
+    main()
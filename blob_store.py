@@ -0,0 +1,161 @@
+"""
+🗄️ BLOB STORE - Imagens binárias endereçadas por conteúdo em PERSIST_DIR/blobs
+
+O docstore.pkl guardava cada imagem como string base64 (+33% de tamanho), e
+toda tabela aparecia duas vezes: como screenshot e dentro do elemento Table
+pickled (metadata.image_base64). A API carregava tudo isso na RAM.
+
+- Arquivo: PERSIST_DIR/blobs/<sha256[:2]>/<sha256> (bytes da imagem)
+- No docstore fica só a referência "blob:sha256:<hash>" (no lugar da string
+  base64 e de metadata.image_base64 de tabelas/elementos)
+- Mesmo conteúdo = mesmo arquivo: imagens repetidas são gravadas uma vez
+- Leitura sob demanda (load_base64) só das imagens que vão para o prompt
+- collect_garbage() remove blobs sem referência no docstore
+
+Uso:
+    ref = put_base64(persist_directory, image_b64)
+    ...
+    image_b64 = resolve_base64(persist_directory, docstore_value)
+"""
+
+import os
+import time
+import hashlib
+from base64 import b64decode, b64encode
+from typing import Iterable, Optional, Set
+
+BLOB_DIRNAME = "blobs"
+BLOB_REF_PREFIX = "blob:sha256:"
+
+# Blobs recém-gravados ficam protegidos do GC (ingestão ainda sem docstore salvo)
+BLOB_GC_GRACE_SECONDS = float(os.getenv("BLOB_GC_GRACE_SECONDS", "21600"))
+
+
+def is_blob_ref(value) -> bool:
+    return isinstance(value, str) and value.startswith(BLOB_REF_PREFIX)
+
+
+def _blob_path(persist_directory: str, digest: str) -> str:
+    return os.path.join(persist_directory, BLOB_DIRNAME, digest[:2], digest)
+
+
+def put_bytes(persist_directory: str, data: bytes) -> str:
+    """Grava os bytes (se ainda não existirem). Returns: referência blob:sha256:<hash>"""
+    digest = hashlib.sha256(data).hexdigest()
+    path = _blob_path(persist_directory, digest)
+    if os.path.exists(path):
+        os.utime(path, None)  # Referenciado de novo: protege do GC
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    return BLOB_REF_PREFIX + digest
+
+
+def put_base64(persist_directory: str, image_b64: str) -> str:
+    """Grava uma imagem base64 como binário. Referências já existentes são mantidas"""
+    if is_blob_ref(image_b64):
+        return image_b64
+    return put_bytes(persist_directory, b64decode(image_b64))
+
+
+def blob_exists(persist_directory: str, ref: str) -> bool:
+    return is_blob_ref(ref) and os.path.exists(_blob_path(persist_directory, ref[len(BLOB_REF_PREFIX):]))
+
+
+def load_bytes(persist_directory: str, ref: str) -> bytes:
+    with open(_blob_path(persist_directory, ref[len(BLOB_REF_PREFIX):]), "rb") as f:
+        return f.read()
+
+
+def load_base64(persist_directory: str, ref: str) -> str:
+    return b64encode(load_bytes(persist_directory, ref)).decode("utf-8")
+
+
+def resolve_base64(persist_directory: str, value) -> Optional[str]:
+    """Base64 de um valor do docstore: carrega do disco se for referência, senão devolve como está"""
+    if is_blob_ref(value):
+        try:
+            return load_base64(persist_directory, value)
+        except OSError:
+            return None
+    return value
+
+
+def externalize_element_images(persist_directory: str, element):
+    """
+    Move metadata.image_base64 de um elemento Unstructured (e dos seus
+    orig_elements) para o blob store, deixando a referência no lugar
+    """
+    metadata = getattr(element, "metadata", None)
+    if metadata is None or isinstance(metadata, dict):
+        return element
+
+    image_b64 = getattr(metadata, "image_base64", None)
+    if image_b64 and not is_blob_ref(image_b64):
+        try:
+            metadata.image_base64 = put_base64(persist_directory, image_b64)
+        except ValueError:
+            pass  # base64 inválido: mantém como está
+
+    for orig in getattr(metadata, "orig_elements", None) or []:
+        externalize_element_images(persist_directory, orig)
+    return element
+
+
+def _element_refs(element, refs: Set[str]):
+    metadata = getattr(element, "metadata", None)
+    if metadata is None or isinstance(metadata, dict):
+        return
+    image_b64 = getattr(metadata, "image_base64", None)
+    if is_blob_ref(image_b64):
+        refs.add(image_b64)
+    for orig in getattr(metadata, "orig_elements", None) or []:
+        _element_refs(orig, refs)
+
+
+def referenced_blobs(docstore_values: Iterable) -> Set[str]:
+    """Hashes de todos os blobs referenciados pelos valores do docstore"""
+    refs: Set[str] = set()
+    for value in docstore_values:
+        if is_blob_ref(value):
+            refs.add(value)
+        else:
+            _element_refs(value, refs)
+    return {ref[len(BLOB_REF_PREFIX):] for ref in refs}
+
+
+def collect_garbage(persist_directory: str, docstore_values: Iterable) -> int:
+    """
+    Remove blobs que nenhum valor do docstore referencia
+
+    Blobs gravados há menos de BLOB_GC_GRACE_SECONDS são mantidos: podem ser de
+    uma ingestão em andamento cujo docstore ainda não foi salvo.
+
+    Returns:
+        int: Quantidade de blobs removidos
+    """
+    blob_root = os.path.join(persist_directory, BLOB_DIRNAME)
+    if not os.path.isdir(blob_root):
+        return 0
+
+    referenced = referenced_blobs(docstore_values)
+    cutoff = time.time() - BLOB_GC_GRACE_SECONDS
+    removed = 0
+    for prefix in os.listdir(blob_root):
+        prefix_dir = os.path.join(blob_root, prefix)
+        if not os.path.isdir(prefix_dir):
+            continue
+        for name in os.listdir(prefix_dir):
+            path = os.path.join(prefix_dir, name)
+            if name in referenced or name.endswith(".tmp"):
+                continue
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    removed += 1
+            except OSError:
+                pass
+    return removed
@@ -10,18 +10,14 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
-# Verificar API key do Cohere
-if not os.getenv("COHERE_API_KEY"):
-    print("❌ COHERE_API_KEY não configurada no .env")
-    print("Adicione: COHERE_API_KEY=sua_chave")
-    exit(1)
 
-modo_api = '--api' in sys.argv
-
-if modo_api:
+def run_api():
     # ========================================================================
     # MODO API
     # ========================================================================
+    # Estado compartilhado com as rotas (que declaram global): fica no módulo
+    global _docstore, _cached_retriever, _cached_num_docs, _last_docstore_mtime, retriever, vectorstore
+
     from flask import Flask, request, jsonify, render_template_string, Response
     from flask_cors import CORS
     import time
@@ -53,6 +49,25 @@ if modo_api:
     # Railway Volume
     persist_directory = os.getenv("PERSIST_DIR", "./knowledge")
 
+    # 🚦 Orçamento de API compartilhado com a ingestão (ver rate_limiter.py)
+    from rate_limiter import get_rate_limiter, rate_limited_embeddings, rate_limited_reranker
+    rate_limiter = get_rate_limiter(persist_directory)
+
+    # 🗄️ Imagens no docstore são referências ao blob store (bytes lidos sob demanda)
+    from blob_store import resolve_base64, is_blob_ref, blob_exists
+
+    def query_embeddings():
+        """OpenAIEmbeddings da consulta, consumindo o mesmo orçamento da ingestão"""
+        return rate_limited_embeddings(
+            OpenAIEmbeddings(model="text-embedding-3-large"), rate_limiter, "text-embedding-3-large"
+        )
+
+    # ✅ Ingestão em processo: pipeline e modelos (KeyBERT, unstructured) aquecidos
+    # em background desde o startup, em vez de um subprocess por upload
+    from ingestion_worker import get_ingestion_worker
+    if os.getenv("INGESTION_WORKER_WARMUP", "true").lower() == "true":
+        get_ingestion_worker()
+
     # ===========================================================================
     # 🖼️ IMAGE CONVERSION: Convert all images to JPEG for GPT-4 Vision
     # ===========================================================================
@@ -115,7 +130,7 @@ if modo_api:
 
     vectorstore = Chroma(
         collection_name="knowledge_base",
-        embedding_function=OpenAIEmbeddings(model="text-embedding-3-large"),  # Modelo novo, melhor semântica
+        embedding_function=query_embeddings(),  # Modelo novo, melhor semântica
         persist_directory=persist_directory
     )
 
@@ -133,7 +148,6 @@ if modo_api:
     store = load_docstore()
 
     # ✅ GLOBAL: Guardar referência ao docstore para parse_docs() acessar
-    global _docstore
     _docstore = store
 
     base_retriever = MultiVectorRetriever(
@@ -213,8 +227,9 @@ if modo_api:
         # 🔥 EXTRAIR KEYWORDS DA QUERY PARA BUSCA MAIS PRECISA
         extracted_terms = []
         try:
-            from keybert import KeyBERT
-            kw_model = KeyBERT()
+            # Mesmo encoder do enriquecimento (carregado uma vez por processo)
+            from metadata_extractors import get_keybert
+            kw_model = get_keybert()
             # Extrair top 3 keywords/phrases
             keywords = kw_model.extract_keywords(
                 question,
@@ -278,6 +293,8 @@ if modo_api:
                             if _docstore and hasattr(_docstore, 'mget'):
                                 try:
                                     doc_obj = _docstore.mget([doc_id])[0]
+                                    if is_blob_ref(doc_obj) and not blob_exists(persist_directory, doc_obj):
+                                        doc_obj = None  # Blob removido do disco
                                     if doc_obj:
                                         found_images.append(img)
                                         seen_doc_ids.add(doc_id)
@@ -368,6 +385,9 @@ if modo_api:
                     ))
                     if i < 3:
                         print(f"      → Convertido via text")
+                elif is_blob_ref(doc):
+                    # Referência de imagem (sem texto): imagens entram via force_include_images
+                    continue
                 elif isinstance(doc, str):
                     converted.append(Document(page_content=doc, metadata={}))
                     if i < 3:
@@ -436,7 +456,7 @@ meta glicemia alvo paciente UTI terapia intensiva
 hiperglicemia hipoglicemia controle glicose doente grave"""
 
         try:
-            llm = ChatOpenAI(model="gpt-4o-mini", temperature=0.3)
+            llm = ChatOpenAI(model="gpt-4o-mini", temperature=0.3, **rate_limiter.chat_model_kwargs("gpt-4o-mini"))
             chain = llm | StrOutputParser()
             result = chain.invoke(prompt)
             
@@ -476,7 +496,7 @@ hiperglicemia hipoglicemia controle glicose doente grave"""
         # 2. Recarregar Chroma vectorstore (pega embeddings novos do disco)
         fresh_vectorstore = Chroma(
             collection_name="knowledge_base",
-            embedding_function=OpenAIEmbeddings(model="text-embedding-3-large"),
+            embedding_function=query_embeddings(),
             persist_directory=persist_directory
         )
 
@@ -516,6 +536,8 @@ hiperglicemia hipoglicemia controle glicose doente grave"""
                             page_content=doc.text,
                             metadata=metadata
                         ))
+                    elif is_blob_ref(doc):
+                        continue  # Referência de imagem (sem texto)
                     elif isinstance(doc, str):
                         converted.append(Document(page_content=doc, metadata={}))
                     else:
@@ -695,7 +717,8 @@ hiperglicemia hipoglicemia controle glicose doente grave"""
     # ===========================================================================
     print("🔥 Inicializando Cohere Reranker...")
 
-    compressor = CohereRerank(
+    compressor = rate_limited_reranker(
+        rate_limiter,
         model="rerank-v3.5",  # Latest unified model (multilingual + better performance)
         top_n=15  # ✅ INCREASED: 15 chunks for better coverage (Reddit insights)
     )
@@ -747,6 +770,8 @@ hiperglicemia hipoglicemia controle glicose doente grave"""
 
                         # Tentar buscar a imagem do docstore
                         image_obj = _docstore.mget([doc_id])[0]
+                        # 🗄️ Referência do blob store: bytes lidos do disco só aqui
+                        image_obj = resolve_base64(persist_directory, image_obj)
                         if image_obj:
                             # Image object da Unstructured tem .text com base64
                             image_base64 = image_obj.text if hasattr(image_obj, 'text') else str(image_obj)
@@ -863,7 +888,7 @@ RESPOSTA (baseada SOMENTE no contexto acima, com inferências lógicas documenta
     } | RunnablePassthrough().assign(
         response=(
             RunnableLambda(build_prompt)
-            | ChatOpenAI(model="gpt-4o")  # Upgrade: +60% melhor inferência vs 4o-mini
+            | ChatOpenAI(model="gpt-4o", **rate_limiter.chat_model_kwargs("gpt-4o"))  # Upgrade: +60% melhor inferência vs 4o-mini
             | StrOutputParser()
         )
     )
@@ -1035,7 +1060,7 @@ RESPOSTA (baseada SOMENTE no contexto acima, com inferências lógicas documenta
                     # Criar nova instância do Chroma para dados atualizados
                     fresh_vectorstore = Chroma(
                         collection_name="knowledge_base",
-                        embedding_function=OpenAIEmbeddings(model="text-embedding-3-large"),
+                        embedding_function=query_embeddings(),
                         persist_directory=persist_directory
                     )
 
@@ -1100,7 +1125,7 @@ RESPOSTA (baseada SOMENTE no contexto acima, com inferências lógicas documenta
             } | RunnablePassthrough().assign(
                 response=(
                     RunnableLambda(build_prompt)
-                    | ChatOpenAI(model="gpt-4o")
+                    | ChatOpenAI(model="gpt-4o", **rate_limiter.chat_model_kwargs("gpt-4o"))
                     | StrOutputParser()
                 )
             )
@@ -1582,7 +1607,7 @@ RESPOSTA (baseada SOMENTE no contexto acima, com inferências lógicas documenta
             # 4. Recriar ChromaDB do zero
             new_vectorstore = Chroma(
                 collection_name="knowledge_base",
-                embedding_function=OpenAIEmbeddings(model="text-embedding-3-large"),
+                embedding_function=query_embeddings(),
                 persist_directory=persist_directory
             )
 
@@ -1692,11 +1717,10 @@ RESPOSTA (baseada SOMENTE no contexto acima, com inferências lógicas documenta
 
             # 3.5. Recriar ChromaDB vazio (evita "no such table" error)
             from langchain_chroma import Chroma
-            from langchain_openai import OpenAIEmbeddings
 
             new_vectorstore = Chroma(
                 collection_name="knowledge_base",
-                embedding_function=OpenAIEmbeddings(model="text-embedding-3-large"),
+                embedding_function=query_embeddings(),
                 persist_directory=persist_directory
             )
             deleted_files.append("chromadb_recreated")
@@ -2700,7 +2724,7 @@ RESPOSTA (baseada SOMENTE no contexto acima, com inferências lógicas documenta
             try:
                 fresh_vectorstore = Chroma(
                     collection_name="knowledge_base",
-                    embedding_function=OpenAIEmbeddings(model="text-embedding-3-large"),
+                    embedding_function=query_embeddings(),
                     persist_directory=persist_directory
                 )
 
@@ -2858,14 +2882,16 @@ RESPOSTA (baseada SOMENTE no contexto acima, com inferências lógicas documenta
         save_path = os.path.join('content', f.filename)
         f.save(save_path)
 
-        # Processar usando o script existente
-        try:
-            import subprocess, sys
-            proc = subprocess.run([sys.executable, 'adicionar_pdf.py', save_path], capture_output=True, text=True, timeout=1800)
-            if proc.returncode != 0:
-                return jsonify({"error": proc.stderr.strip() or proc.stdout.strip() or "Falha ao processar"}), 500
-        except Exception as e:
-            return jsonify({"error": str(e)}), 500
+        # ✅ Processar no ingestion worker (modelos já carregados, sem subprocess)
+        job = get_ingestion_worker().submit(save_path)
+        if not job.wait(timeout=1800):
+            return jsonify({"error": "Timeout: processamento ainda em andamento", "job_id": job.job_id}), 504
+        if job.status != "success":
+            return jsonify({
+                "error": job.error or "Falha ao processar",
+                "traceback": job.traceback,
+                "job_id": job.job_id,
+            }), 500
 
         # ✅ INVALIDAR CACHE E FORÇAR REBUILD IMEDIATO
         global _last_docstore_mtime, _cached_retriever
@@ -2885,9 +2911,19 @@ RESPOSTA (baseada SOMENTE no contexto acima, com inferências lógicas documenta
         return jsonify({
             "message": "PDF processado e adicionado ao knowledge base",
             "filename": f.filename,
+            "job_id": job.job_id,
+            "pdf_id": job.doc_info.get("pdf_id") if job.doc_info else None,
             "total_docs": num_docs if 'num_docs' in locals() else "unknown"
         })
 
+    @app.route('/upload-jobs/<job_id>', methods=['GET'])
+    def upload_job_status(job_id):
+        """Status + eventos de progresso estruturados de um upload"""
+        job = get_ingestion_worker().get_job(job_id)
+        if job is None:
+            return jsonify({"error": "Job não encontrado"}), 404
+        return jsonify(job.to_dict())
+
     @app.route('/test-direct-query', methods=['POST', 'GET'])
     def test_direct_query():
         """
@@ -3032,28 +3068,21 @@ RESPOSTA (baseada SOMENTE no contexto acima, com inferências lógicas documenta
         save_path = os.path.join('content', f.filename)
         f.save(save_path)
 
+        job = get_ingestion_worker().submit(save_path)
+        # ?format=json → cada linha "data:" é o evento estruturado completo (JSON)
+        as_json = request.args.get('format') == 'json'
+
         def generate():
-            import subprocess, sys
+            import json
             try:
-                # Iniciar processo com streaming
-                proc = subprocess.Popen(
-                    [sys.executable, 'adicionar_pdf.py', save_path],
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.STDOUT,
-                    text=True,
-                    bufsize=1,
-                    universal_newlines=True
-                )
-                
-                # Stream output linha por linha
-                for line in iter(proc.stdout.readline, ''):
-                    if line:
-                        yield f"data: {line.strip()}\n\n"
-                
-                # Aguardar processo terminar
-                proc.wait()
+                # Eventos de progresso estruturados do ingestion worker
+                for event in job.iter_events():
+                    if as_json:
+                        yield f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+                    else:
+                        yield f"data: {event['message']}\n\n"
 
-                if proc.returncode == 0:
+                if job.status == "success":
                     # ✅ INVALIDAR CACHE E FORÇAR REBUILD IMEDIATO
                     global _last_docstore_mtime, _cached_retriever
                     _last_docstore_mtime = None
@@ -3070,12 +3099,14 @@ RESPOSTA (baseada SOMENTE no contexto acima, com inferências lógicas documenta
                         _last_docstore_mtime = None
                         yield f"data: PDF processado, mas retriever será recarregado na próxima query\n\n"
                 else:
-                    yield f"data: Erro no processamento (codigo {proc.returncode})\n\n"
+                    yield f"data: Erro no processamento: {job.error}\n\n"
 
             except Exception as e:
                 yield f"data: Erro: {str(e)}\n\n"
 
-        return Response(generate(), mimetype='text/plain')
+        response = Response(generate(), mimetype='text/plain')
+        response.headers['X-Job-Id'] = job.job_id
+        return response
 
     @app.route('/clear-cache', methods=['POST'])
     def clear_cache():
@@ -3255,6 +3286,7 @@ RESPOSTA (baseada SOMENTE no contexto acima, com inferências lógicas documenta
     print("  GET  /ui      → Upload UI")
     print("  GET  /chat    → Chat UI")
     print("  POST /upload  → Enviar PDF (multipart)")
+    print("  GET  /upload-jobs/<job_id> → Progresso estruturado de um upload")
     print("  POST /query   → Fazer pergunta (com rerank)")
     print("  POST /clear-cache → Limpar cache do retriever (use após deletar docs)")
     print("\n💡 Teste no navegador: http://localhost:5001/ui")
@@ -3265,7 +3297,8 @@ RESPOSTA (baseada SOMENTE no contexto acima, com inferências lógicas documenta
     port = int(os.getenv('PORT', 5001))
     app.run(host='0.0.0.0', port=port, debug=False)
 
-else:
+
+def run_terminal():
     # ========================================================================
     # MODO TERMINAL
     # ========================================================================
@@ -3299,6 +3332,19 @@ else:
     from PIL import Image
     import io
 
+    # 🚦 Orçamento de API compartilhado com a ingestão (ver rate_limiter.py)
+    from rate_limiter import get_rate_limiter, rate_limited_embeddings, rate_limited_reranker
+    rate_limiter = get_rate_limiter(persist_directory)
+
+    # 🗄️ Imagens no docstore são referências ao blob store (bytes lidos sob demanda)
+    from blob_store import resolve_base64, is_blob_ref, blob_exists
+
+    def query_embeddings():
+        """OpenAIEmbeddings da consulta, consumindo o mesmo orçamento da ingestão"""
+        return rate_limited_embeddings(
+            OpenAIEmbeddings(model="text-embedding-3-large"), rate_limiter, "text-embedding-3-large"
+        )
+
     # ===========================================================================
     # 🖼️ IMAGE CONVERSION: Convert all images to JPEG for GPT-4 Vision
     # ===========================================================================
@@ -3361,7 +3407,7 @@ else:
 
     vectorstore = Chroma(
         collection_name="knowledge_base",
-        embedding_function=OpenAIEmbeddings(model="text-embedding-3-large"),  # Modelo novo, melhor semântica
+        embedding_function=query_embeddings(),  # Modelo novo, melhor semântica
         persist_directory=persist_directory
     )
     
@@ -3457,6 +3503,8 @@ else:
                             if _docstore and hasattr(_docstore, 'mget'):
                                 try:
                                     doc_obj = _docstore.mget([doc_id])[0]
+                                    if is_blob_ref(doc_obj) and not blob_exists(persist_directory, doc_obj):
+                                        doc_obj = None  # Blob removido do disco
                                     if doc_obj:
                                         found_images.append(img)
                                         seen_doc_ids.add(doc_id)
@@ -3543,6 +3591,9 @@ else:
                     ))
                     if i < 3:
                         print(f"      → Convertido via text")
+                elif is_blob_ref(doc):
+                    # Referência de imagem (sem texto): imagens entram via force_include_images
+                    continue
                 elif isinstance(doc, str):
                     converted.append(Document(page_content=doc, metadata={}))
                     if i < 3:
@@ -3572,7 +3623,8 @@ else:
 
     # 🔥 RERANKER COHERE
     print("🔥 Inicializando Cohere Reranker...")
-    compressor = CohereRerank(
+    compressor = rate_limited_reranker(
+        rate_limiter,
         model="rerank-v3.5",  # Latest unified model (multilingual + better performance)
         top_n=8  # ✅ OTIMIZADO: Aumentado de 5→8 para perguntas complexas/abstratas
     )
@@ -3645,6 +3697,8 @@ else:
 
                         # Tentar buscar a imagem do docstore
                         image_obj = _docstore.mget([doc_id])[0]
+                        # 🗄️ Referência do blob store: bytes lidos do disco só aqui
+                        image_obj = resolve_base64(persist_directory, image_obj)
                         if image_obj:
                             # Image object da Unstructured tem .text com base64
                             image_base64 = image_obj.text if hasattr(image_obj, 'text') else str(image_obj)
@@ -3761,7 +3815,7 @@ RESPOSTA (baseada SOMENTE no contexto acima, com inferências lógicas documenta
     } | RunnablePassthrough().assign(
         response=(
             RunnableLambda(build_prompt)
-            | ChatOpenAI(model="gpt-4o")  # Upgrade: +60% melhor inferência vs 4o-mini
+            | ChatOpenAI(model="gpt-4o", **rate_limiter.chat_model_kwargs("gpt-4o"))  # Upgrade: +60% melhor inferência vs 4o-mini
             | StrOutputParser()
         )
     )
@@ -3803,3 +3857,21 @@ RESPOSTA (baseada SOMENTE no contexto acima, com inferências lógicas documenta
         except Exception as e:
             print(f"❌ Erro: {str(e)[:100]}\n")
 
+
+def main():
+    # Verificar API key do Cohere
+    if not os.getenv("COHERE_API_KEY"):
+        print("❌ COHERE_API_KEY não configurada no .env")
+        print("Adicione: COHERE_API_KEY=sua_chave")
+        exit(1)
+
+    if '--api' in sys.argv:
+        run_api()
+    else:
+        run_terminal()
+
+
+# Processos filhos com spawn (enriquecimento, conversão de imagens) reimportam
+# este script como __mp_main__: API e terminal só sobem no processo principal
+if __name__ == "__main__":
+    main()
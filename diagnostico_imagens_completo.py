@@ -10,6 +10,7 @@ import os
 import pickle
 from dotenv import load_dotenv
 from base64 import b64decode
+from blob_store import resolve_base64, is_blob_ref
 
 load_dotenv()
 
@@ -84,8 +85,15 @@ text_count = 0
 table_count = 0
 unknown_count = 0
 
+missing_blobs = 0
 for doc_id, content in docstore.items():
     # Tentar identificar tipo
+    if is_blob_ref(content):
+        # Imagem no blob store (docstore guarda só a referência)
+        content = resolve_base64(PERSIST_DIR, content)
+        if content is None:
+            missing_blobs += 1
+            continue
     if isinstance(content, str):
         # String: pode ser imagem base64 ou texto
         try:
@@ -115,6 +123,8 @@ print(f"      Imagens (base64): {image_count}")
 print(f"      Textos: {text_count}")
 print(f"      Tabelas: {table_count}")
 print(f"      Desconhecido: {unknown_count}")
+if missing_blobs:
+    print(f"      ⚠️  Referências de blob sem arquivo em {PERSIST_DIR}/blobs: {missing_blobs}")
 
 if image_count == 0:
     print(f"\n   ❌ PROBLEMA: Nenhuma imagem encontrada no docstore!")
@@ -211,7 +221,7 @@ try:
         # Verificar se é imagem (base64)
         if isinstance(doc, str):
             try:
-                b64decode(doc[:100])
+                b64decode(resolve_base64(PERSIST_DIR, doc)[:100])
                 images_in_results += 1
             except:
                 pass
@@ -10,6 +10,7 @@ from langchain_chroma import Chroma
 from langchain_openai import OpenAIEmbeddings
 from langchain.storage import InMemoryStore
 from langchain.retrievers.multi_vector import MultiVectorRetriever
+from blob_store import is_blob_ref
 
 load_dotenv()
 
@@ -65,7 +66,7 @@ try:
     # Analisar tipos
     types_count = {}
     for doc in list(store.store.values())[:100]:  # Sample de 100
-        doc_type = type(doc).__name__
+        doc_type = "imagem (blob store)" if is_blob_ref(doc) else type(doc).__name__
         types_count[doc_type] = types_count.get(doc_type, 0) + 1
 
     print("\n   Tipos de documentos no docstore:")
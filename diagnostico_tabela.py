@@ -6,6 +6,7 @@ Diagnóstico de como a Tabela 1 (Estratificação de Risco) foi chunkeada
 import os
 import pickle
 from dotenv import load_dotenv
+from blob_store import is_blob_ref
 
 load_dotenv()
 
@@ -31,6 +32,9 @@ print("🔍 Procurando chunks da tabela de risco...\n")
 
 relevant_chunks = []
 for chunk_id, doc in docstore.items():
+    if is_blob_ref(doc):
+        continue  # Imagem no blob store, não é texto
+
     # Extrair texto do chunk
     text = ""
     if hasattr(doc, 'text'):
@@ -233,6 +233,21 @@ def delete_document(pdf_id: str, persist_directory: str = "./knowledge") -> Dict
             with open(docstore_path, 'wb') as f:
                 pickle.dump(docstore, f)
 
+            # Blobs de imagem que só este documento referenciava
+            try:
+                from blob_store import collect_garbage
+                removed_blobs = collect_garbage(persist_directory, docstore.values())
+                debug_logs.append(f"✓ {removed_blobs} blobs de imagem removidos")
+            except Exception as e:
+                debug_logs.append(f"⚠️ Erro ao limpar blobs de imagem: {str(e)}")
+
+        # 4.1 Remover imagens do índice perceptual global
+        try:
+            from image_index import get_image_index
+            get_image_index(persist_directory).remove(chunk_ids)
+        except Exception as e:
+            debug_logs.append(f"⚠️ Erro ao atualizar índice de imagens: {str(e)}")
+
         # 5. Atualizar metadata.pkl
         if 'documents' in metadata and pdf_id in metadata['documents']:
             del metadata['documents'][pdf_id]
@@ -279,6 +294,30 @@ def check_duplicate(file_path: str, persist_directory: str = "./knowledge") -> O
     return get_document_by_id(pdf_id, persist_directory)
 
 
+def find_document_by_filename(filename: str, persist_directory: str = "./knowledge") -> Optional[Dict]:
+    """
+    Busca o documento mais recente registrado com o mesmo nome de arquivo
+
+    Útil para novas edições de um PDF (conteúdo diferente → pdf_id diferente)
+
+    Args:
+        filename: Nome do arquivo (ex: "Diretriz Diabetes 2025.pdf")
+        persist_directory: Diretório do knowledge base
+
+    Returns:
+        dict: Informações do documento ou None se não encontrado
+    """
+    matches = [
+        doc for doc in get_all_documents(persist_directory)["documents"]
+        if doc.get("filename") == filename or doc.get("original_filename") == filename
+    ]
+    if not matches:
+        return None
+
+    # get_all_documents() já ordena por uploaded_at (mais recente primeiro)
+    return get_document_by_id(matches[0]["pdf_id"], persist_directory)
+
+
 def get_global_stats(persist_directory: str = "./knowledge") -> Dict:
     """
     Retorna estatísticas globais do knowledge base
@@ -0,0 +1,193 @@
+"""
+💾 EMBEDDING CACHE - Cache persistente de embeddings endereçado por conteúdo
+
+Evita re-embedar chunks idênticos em reprocessamentos (check_duplicate →
+delete_document → re-ingestão) e em migrações que preservam o modelo.
+
+- Chave: SHA256(modelo + texto embedado)
+- Armazenamento: SQLite em PERSIST_DIR/embedding_cache.sqlite3
+- Eviction: LRU por tamanho total (EMBEDDING_CACHE_MAX_MB)
+
+Uso:
+    embeddings = get_cached_embeddings(persist_directory)
+    vectorstore = Chroma(..., embedding_function=embeddings)
+"""
+
+import os
+import time
+import hashlib
+import sqlite3
+import threading
+from array import array
+from contextlib import contextmanager
+from typing import List, Optional
+
+from langchain_core.embeddings import Embeddings
+
+EMBEDDING_MODEL = "text-embedding-3-large"
+
+# Tamanho máximo do cache em disco (0 = cache desativado)
+EMBEDDING_CACHE_MAX_MB = float(os.getenv("EMBEDDING_CACHE_MAX_MB", "1024"))
+
+CACHE_FILENAME = "embedding_cache.sqlite3"
+
+
+def embedding_cache_key(model: str, text: str) -> str:
+    """Hash do input de embedding + nome do modelo"""
+    return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).hexdigest()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wrapper de Embeddings com cache persistente em SQLite
+
+    Apenas embed_documents() usa o cache (ingestão). embed_query() é repassado
+    direto ao modelo: perguntas raramente se repetem byte a byte.
+    """
+
+    def __init__(self, underlying: Embeddings, model: str, cache_path: str, max_bytes: int):
+        self.underlying = underlying
+        self.model = model
+        self.cache_path = cache_path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS embeddings (
+                    key TEXT PRIMARY KEY,
+                    model TEXT NOT NULL,
+                    vector BLOB NOT NULL,
+                    size_bytes INTEGER NOT NULL,
+                    last_used REAL NOT NULL
+                )"""
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings(last_used)")
+
+    @contextmanager
+    def _connect(self):
+        """Conexão curta: commit no sucesso, sempre fechada no final"""
+        conn = sqlite3.connect(self.cache_path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [embedding_cache_key(self.model, text) for text in texts]
+        vectors: List[Optional[List[float]]] = [None] * len(texts)
+
+        with self._lock, self._connect() as conn:
+            found = {}
+            unique_keys = list(set(keys))
+            # SQLite limita o número de parâmetros por query
+            for start in range(0, len(unique_keys), 500):
+                batch = unique_keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = array("f", blob).tolist()
+
+            if found:
+                conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                    [(time.time(), key) for key in found],
+                )
+
+        missing = {}  # key → índice do primeiro texto com essa chave
+        for i, key in enumerate(keys):
+            if key in found:
+                vectors[i] = found[key]
+            elif key not in missing:
+                missing[key] = i
+
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+
+        if missing:
+            new_vectors = self.underlying.embed_documents([texts[i] for i in missing.values()])
+            computed = dict(zip(missing.keys(), new_vectors))
+            for i, key in enumerate(keys):
+                if vectors[i] is None:
+                    vectors[i] = computed[key]
+            self._store(computed)
+
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.underlying.embed_query(text)
+
+    def _store(self, computed: dict):
+        now = time.time()
+        rows = []
+        for key, vector in computed.items():
+            blob = array("f", vector).tobytes()
+            rows.append((key, self.model, blob, len(blob), now))
+
+        with self._lock, self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, model, vector, size_bytes, last_used) VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._evict(conn)
+
+    def _evict(self, conn):
+        """Remove os embeddings menos usados até ficar abaixo de 90% do limite"""
+        total = conn.execute("SELECT COALESCE(SUM(size_bytes), 0) FROM embeddings").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        target = int(self.max_bytes * 0.9)
+        to_delete = []
+        for key, size in conn.execute("SELECT key, size_bytes FROM embeddings ORDER BY last_used ASC"):
+            if total <= target:
+                break
+            to_delete.append((key,))
+            total -= size
+
+        conn.executemany("DELETE FROM embeddings WHERE key = ?", to_delete)
+        print(f"   🧹 Embedding cache: {len(to_delete)} entradas antigas removidas (limite {self.max_bytes / 1024 / 1024:.0f}MB)")
+
+    def stats(self) -> dict:
+        """Hits/misses desta instância + tamanho atual do cache"""
+        with self._connect() as conn:
+            entries, total = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM embeddings"
+            ).fetchone()
+        return {"hits": self.hits, "misses": self.misses, "entries": entries, "size_bytes": total}
+
+
+def get_cached_embeddings(persist_directory: str, model: str = EMBEDDING_MODEL, **kwargs) -> Embeddings:
+    """
+    Retorna OpenAIEmbeddings envolvido pelo cache persistente em persist_directory
+
+    Com EMBEDDING_CACHE_MAX_MB=0 retorna o OpenAIEmbeddings sem cache. Só os
+    textos ausentes do cache chegam à API, passando pelo rate limiter compartilhado.
+
+    Args:
+        persist_directory: Diretório do knowledge base (PERSIST_DIR)
+        model: Modelo de embeddings (parte da chave do cache)
+        **kwargs: Repassados ao OpenAIEmbeddings (ex: chunk_size)
+    """
+    from langchain_openai import OpenAIEmbeddings
+    from rate_limiter import get_rate_limiter, rate_limited_embeddings
+
+    underlying = rate_limited_embeddings(
+        OpenAIEmbeddings(model=model, **kwargs), get_rate_limiter(persist_directory), model
+    )
+    if EMBEDDING_CACHE_MAX_MB <= 0:
+        return underlying
+
+    return CachedEmbeddings(
+        underlying=underlying,
+        model=model,
+        cache_path=os.path.join(persist_directory, CACHE_FILENAME),
+        max_bytes=int(EMBEDDING_CACHE_MAX_MB * 1024 * 1024),
+    )
@@ -0,0 +1,263 @@
+"""
+⏱️ ENRICHMENT POOL - Enriquecimento de metadados em processos com timeout real
+
+O timeout antigo do KeyBERT (thread daemon + join) só parava de ESPERAR: a
+thread continuava rodando o modelo em segundo plano, disputando CPU com o
+fallback e com os próximos chunks. Chunks lentos viravam computações zumbis.
+
+- Workers (spawn) carregam o MetadataEnricher UMA vez e recebem lotes de chunks
+- Cada lote tem orçamento de ENRICH_CHUNK_TIMEOUT_SECONDS por chunk
+- Estourou: o processo é MORTO (kill) e recriado; os chunks do lote usam o
+  fallback leve (keywords por regex + entidades + medições) no processo atual
+- Timeouts são reportados por chunk (print + "enrichment_fallback" no metadata)
+
+Mesma interface do MetadataEnricher (enrich / enrich_batch).
+
+Workers usam spawn: o script principal é reimportado em cada um, então a
+API/CLI precisa subir só sob `if __name__ == "__main__"` (ver
+consultar_com_rerank.py).
+
+Uso:
+    enricher = get_enrichment_pool()
+    enriched = enricher.enrich_batch(texts)
+    print(enricher.stats())
+"""
+
+import os
+import time
+import threading
+import multiprocessing
+from multiprocessing.connection import wait
+from typing import Dict, List, Optional
+
+# Processos de enriquecimento (0 = KeyBERT no processo atual, sem timeout real)
+ENRICH_WORKERS = int(os.getenv("ENRICH_WORKERS", "1"))
+
+# Orçamento por chunk (o lote inteiro tem N × orçamento)
+ENRICH_CHUNK_TIMEOUT_SECONDS = float(os.getenv("ENRICH_CHUNK_TIMEOUT_SECONDS", "5"))
+
+# Chunks enviados juntos a um worker (batch do KeyBERT)
+ENRICH_BATCH_SIZE = int(os.getenv("ENRICH_BATCH_SIZE", "16"))
+
+# Carregar KeyBERT no worker (download do modelo na primeira vez)
+ENRICH_WORKER_STARTUP_SECONDS = 300
+
+
+def _worker_main(conn):
+    """Loop do worker: carrega o enricher e responde lotes até receber None"""
+    try:
+        from metadata_extractors import MetadataEnricher
+        enricher = MetadataEnricher()
+    except Exception as e:
+        conn.send(("error", str(e)))
+        return
+    conn.send(("ready", None))
+
+    while True:
+        try:
+            texts = conn.recv()
+        except EOFError:
+            return
+        if texts is None:
+            return
+        try:
+            conn.send(("ok", enricher.enrich_batch(texts)))
+        except Exception as e:
+            conn.send(("error", str(e)))
+
+
+class _Worker:
+    """Um processo de enriquecimento e a ponta do pipe no processo atual"""
+
+    def __init__(self, ctx, target=_worker_main):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=target, args=(child_conn,), daemon=True,
+                                   name="enrichment-worker")
+        self.process.start()
+        child_conn.close()
+        self.ready = False
+
+    def wait_ready(self, timeout: float) -> bool:
+        if not self.ready and self.conn.poll(timeout):
+            try:
+                status, _ = self.conn.recv()
+                self.ready = status == "ready"
+            except EOFError:
+                pass
+        return self.ready
+
+    def kill(self):
+        self.process.kill()
+        self.process.join(timeout=5)
+        self.conn.close()
+
+    def close(self):
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.kill()
+        self.conn.close()
+
+
+class EnrichmentPool:
+    """Pool de processos com MetadataEnricher e timeout que realmente interrompe o trabalho"""
+
+    def __init__(self, workers: int = ENRICH_WORKERS, chunk_timeout: float = ENRICH_CHUNK_TIMEOUT_SECONDS,
+                 batch_size: int = ENRICH_BATCH_SIZE, worker_target=_worker_main):
+        """
+        Args:
+            worker_target: Função do processo worker (padrão: _worker_main;
+                test_enrichment_pool.py usa um worker falso, sem KeyBERT)
+        """
+        from metadata_extractors import MetadataEnricher
+
+        self.chunk_timeout = chunk_timeout
+        self.batch_size = max(1, batch_size)
+        self.timeouts = 0
+        self.errors = 0
+        self.restarts = 0
+        self._ctx = multiprocessing.get_context("spawn")
+        self._worker_target = worker_target
+        self._lock = threading.Lock()
+
+        # Fallback leve (sem KeyBERT) para lotes que estouram o orçamento
+        self.fallback = MetadataEnricher(load_keyword_model=False)
+
+        print(f"🔧 Iniciando {workers} worker(s) de enriquecimento (timeout {chunk_timeout:.0f}s/chunk)...")
+        self._workers = [_Worker(self._ctx, worker_target) for _ in range(max(1, workers))]
+        self.available = all(worker.wait_ready(ENRICH_WORKER_STARTUP_SECONDS) for worker in self._workers)
+        if self.available:
+            print("   ✓ Workers de enriquecimento prontos")
+        else:
+            print("   ⚠️  Worker de enriquecimento não inicializou (KeyBERT): usando fallback regex")
+
+    def _restart(self, index: int):
+        self._workers[index].kill()
+        self._workers[index] = _Worker(self._ctx, self._worker_target)
+        self.restarts += 1
+
+    def enrich(self, text: str, **kwargs) -> Dict:
+        return self.enrich_batch([text], **kwargs)[0]
+
+    def enrich_batch(self, texts: List[str], **kwargs) -> List[Dict]:
+        """
+        Enriquece os chunks nos workers, lote a lote
+
+        Lotes que estouram o orçamento (ou falham) caem no fallback leve e cada
+        chunk afetado é reportado e marcado com "enrichment_fallback".
+
+        Returns:
+            Lista de dicts no formato de MetadataEnricher.enrich(), na ordem de `texts`
+        """
+        if kwargs:
+            # Flags de extração: lote pequeno e raro, sem pool
+            return self.fallback.enrich_batch(texts, **kwargs)
+        if not self.available:
+            return self._fallback_all(texts)
+
+        results: List[Optional[Dict]] = [None] * len(texts)
+        pending = [list(range(start, min(start + self.batch_size, len(texts))))
+                   for start in range(0, len(texts), self.batch_size)]
+
+        with self._lock:
+            running = {}  # índice do worker → (chunks do lote, deadline)
+            while pending or running:
+                # Distribuir lotes para workers livres (reinicia os que morreram)
+                for index in range(len(self._workers)):
+                    if not pending:
+                        break
+                    if index in running:
+                        continue
+                    worker = self._workers[index]
+                    if not worker.process.is_alive():
+                        self._restart(index)
+                        worker = self._workers[index]
+                    if not worker.wait_ready(ENRICH_WORKER_STARTUP_SECONDS):
+                        # Worker não volta (KeyBERT não carrega): resto do documento no fallback
+                        print("   ⚠️  Worker de enriquecimento não reiniciou: usando fallback regex")
+                        self.available = False
+                        for batch in pending:
+                            self._degrade(texts, batch, results, None)
+                        pending = []
+                        break
+                    batch = pending.pop(0)
+                    worker.conn.send([texts[i] for i in batch])
+                    running[index] = (batch, time.monotonic() + self.chunk_timeout * len(batch))
+
+                if not running:
+                    continue
+
+                next_deadline = min(deadline for _, deadline in running.values())
+                ready = wait([self._workers[index].conn for index in running],
+                             timeout=max(0.0, next_deadline - time.monotonic()))
+
+                for index in list(running):
+                    batch, deadline = running[index]
+                    worker = self._workers[index]
+                    if worker.conn in ready:
+                        del running[index]
+                        try:
+                            status, payload = worker.conn.recv()
+                        except EOFError:
+                            status, payload = "error", "worker encerrado"
+                        if status == "ok":
+                            for i, enriched in zip(batch, payload):
+                                results[i] = enriched
+                        else:
+                            self.errors += 1
+                            self._degrade(texts, batch, results, f"erro: {str(payload)[:100]}")
+                    elif time.monotonic() >= deadline:
+                        # Estourou o orçamento: matar o processo de verdade
+                        del running[index]
+                        self._restart(index)
+                        self.timeouts += len(batch)
+                        self._degrade(texts, batch, results, f"timeout ({self.chunk_timeout * len(batch):.0f}s)")
+
+        return results
+
+    def _fallback_all(self, texts):
+        results = [None] * len(texts)
+        self._degrade(texts, range(len(texts)), results, None)
+        return results
+
+    def _degrade(self, texts, batch, results, reason):
+        """Fallback leve para os chunks de um lote, reportando cada um"""
+        if reason:
+            for i in batch:
+                print(f"      ⚠️  Chunk {i}: enriquecimento {reason} → fallback regex")
+        for i, enriched in zip(batch, self.fallback.enrich_batch([texts[i] for i in batch])):
+            enriched["enrichment_fallback"] = True
+            results[i] = enriched
+
+    def stats(self) -> dict:
+        return {"timeouts": self.timeouts, "errors": self.errors, "restarts": self.restarts}
+
+    def close(self):
+        with self._lock:
+            for worker in self._workers:
+                worker.close()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_enrichment_pool():
+    """
+    Enricher do processo (criado uma única vez)
+
+    ENRICH_WORKERS=0 retorna o MetadataEnricher no processo atual: enrich_batch
+    não tem timeout (um lote lento trava a ingestão até terminar).
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            if ENRICH_WORKERS > 0:
+                _pool = EnrichmentPool()
+            else:
+                from metadata_extractors import MetadataEnricher
+                _pool = MetadataEnricher()
+        return _pool
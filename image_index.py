@@ -0,0 +1,219 @@
+"""
+🖼️ IMAGE INDEX - Índice global de imagens por conteúdo (sha256 dos pixels)
+
+Logos de sociedades, emblemas e fluxogramas repetidos entre edições de
+diretrizes aparecem em vários PDFs. Com o índice, uma imagem idêntica a uma já
+armazenada reaproveita:
+
+- a descrição Vision já gerada (sem nova chamada ao gpt-4o-mini)
+- o base64 já presente no docstore (mesmo objeto → gravado uma vez no pickle)
+
+- Chave: sha256 dos pixels decodificados, consulta indexada por igualdade.
+  O hash perceptual confundia figuras parecidas (mesmo gráfico com outros
+  valores, fluxogramas de uma edição para a outra) e reaproveitava a errada
+- dHash 16x16 (256 bits) + aspect ratio continuam gravados por imagem
+- Armazenamento: SQLite em PERSIST_DIR/image_index.sqlite3 (doc_id do
+  docstore, pdf_id, hashes, descrição sem rótulo, versão do prompt)
+
+Uso:
+    index = get_image_index(persist_directory)
+    match = index.find_similar(image_b64, prompt_version="v1")
+    if match:
+        description = match["description"]
+    ...
+    index.add(doc_id, pdf_id, image_b64, description, prompt_version="v1")
+"""
+
+import io
+import os
+import time
+import hashlib
+import sqlite3
+import threading
+from base64 import b64decode
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Dict, Iterable, Optional, Tuple
+
+IMAGE_INDEX_ENABLED = os.getenv("IMAGE_INDEX_ENABLED", "true").lower() == "true"
+
+HASH_SIZE = 16
+INDEX_FILENAME = "image_index.sqlite3"
+
+
+@lru_cache(maxsize=512)
+def perceptual_hash(image_b64: str) -> Optional[Tuple[int, float]]:
+    """
+    dHash da imagem: compara pixels vizinhos de uma miniatura 17x16 em cinza
+
+    Returns:
+        tuple: (hash de 256 bits, aspect ratio) ou None se a imagem não abrir
+    """
+    from PIL import Image
+
+    try:
+        img = Image.open(io.BytesIO(b64decode(image_b64)))
+        width, height = img.size
+        pixels = list(img.convert("L").resize((HASH_SIZE + 1, HASH_SIZE), Image.Resampling.LANCZOS).getdata())
+    except Exception:
+        return None
+
+    value = 0
+    for row in range(HASH_SIZE):
+        offset = row * (HASH_SIZE + 1)
+        for col in range(HASH_SIZE):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value, (width / height if height else 1.0)
+
+
+@lru_cache(maxsize=512)
+def content_hash(image_b64: str) -> str:
+    """sha256 dos pixels decodificados (modo + tamanho + bytes); dos dados se a imagem não abrir"""
+    from PIL import Image
+
+    try:
+        data = b64decode(image_b64)
+    except Exception:
+        return hashlib.sha256(image_b64.encode("utf-8")).hexdigest()
+    try:
+        img = Image.open(io.BytesIO(data))
+        img.load()
+    except Exception:
+        return hashlib.sha256(data).hexdigest()
+
+    digest = hashlib.sha256(f"{img.mode}:{img.size[0]}x{img.size[1]}:".encode("utf-8"))
+    digest.update(img.tobytes())
+    return digest.hexdigest()
+
+
+class ImageIndex:
+    """sha256 dos pixels → (doc_id no docstore, descrição) de todas as imagens armazenadas"""
+
+    def __init__(self, index_path: str):
+        self.index_path = index_path
+        self.reused_descriptions = 0
+        self.reused_blobs = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(index_path), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS images (
+                    doc_id TEXT PRIMARY KEY,
+                    pdf_id TEXT,
+                    phash TEXT NOT NULL,
+                    aspect REAL NOT NULL,
+                    content_hash TEXT,
+                    description TEXT,
+                    prompt_version TEXT,
+                    created REAL NOT NULL
+                )"""
+            )
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(images)")}
+            if "content_hash" not in columns:
+                # Índices antigos: entradas sem hash de conteúdo nunca são reaproveitadas
+                conn.execute("ALTER TABLE images ADD COLUMN content_hash TEXT")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_images_pdf_id ON images(pdf_id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_images_content_hash ON images(content_hash)")
+
+    @contextmanager
+    def _connect(self):
+        """Conexão curta: commit no sucesso, sempre fechada no final"""
+        conn = sqlite3.connect(self.index_path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def find_similar(self, image_b64: str, prompt_version: Optional[str] = None,
+                     exists=None) -> Optional[Dict]:
+        """
+        Imagem armazenada com o mesmo conteúdo de image_b64 (ou None)
+
+        Args:
+            prompt_version: Só considera descrições geradas com esta versão do prompt
+            exists: Filtro opcional doc_id → bool (ex: blob ainda está no docstore?)
+
+        Returns:
+            dict {"doc_id", "pdf_id", "description"}
+        """
+        query = "SELECT doc_id, pdf_id, description FROM images WHERE content_hash = ?"
+        params = (content_hash(image_b64),)
+        if prompt_version is not None:
+            query += " AND prompt_version = ? AND description IS NOT NULL"
+            params += (prompt_version,)
+        query += " ORDER BY created DESC"
+
+        with self._lock, self._connect() as conn:
+            rows = conn.execute(query, params).fetchall()
+
+        for doc_id, pdf_id, description in rows:
+            if exists is not None and not exists(doc_id):
+                continue
+            return {"doc_id": doc_id, "pdf_id": pdf_id, "description": description}
+        return None
+
+    def add(self, doc_id: str, pdf_id: str, image_b64: str, description: Optional[str] = None,
+            prompt_version: Optional[str] = None):
+        """Registra (ou atualiza) uma imagem armazenada no docstore"""
+        image_hash = perceptual_hash(image_b64)
+        if image_hash is None:
+            return
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO images (doc_id, pdf_id, phash, aspect, content_hash, description, "
+                "prompt_version, created) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (doc_id, pdf_id, format(image_hash[0], "x"), image_hash[1], content_hash(image_b64),
+                 description, prompt_version, time.time()),
+            )
+
+    def remove(self, doc_ids: Iterable[str]):
+        """Remove imagens que saíram do docstore (documento deletado, chunks obsoletos)"""
+        doc_ids = [(doc_id,) for doc_id in doc_ids]
+        if not doc_ids:
+            return
+        with self._lock, self._connect() as conn:
+            conn.executemany("DELETE FROM images WHERE doc_id = ?", doc_ids)
+
+    def stats(self) -> dict:
+        with self._connect() as conn:
+            entries = conn.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+        return {"entries": entries, "reused_descriptions": self.reused_descriptions,
+                "reused_blobs": self.reused_blobs}
+
+
+class _DisabledImageIndex:
+    """Mesma interface, sem indexar nada (IMAGE_INDEX_ENABLED=false)"""
+
+    reused_descriptions = 0
+    reused_blobs = 0
+
+    def find_similar(self, image_b64, prompt_version=None, exists=None):
+        return None
+
+    def add(self, doc_id, pdf_id, image_b64, description=None, prompt_version=None):
+        pass
+
+    def remove(self, doc_ids):
+        pass
+
+    def stats(self):
+        return {"entries": 0, "reused_descriptions": 0, "reused_blobs": 0}
+
+
+_indexes: Dict[str, object] = {}
+_indexes_lock = threading.Lock()
+
+
+def get_image_index(persist_directory: str):
+    """Instância única do índice por persist_directory (por processo)"""
+    if not IMAGE_INDEX_ENABLED:
+        return _DisabledImageIndex()
+
+    index_path = os.path.join(os.path.abspath(persist_directory), INDEX_FILENAME)
+    with _indexes_lock:
+        if index_path not in _indexes:
+            _indexes[index_path] = ImageIndex(index_path)
+        return _indexes[index_path]
@@ -0,0 +1,197 @@
+"""
+🖼️ IMAGE TRANSCODE - Conversão de imagens para JPEG em processos paralelos
+
+Decodificar, rotacionar e re-encodar (JPEG optimize=True) é CPU puro: as
+imagens de um documento são convertidas em um pool de processos, e cada
+imagem de origem é convertida no máximo UMA vez por ingestão (memo pelo hash
+da imagem original + auto_rotate). A tabela convertida para o Vision é a
+mesma reaproveitada como screenshot secundário.
+
+Módulo leve de propósito: os workers (spawn) importam só PIL, não o pipeline.
+
+Uso:
+    reset_transcode_memo()  # início de cada documento
+    results = transcode_images(images_b64, auto_rotate=False)  # [(jpeg_b64, success, rotation)]
+    jpeg_b64, success, rotation = convert_image_cached(table_b64, auto_rotate=True)
+"""
+
+import io
+import os
+import hashlib
+import threading
+from base64 import b64decode, b64encode
+from typing import Dict, List, Optional, Tuple
+
+from PIL import Image
+
+# Processos de conversão (1 = converter no processo atual)
+IMAGE_TRANSCODE_WORKERS = int(os.getenv("IMAGE_TRANSCODE_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+# Abaixo disso o custo de enviar as imagens ao pool não compensa
+MIN_IMAGES_FOR_POOL = 2
+
+_transcode_memo: Dict[Tuple[str, bool], tuple] = {}
+_transcode_lock = threading.Lock()
+_transcode_pool = None
+
+
+def convert_image_to_jpeg_base64(image_base64_str, auto_rotate=False):
+    """
+    Converte qualquer formato de imagem para JPEG (suportado por GPT-4 Vision).
+
+    Formatos não suportados: TIFF, BMP, ICO, etc.
+    Formatos suportados: PNG, JPEG, GIF, WEBP
+
+    Esta função garante que TODAS as imagens sejam JPEG válidas.
+
+    Args:
+        image_base64_str: String base64 da imagem
+        auto_rotate: Se True, detecta e corrige orientação vertical (tabelas rotacionadas)
+
+    Returns:
+        tuple: (jpeg_base64, success, rotation_applied)
+    """
+    try:
+        # Decodificar base64 para bytes
+        image_bytes = b64decode(image_base64_str)
+
+        # Abrir imagem com PIL
+        img = Image.open(io.BytesIO(image_bytes))
+
+        rotation_applied = 0
+
+        # ✅ AUTO-ROTATE: Detectar e corrigir orientação vertical
+        if auto_rotate:
+            width, height = img.size
+
+            # Se altura >> largura, provavelmente está rotacionada
+            # Ratio > 1.5 indica orientação vertical/portrait
+            aspect_ratio = height / width if width > 0 else 1
+
+            if aspect_ratio > 1.5:
+                # Rotacionar -90° (270°) no sentido horário (clockwise)
+                # Tabelas verticais geralmente estão rotacionadas 90° para direita no PDF
+                # Então precisamos rotacionar -90° para corrigir
+                img = img.rotate(-90, expand=True)
+                rotation_applied = -90
+                print(f"      🔄 Imagem rotacionada -90° HORÁRIO (aspect ratio: {aspect_ratio:.2f})")
+
+        # Converter para RGB (remove alpha channel se houver)
+        # Isso é necessário porque JPEG não suporta transparência
+        if img.mode in ('RGBA', 'LA', 'P'):
+            # Criar background branco
+            background = Image.new('RGB', img.size, (255, 255, 255))
+
+            # Converter P (palette) para RGBA primeiro
+            if img.mode == 'P':
+                img = img.convert('RGBA')
+
+            # Colar imagem sobre background branco (preserva transparência)
+            if img.mode in ('RGBA', 'LA'):
+                background.paste(img, mask=img.split()[-1])  # Usa alpha channel como máscara
+            else:
+                background.paste(img)
+
+            img = background
+        elif img.mode != 'RGB':
+            # Outros modos (L, CMYK, etc.) → RGB
+            img = img.convert('RGB')
+
+        # Salvar como JPEG em buffer
+        output = io.BytesIO()
+        img.save(output, format='JPEG', quality=85, optimize=True)
+        jpeg_bytes = output.getvalue()
+
+        # Re-encodar para base64
+        jpeg_base64 = b64encode(jpeg_bytes).decode('utf-8')
+
+        return jpeg_base64, True, rotation_applied
+
+    except Exception as e:
+        # Se conversão falhar, retornar None
+        print(f"      ⚠️  Erro ao converter imagem: {str(e)[:100]}")
+        return None, False, 0
+
+
+def _transcode_key(image_base64_str: str, auto_rotate: bool) -> Tuple[str, bool]:
+    return hashlib.sha256(image_base64_str.encode("utf-8")).hexdigest(), auto_rotate
+
+
+def reset_transcode_memo():
+    """Descarta as conversões do documento anterior (memo vale por ingestão)"""
+    with _transcode_lock:
+        _transcode_memo.clear()
+
+
+def set_transcode_workers(workers: int):
+    """Ajusta o pool (ex: 1 dentro dos workers do modo bulk, que já são processos)"""
+    global IMAGE_TRANSCODE_WORKERS, _transcode_pool
+    with _transcode_lock:
+        IMAGE_TRANSCODE_WORKERS = max(1, workers)
+        if _transcode_pool is not None:
+            _transcode_pool.shutdown(wait=False)
+            _transcode_pool = None
+
+
+def _get_pool():
+    """Pool de processos criado sob demanda e mantido aquecido entre documentos"""
+    global _transcode_pool
+    if _transcode_pool is None:
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+
+        # spawn: workers não herdam estado de threads/modelos do processo principal
+        # (mas reimportam o script principal: ele precisa de `if __name__ == "__main__"`)
+        ctx = multiprocessing.get_context("spawn")
+        _transcode_pool = ProcessPoolExecutor(max_workers=IMAGE_TRANSCODE_WORKERS, mp_context=ctx)
+    return _transcode_pool
+
+
+def _convert_in_pool(images: List[str], auto_rotate: bool) -> Optional[list]:
+    """Converte no pool; None se o pool não estiver disponível (converter localmente)"""
+    global _transcode_pool
+    try:
+        with _transcode_lock:
+            pool = _get_pool()
+        chunksize = max(1, len(images) // (IMAGE_TRANSCODE_WORKERS * 4))
+        return list(pool.map(convert_image_to_jpeg_base64, images, [auto_rotate] * len(images), chunksize=chunksize))
+    except Exception as e:
+        print(f"      ⚠️  Pool de conversão indisponível, convertendo localmente: {str(e)[:100]}")
+        with _transcode_lock:
+            _transcode_pool = None
+        return None
+
+
+def transcode_images(images: List[str], auto_rotate: bool = False) -> List[tuple]:
+    """
+    Converte imagens para JPEG (process pool), reaproveitando conversões já feitas
+
+    Returns:
+        list: (jpeg_base64, success, rotation_applied) na ordem de `images`
+    """
+    keys = [_transcode_key(img, auto_rotate) for img in images]
+
+    with _transcode_lock:
+        pending = {}
+        for key, img in zip(keys, images):
+            if key not in _transcode_memo and key not in pending:
+                pending[key] = img
+
+    if pending:
+        to_convert = list(pending.values())
+        results = None
+        if IMAGE_TRANSCODE_WORKERS > 1 and len(to_convert) >= MIN_IMAGES_FOR_POOL:
+            results = _convert_in_pool(to_convert, auto_rotate)
+        if results is None:
+            results = [convert_image_to_jpeg_base64(img, auto_rotate) for img in to_convert]
+
+        with _transcode_lock:
+            _transcode_memo.update(zip(pending.keys(), results))
+
+    with _transcode_lock:
+        return [_transcode_memo[key] for key in keys]
+
+
+def convert_image_cached(image_base64_str: str, auto_rotate: bool = False) -> tuple:
+    """convert_image_to_jpeg_base64() com memo: a mesma imagem não é convertida duas vezes"""
+    return transcode_images([image_base64_str], auto_rotate)[0]
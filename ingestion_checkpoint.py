@@ -0,0 +1,185 @@
+"""
+💾 INGESTION CHECKPOINT - Artefatos por etapa para retomar ingestões interrompidas
+
+Um erro no fim da ingestão (Chroma na escrita, 5xx da OpenAI na
+contextualização de imagens) dispara o ROLLBACK do knowledge base, mas não
+precisa jogar fora partition, extração Vision de tabelas e resumos.
+
+- Local: PERSIST_DIR/checkpoints/<pdf_id>/
+- state.pkl: estado acumulado do documento após a última etapa concluída
+- units/: unidades já anotadas + enriquecidas do pipeline em streaming, com os
+  doc_ids que a unidade grava no knowledge base (registrados ANTES da escrita)
+- manifest.json: etapa concluída + chave de configuração (prompts, chunking...);
+  checkpoints de outra configuração são descartados
+- Removidos após o documento ser registrado com sucesso
+
+O knowledge base continua atômico: checkpoints nunca são visíveis para
+consulta, e a escrita sempre recomeça do zero (rollback + embedding cache).
+No streaming, um processo morto (kill) não chega ao rollback: os doc_ids
+registrados nas unidades viram `orphan_ids` quando o checkpoint é descartado
+ou retomado, e são removidos antes da nova escrita.
+
+Uso:
+    checkpoint = get_checkpoint(persist_directory, pdf_id, config_key, resume=True)
+    if not checkpoint.is_done("extract"):
+        state = extract(...)
+        checkpoint.save("extract", state)
+    ...
+    checkpoint.clear()  # após commit
+"""
+
+import os
+import json
+import time
+import pickle
+import shutil
+from typing import Any, Optional
+
+CHECKPOINT_DIRNAME = "checkpoints"
+
+# Etapas do pipeline em fases, em ordem
+STAGES = ["extract", "summaries", "context", "enrichment"]
+
+
+def _atomic_pickle(path: str, data: Any):
+    """Escreve em arquivo temporário e renomeia: checkpoint nunca fica pela metade"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+class IngestionCheckpoint:
+    """Checkpoints de um documento (pdf_id) em PERSIST_DIR/checkpoints/<pdf_id>"""
+
+    def __init__(self, persist_directory: str, pdf_id: str, config_key: str):
+        self.directory = os.path.join(persist_directory, CHECKPOINT_DIRNAME, pdf_id)
+        self.config_key = config_key
+        self.manifest_path = os.path.join(self.directory, "manifest.json")
+        self.state_path = os.path.join(self.directory, "state.pkl")
+        self.units_dir = os.path.join(self.directory, "units")
+        self.stage = None
+        self.orphan_ids = []  # Gravados por uma execução interrompida, nunca registrados
+
+        manifest = self._read_manifest()
+        if manifest and manifest.get("config_key") == config_key and os.path.exists(self.state_path):
+            self.stage = manifest.get("stage")
+        elif manifest:
+            print("   ♻️  Checkpoint de outra configuração descartado")
+            self.discard()
+
+    def _read_manifest(self) -> Optional[dict]:
+        if not os.path.exists(self.manifest_path):
+            return None
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def is_done(self, stage: str) -> bool:
+        """A etapa já foi concluída em uma execução anterior?"""
+        if self.stage is None:
+            return False
+        if stage not in STAGES or self.stage not in STAGES:
+            return stage == self.stage
+        return STAGES.index(stage) <= STAGES.index(self.stage)
+
+    def load(self) -> Any:
+        """Estado salvo pela última etapa concluída"""
+        with open(self.state_path, "rb") as f:
+            return pickle.load(f)
+
+    def save(self, stage: str, state: Any):
+        """Salva o estado acumulado após concluir `stage`"""
+        os.makedirs(self.directory, exist_ok=True)
+        _atomic_pickle(self.state_path, state)
+        with open(self.manifest_path, "w", encoding="utf-8") as f:
+            json.dump({"stage": stage, "config_key": self.config_key, "saved_at": time.time()}, f)
+        self.stage = stage
+
+    def load_unit(self, key: str) -> Any:
+        """Unidade do pipeline em streaming já processada (ou None)"""
+        path = os.path.join(self.units_dir, f"{key}.pkl")
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "rb") as f:
+                return pickle.load(f)
+        except Exception:
+            return None
+
+    def save_unit(self, key: str, data: Any):
+        os.makedirs(self.units_dir, exist_ok=True)
+        _atomic_pickle(os.path.join(self.units_dir, f"{key}.pkl"), data)
+
+    def written_ids(self) -> list:
+        """doc_ids registrados pelas unidades do streaming (gravados ou prestes a ser)"""
+        if not os.path.isdir(self.units_dir):
+            return []
+        doc_ids = []
+        for filename in sorted(os.listdir(self.units_dir)):
+            if filename.endswith(".pkl"):
+                unit = self.load_unit(filename[:-len(".pkl")])
+                if unit:
+                    doc_ids.extend(unit.get("written_ids", []))
+        return doc_ids
+
+    def discard(self):
+        """Descarta os checkpoints sem commit: doc_ids já gravados vão para orphan_ids"""
+        self.orphan_ids.extend(self.written_ids())
+        self.clear()
+
+    def clear(self):
+        """Remove todos os checkpoints do documento"""
+        shutil.rmtree(self.directory, ignore_errors=True)
+        self.stage = None
+
+
+class _DisabledCheckpoint:
+    """Mesma interface, sem salvar nada (checkpoints desativados)"""
+
+    stage = None
+    orphan_ids = ()
+
+    def is_done(self, stage):
+        return False
+
+    def load(self):
+        return None
+
+    def save(self, stage, state):
+        pass
+
+    def load_unit(self, key):
+        return None
+
+    def save_unit(self, key, data):
+        pass
+
+    def written_ids(self):
+        return []
+
+    def discard(self):
+        pass
+
+    def clear(self):
+        pass
+
+
+def get_checkpoint(persist_directory: Optional[str] = None, pdf_id: Optional[str] = None, config_key: str = "",
+                   resume: bool = False, enabled: bool = True):
+    """
+    Checkpoints de um documento
+
+    Args:
+        resume: Reaproveitar checkpoints existentes (False = começar do zero)
+        enabled: False retorna um checkpoint que não salva nada
+    """
+    if not enabled:
+        return _DisabledCheckpoint()
+
+    checkpoint = IngestionCheckpoint(persist_directory, pdf_id, config_key)
+    if not resume:
+        checkpoint.discard()
+    return checkpoint
@@ -0,0 +1,197 @@
+"""
+⚙️ INGESTION WORKER - Ingestão em processo com modelos aquecidos
+
+Substitui o subprocess por upload (`python adicionar_pdf.py arquivo.pdf`):
+unstructured, langchain e o MetadataEnricher (KeyBERT) são carregados UMA vez
+por processo da API, e o progresso chega como eventos estruturados em vez de
+linhas de stdout.
+
+- Uma thread consome a fila de jobs: um PDF por vez (Chroma local e
+  docstore.pkl não suportam escritores concorrentes)
+- Cada job guarda seus eventos {"stage", "message", "time", ...}
+- Modelos são pré-carregados em background quando o worker inicia
+
+Uso:
+    worker = get_ingestion_worker()
+    job = worker.submit("content/arquivo.pdf")
+    for event in job.iter_events():
+        print(event["stage"], event["message"])
+    if job.status == "success":
+        print(job.doc_info["pdf_id"])
+"""
+
+import os
+import time
+import uuid
+import queue
+import threading
+import traceback
+from collections import OrderedDict
+from typing import Dict, Iterator, List, Optional
+
+# Quantos jobs finalizados ficam disponíveis para consulta (/upload-jobs)
+INGESTION_JOB_HISTORY = int(os.getenv("INGESTION_JOB_HISTORY", "50"))
+
+
+class IngestionJob:
+    """Um PDF na fila de ingestão, com eventos de progresso e resultado"""
+
+    def __init__(self, file_path: str):
+        self.job_id = uuid.uuid4().hex[:12]
+        self.file_path = file_path
+        self.status = "queued"  # queued | running | success | error
+        self.events: List[Dict] = []
+        self.doc_info: Optional[Dict] = None
+        self.error: Optional[str] = None
+        self.traceback: Optional[str] = None
+        self.submitted_at = time.time()
+        self.finished_at: Optional[float] = None
+        self._cond = threading.Condition()
+
+    @property
+    def done(self) -> bool:
+        return self.status in ("success", "error")
+
+    def add_event(self, event: Dict):
+        """Registra um evento e acorda quem está acompanhando o job"""
+        with self._cond:
+            self.events.append({"time": round(time.time(), 3), **event})
+            self._cond.notify_all()
+
+    def _set_status(self, status: str, doc_info=None, error=None, tb=None):
+        with self._cond:
+            self.status = status
+            self.doc_info = doc_info
+            self.error = error
+            self.traceback = tb
+            if self.done:
+                self.finished_at = time.time()
+            self._cond.notify_all()
+
+    def iter_events(self, heartbeat: float = 15.0) -> Iterator[Dict]:
+        """
+        Itera sobre os eventos (inclusive os já emitidos) até o job terminar
+
+        Sem eventos novos por `heartbeat` segundos, emite {"stage": "heartbeat"}
+        para manter conexões de streaming vivas.
+        """
+        position = 0
+        while True:
+            with self._cond:
+                if position >= len(self.events) and not self.done:
+                    self._cond.wait(timeout=heartbeat)
+                new_events = self.events[position:]
+                position = len(self.events)
+                finished = self.done
+
+            for event in new_events:
+                yield event
+            if finished and not new_events:
+                return
+            if not new_events and not finished:
+                yield {"time": round(time.time(), 3), "stage": "heartbeat", "message": f"⏳ {self.status}..."}
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Bloqueia até o job terminar. Returns: True se terminou dentro do timeout"""
+        with self._cond:
+            return self._cond.wait_for(lambda: self.done, timeout=timeout)
+
+    def to_dict(self, include_events: bool = True) -> Dict:
+        data = {
+            "job_id": self.job_id,
+            "file": os.path.basename(self.file_path),
+            "status": self.status,
+            "pdf_id": self.doc_info.get("pdf_id") if self.doc_info else None,
+            "chunks": len(self.doc_info.get("chunk_ids", [])) if self.doc_info else 0,
+            "error": self.error,
+            "submitted_at": self.submitted_at,
+            "finished_at": self.finished_at,
+        }
+        if include_events:
+            data["events"] = list(self.events)
+        return data
+
+
+class IngestionWorker:
+    """Thread de ingestão de longa duração com modelos carregados uma única vez"""
+
+    def __init__(self, persist_directory: Optional[str] = None):
+        self.persist_directory = persist_directory
+        self.jobs: "OrderedDict[str, IngestionJob]" = OrderedDict()
+        self.ready = threading.Event()
+        self._queue: "queue.Queue[IngestionJob]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="ingestion-worker", daemon=True)
+        self._thread.start()
+
+    def submit(self, file_path: str) -> IngestionJob:
+        """Enfileira um PDF. Returns: IngestionJob para acompanhar o progresso"""
+        job = IngestionJob(file_path)
+        job.add_event({"stage": "queued", "message": f"📥 Na fila: {os.path.basename(file_path)} "
+                                                     f"({self._queue.qsize()} à frente)"})
+        with self._lock:
+            self.jobs[job.job_id] = job
+            self._prune_history()
+        self._queue.put(job)
+        return job
+
+    def get_job(self, job_id: str) -> Optional[IngestionJob]:
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def _prune_history(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.done]
+        for job_id in finished[:max(0, len(finished) - INGESTION_JOB_HISTORY)]:
+            del self.jobs[job_id]
+
+    def _warm_up(self):
+        """Importa o pipeline e carrega os modelos antes do primeiro upload"""
+        started = time.time()
+        print("⚙️  Ingestion worker: carregando pipeline de ingestão...")
+        try:
+            import adicionar_pdf
+            adicionar_pdf.get_enricher()
+            adicionar_pdf._init_bulk_worker()  # Modelo de layout do unstructured (hi_res)
+            print(f"✅ Ingestion worker pronto ({time.time() - started:.1f}s)")
+        except Exception as e:
+            # Não impede a API de subir: o job vai reportar o erro real
+            print(f"⚠️  Ingestion worker: falha ao pré-carregar modelos: {str(e)[:200]}")
+        finally:
+            self.ready.set()
+
+    def _run(self):
+        self._warm_up()
+
+        while True:
+            job = self._queue.get()
+            job._set_status("running")
+            job.add_event({"stage": "running", "message": f"⚙️ Iniciando ingestão de {os.path.basename(job.file_path)}"})
+
+            try:
+                import adicionar_pdf
+                adicionar_pdf.set_progress_callback(job.add_event)
+                try:
+                    doc_info = adicionar_pdf.process_pdf(
+                        job.file_path,
+                        persist_directory=self.persist_directory,
+                        interactive=False,
+                    )
+                finally:
+                    adicionar_pdf.set_progress_callback(None)
+                job._set_status("success", doc_info=doc_info)
+            except Exception as e:
+                job.add_event({"stage": "error", "message": f"❌ Erro no processamento: {str(e)[:300]}", "error": str(e)})
+                job._set_status("error", error=str(e), tb=traceback.format_exc())
+
+
+_worker: Optional[IngestionWorker] = None
+_worker_lock = threading.Lock()
+
+
+def get_ingestion_worker(persist_directory: Optional[str] = None) -> IngestionWorker:
+    """Worker único por processo (criado e aquecido na primeira chamada)"""
+    global _worker
+    with _worker_lock:
+        if _worker is None:
+            _worker = IngestionWorker(persist_directory)
+        return _worker
@@ -0,0 +1,164 @@
+"""
+🧠 LLM CACHE - Memoização persistente das respostas LLM/Vision da ingestão
+
+Resumos, descrições de tabelas/imagens, extração de tabelas via Vision e
+prefixos contextuais são determinísticos o suficiente para serem reutilizados
+quando o mesmo input volta a ser processado (reprocessamento após ajuste de
+código, nova edição de uma diretriz com seções inalteradas, etc).
+
+- Chave: SHA256(stage + modelo + versão do prompt + hash do input)
+- Imagens/tabelas: o hash do input é o hash da imagem
+- Armazenamento: SQLite em PERSIST_DIR/llm_cache.sqlite3
+- Eviction: LRU por tamanho total (LLM_CACHE_MAX_MB)
+
+Uso:
+    cache = get_llm_cache(persist_directory)
+    key_input = input_hash(text)
+    cached = cache.get("text_summary", "gpt-4o-mini", "v1", key_input)
+    if cached is None:
+        cached = chain.invoke(text)
+        cache.set("text_summary", "gpt-4o-mini", "v1", key_input, cached)
+"""
+
+import os
+import time
+import hashlib
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+# Tamanho máximo do cache em disco (0 = cache desativado)
+LLM_CACHE_MAX_MB = float(os.getenv("LLM_CACHE_MAX_MB", "512"))
+
+CACHE_FILENAME = "llm_cache.sqlite3"
+
+
+def input_hash(*parts) -> str:
+    """Hash SHA256 das partes do input (textos, base64 de imagens, etc)"""
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(str(part).encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+class LLMResponseCache:
+    """Cache persistente de respostas (str) com contadores de hit/miss por stage"""
+
+    def __init__(self, cache_path: str, max_bytes: int):
+        self.cache_path = cache_path
+        self.max_bytes = max_bytes
+        self.counters: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    stage TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    prompt_version TEXT NOT NULL,
+                    response TEXT NOT NULL,
+                    size_bytes INTEGER NOT NULL,
+                    last_used REAL NOT NULL
+                )"""
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_used ON responses(last_used)")
+
+    @contextmanager
+    def _connect(self):
+        """Conexão curta: commit no sucesso, sempre fechada no final"""
+        conn = sqlite3.connect(self.cache_path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _key(stage: str, model: str, prompt_version: str, key_input: str) -> str:
+        return input_hash(stage, model, prompt_version, key_input)
+
+    def _count(self, stage: str, field: str):
+        stage_counters = self.counters.setdefault(stage, {"hits": 0, "misses": 0})
+        stage_counters[field] += 1
+
+    def get(self, stage: str, model: str, prompt_version: str, key_input: str) -> Optional[str]:
+        """Retorna a resposta cacheada ou None"""
+        key = self._key(stage, model, prompt_version, key_input)
+        with self._lock, self._connect() as conn:
+            row = conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row:
+                conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._count(stage, "hits" if row else "misses")
+        return row[0] if row else None
+
+    def set(self, stage: str, model: str, prompt_version: str, key_input: str, response: str):
+        """Armazena uma resposta bem-sucedida (fallbacks/erros não devem ser cacheados)"""
+        if not response:
+            return
+        key = self._key(stage, model, prompt_version, key_input)
+        size = len(response.encode("utf-8"))
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, stage, model, prompt_version, response, size_bytes, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, stage, model, prompt_version, response, size, time.time()),
+            )
+            self._evict(conn)
+
+    def _evict(self, conn):
+        """Remove as respostas menos usadas até ficar abaixo de 90% do limite"""
+        total = conn.execute("SELECT COALESCE(SUM(size_bytes), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        target = int(self.max_bytes * 0.9)
+        to_delete = []
+        for key, size in conn.execute("SELECT key, size_bytes FROM responses ORDER BY last_used ASC"):
+            if total <= target:
+                break
+            to_delete.append((key,))
+            total -= size
+
+        conn.executemany("DELETE FROM responses WHERE key = ?", to_delete)
+
+    def stats(self) -> dict:
+        """Hits/misses por stage (neste processo) + tamanho atual do cache"""
+        with self._connect() as conn:
+            entries, total = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM responses"
+            ).fetchone()
+        return {"stages": {k: dict(v) for k, v in self.counters.items()}, "entries": entries, "size_bytes": total}
+
+
+class _DisabledCache:
+    """Mesma interface, sem armazenar nada (LLM_CACHE_MAX_MB=0)"""
+
+    counters: Dict[str, Dict[str, int]] = {}
+
+    def get(self, stage, model, prompt_version, key_input):
+        return None
+
+    def set(self, stage, model, prompt_version, key_input, response):
+        pass
+
+    def stats(self):
+        return {"stages": {}, "entries": 0, "size_bytes": 0}
+
+
+_caches: Dict[str, object] = {}
+
+
+def get_llm_cache(persist_directory: str):
+    """Instância única do cache por persist_directory (por processo)"""
+    if LLM_CACHE_MAX_MB <= 0:
+        return _DisabledCache()
+
+    cache_path = os.path.join(persist_directory, CACHE_FILENAME)
+    if cache_path not in _caches:
+        _caches[cache_path] = LLMResponseCache(cache_path, int(LLM_CACHE_MAX_MB * 1024 * 1024))
+    return _caches[cache_path]
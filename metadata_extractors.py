@@ -11,7 +11,60 @@ Data: 2025-10-21
 """
 
 from typing import List, Dict, Optional
+import os
 import re
+import json
+import threading
+
+# Embeddings de candidatos (palavras/bigramas) mantidos entre chunks e documentos
+KEYBERT_CANDIDATE_CACHE_SIZE = 50000
+
+KEYBERT_MODEL = 'paraphrase-multilingual-MiniLM-L12-v2'
+
+# torch (padrão) ou onnx: encoder quantizado int8 no ONNX Runtime
+# (requer sentence-transformers[onnx]; sem ele, volta para PyTorch)
+KEYBERT_BACKEND = os.getenv("KEYBERT_BACKEND", "torch").lower()
+# Arquivo ONNX dentro do repositório do modelo no Hugging Face
+KEYBERT_ONNX_FILE = os.getenv("KEYBERT_ONNX_FILE", "onnx/model_quint8_avx2.onnx")
+
+_keybert = None
+_keybert_lock = threading.Lock()
+
+
+def load_sentence_encoder(backend: Optional[str] = None):
+    """
+    Encoder do KeyBERT (paraphrase-multilingual-MiniLM-L12-v2)
+
+    backend="onnx" carrega a versão int8 publicada junto do modelo: mesmos
+    embeddings a menos do erro de quantização (rankings de keywords
+    equivalentes), várias vezes mais rápida em CPU e com menos memória.
+    """
+    from sentence_transformers import SentenceTransformer
+
+    backend = backend or KEYBERT_BACKEND
+    if backend == "onnx":
+        try:
+            model = SentenceTransformer(KEYBERT_MODEL, backend="onnx", model_kwargs={"file_name": KEYBERT_ONNX_FILE})
+            print(f"   ✓ Encoder ONNX int8 ({KEYBERT_ONNX_FILE})")
+            return model
+        except Exception as e:
+            print(f"   ⚠️  Backend ONNX indisponível, usando PyTorch: {str(e)[:100]}")
+    return SentenceTransformer(KEYBERT_MODEL)
+
+
+def get_keybert():
+    """
+    KeyBERT do processo (modelo carregado uma única vez)
+
+    Compartilhado entre o enriquecimento na ingestão e a extração de keywords
+    da query (consultar_com_rerank.py), que antes carregava um segundo modelo.
+    """
+    global _keybert
+    with _keybert_lock:
+        if _keybert is None:
+            from keybert import KeyBERT
+            _keybert = KeyBERT(model=load_sentence_encoder())
+        return _keybert
 
 # ==============================================================================
 # 1. KEYBERT - KEYWORD EXTRACTION
@@ -28,11 +81,11 @@ class KeywordExtractor:
         - Suporta 50+ idiomas incluindo português
         - 384 dimensões
         - Rápido e preciso para textos médicos
+        - Backend PyTorch ou ONNX int8 (KEYBERT_BACKEND)
         """
-        from keybert import KeyBERT
-
-        print("🔧 Inicializando KeyBERT (multilingual model)...")
-        self.kw_model = KeyBERT(model='paraphrase-multilingual-MiniLM-L12-v2')
+        print(f"🔧 Inicializando KeyBERT (multilingual model, backend {KEYBERT_BACKEND})...")
+        self.kw_model = get_keybert()
+        self._candidate_embeddings = {}  # candidato → embedding normalizado
         print("   ✓ KeyBERT pronto!")
 
     def extract_keywords(
@@ -120,33 +173,255 @@ class KeywordExtractor:
             # Fallback: extração simples por regex (instantâneo)
             return self._extract_keywords_regex_fallback(text, top_n)
 
-    def _extract_keywords_regex_fallback(self, text: str, top_n: int = 8) -> List[str]:
+    def extract_keywords_batch(
+        self,
+        texts: List[str],
+        top_n: int = 8,
+        max_chars: int = 1500
+    ) -> List[List[str]]:
         """
-        Fallback rápido: extração de keywords por regex (termos médicos comuns)
+        Keywords de TODOS os chunks de um documento em poucas chamadas ao modelo
+
+        Mesmo resultado de extract_keywords() (similaridade de cosseno entre o
+        chunk e seus unigramas/bigramas), mas:
+        - Chunks embedados em um único batch do sentence-transformers
+        - Candidatos de todos os chunks embedados juntos, uma vez cada; os
+          embeddings ficam em cache e são reaproveitados por outros chunks e
+          documentos (termos como "diabetes" aparecem em quase todos)
+
+        Args:
+            texts: Textos dos chunks
+            top_n: Número de keywords por chunk (padrão: 8)
+            max_chars: Máximo de caracteres por chunk (padrão: 1500)
+
+        Returns:
+            Lista de keywords por chunk, na mesma ordem de `texts`
         """
-        import re
-        from collections import Counter
+        results = [[] for _ in texts]
+        docs = [
+            (i, text[:max_chars]) for i, text in enumerate(texts)
+            if text and len(text.strip()) >= 20
+        ]
+        if not docs:
+            return results
+
+        try:
+            import numpy as np
+            from sklearn.feature_extraction.text import CountVectorizer
+
+            # Candidatos: mesmo vocabulário que o KeyBERT monta por chunk
+            vectorizer = CountVectorizer(ngram_range=(1, 2), stop_words=None)
+            counts = vectorizer.fit_transform([doc for _, doc in docs])
+            words = vectorizer.get_feature_names_out()
+
+            # Embedar só candidatos ainda fora do cache
+            missing = [word for word in words if word not in self._candidate_embeddings]
+            if len(self._candidate_embeddings) + len(missing) > KEYBERT_CANDIDATE_CACHE_SIZE:
+                self._candidate_embeddings.clear()
+                missing = list(words)
+            if missing:
+                self._candidate_embeddings.update(zip(missing, self._normalize(self.kw_model.model.embed(missing))))
+
+            doc_embeddings = self._normalize(self.kw_model.model.embed([doc for _, doc in docs]))
+            word_embeddings = np.vstack([self._candidate_embeddings[word] for word in words])
+
+            for row, (i, _) in enumerate(docs):
+                candidate_ids = counts[row].nonzero()[1]
+                if len(candidate_ids) == 0:
+                    results[i] = self._extract_keywords_regex_fallback(texts[i], top_n)
+                    continue
+                similarities = word_embeddings[candidate_ids] @ doc_embeddings[row]
+                best = np.argsort(similarities)[::-1][:top_n]
+                results[i] = [str(words[candidate_ids[j]]) for j in best]
+
+        except Exception as e:
+            print(f"      ⚠️  Erro ao extrair keywords em batch: {str(e)[:100]}")
+            # Fallback: extração simples por regex (instantâneo)
+            for i, _ in docs:
+                results[i] = self._extract_keywords_regex_fallback(texts[i], top_n)
 
-        # Padrões de termos médicos comuns em português
-        medical_terms = re.findall(
-            r'\b(?:diabetes|hipertensão|glicemia|insulina|metformina|HbA1c|'
-            r'creatinina|pressão arterial|colesterol|triglicerídeos|'
-            r'doença renal|cardiovascular|nefropatia|retinopatia|'
-            r'tratamento|diagnóstico|prevenção|controle|manejo)\b',
-            text.lower()
-        )
+        return results
 
-        # Contar frequência
-        counter = Counter(medical_terms)
+    @staticmethod
+    def _normalize(embeddings):
+        import numpy as np
 
-        # Retornar top N mais frequentes
-        return [term for term, _ in counter.most_common(top_n)]
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings / np.maximum(norms, 1e-12)
+
+    def _extract_keywords_regex_fallback(self, text: str, top_n: int = 8) -> List[str]:
+        return extract_keywords_regex(text, top_n)
+
+
+def extract_keywords_regex(text: str, top_n: int = 8) -> List[str]:
+    """
+    Fallback rápido: extração de keywords por regex (termos médicos comuns)
+
+    Não depende do KeyBERT: usado também quando o worker de enriquecimento
+    estoura o tempo (enrichment_pool.py).
+    """
+    from collections import Counter
+
+    # Padrões de termos médicos comuns em português
+    medical_terms = re.findall(
+        r'\b(?:diabetes|hipertensão|glicemia|insulina|metformina|HbA1c|'
+        r'creatinina|pressão arterial|colesterol|triglicerídeos|'
+        r'doença renal|cardiovascular|nefropatia|retinopatia|'
+        r'tratamento|diagnóstico|prevenção|controle|manejo)\b',
+        text.lower()
+    )
+
+    # Contar frequência
+    counter = Counter(medical_terms)
+
+    # Retornar top N mais frequentes
+    return [term for term, _ in counter.most_common(top_n)]
 
 
 # ==============================================================================
 # 2. MEDIALBERTINA - MEDICAL ENTITY EXTRACTION (PT-PT)
 # ==============================================================================
 
+# Léxico médico (padrões regex) por categoria, para textos em português
+# brasileiro/europeu. Termos extras (literais) podem ser carregados de um JSON
+# {"diseases": [...], "medications": [...], "procedures": [...]} em MEDICAL_LEXICON_PATH
+MEDICAL_LEXICON = {
+    # Padrões expandidos de doenças
+    "diseases": [
+        r'diabetes\s+(?:mellitus\s+)?tipo\s+[12I]',
+        r'diabetes\s+tipo\s+[12]',
+        r'hipertensão\s+arterial(?:\s+sistêmica)?',
+        r'insuficiência\s+cardíaca(?:\s+congestiva)?',
+        r'cardiomiopatia\s+hipertrófica',
+        r'nefrite\s+lúpica',
+        r'síndrome\s+metabólica',
+        r'doença\s+renal\s+crônica',
+        r'síndrome\s+coronariana\s+aguda',
+        r'infarto\s+(?:agudo\s+do\s+)?miocárdio',
+        r'acidente\s+vascular\s+cerebral',
+        r'fibrilação\s+atrial',
+        r'obesidade',
+        r'dislipidemia',
+    ],
+    # Padrões expandidos de medicamentos
+    "medications": [
+        r'metformina',
+        r'insulina(?:\s+(?:glargina|detemir|aspart|lispro|NPH|regular))?',
+        r'gliclazida',
+        r'empagliflozina',
+        r'dapagliflozina',
+        r'canagliflozina',
+        r'liraglutida',
+        r'semaglutida',
+        r'dulaglutida',
+        r'sitagliptina',
+        r'vildagliptina',
+        r'iSGLT-?2',
+        r'AR\s+GLP-?1',
+        r'iDPP-?4',
+        r'mavacamten',
+        r'aficamten',
+        r'enalapril',
+        r'losartana',
+        r'atorvastatina',
+        r'sinvastatina',
+        r'AAS|aspirina',
+        r'clopidogrel',
+    ],
+    # Padrões expandidos de procedimentos/exames
+    "procedures": [
+        r'HbA1c|hemoglobina\s+glicada|A1C',
+        r'glicemia(?:\s+(?:de\s+jejum|pós-prandial|capilar))?',
+        r'TFG|taxa\s+de\s+filtração\s+glomerular',
+        r'creatinina(?:\s+sérica)?',
+        r'albuminúria',
+        r'ureia',
+        r'colesterol(?:\s+(?:total|LDL|HDL))?',
+        r'triglicerídeos',
+        r'ecocardiograma',
+        r'eletrocardiograma|ECG',
+        r'teste\s+ergométrico',
+        r'cintilografia\s+miocárdica',
+        r'cateterismo\s+cardíaco',
+        r'angiografia\s+coronariana',
+        r'ressonância\s+magnética',
+        r'tomografia\s+computadorizada',
+    ],
+}
+
+
+def load_medical_lexicon(path: Optional[str] = None) -> Dict[str, List[str]]:
+    """
+    Termos literais extras do léxico (JSON por categoria)
+
+    Returns:
+        Dict categoria → termos (vazio se não houver arquivo)
+    """
+    path = path or os.getenv("MEDICAL_LEXICON_PATH")
+    if not path:
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"   ⚠️  Léxico médico não carregado ({path}): {str(e)[:100]}")
+        return {}
+    return {
+        category: [term for term in terms if isinstance(term, str) and term.strip()]
+        for category, terms in data.items() if category in MEDICAL_LEXICON
+    }
+
+
+def _trie_pattern(terms: List[str]) -> Optional[str]:
+    """
+    Regex de uma trie de termos literais: prefixos comuns viram um único ramo,
+    então milhares de termos não viram milhares de alternativas testadas em
+    sequência. Espaços nos termos aceitam qualquer espaço em branco.
+    """
+    trie = {}
+    for term in terms:
+        node = trie
+        for char in " ".join(term.lower().split()):
+            node = node.setdefault(char, {})
+        node[""] = True
+
+    def build(node):
+        end = "" in node
+        branches = [
+            (r"\s+" if char == " " else re.escape(char)) + build(child)
+            for char, child in sorted(node.items()) if char != ""
+        ]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        if end:
+            body = "(?:" + body + ")?"
+        return body
+
+    return build(trie) or None
+
+
+def compile_lexicon_matcher(extra_terms: Optional[Dict[str, List[str]]] = None):
+    """
+    Um único regex compilado para todas as categorias do léxico
+
+    Cada categoria é um grupo nomeado; um finditer() por chunk encontra doenças,
+    medicamentos e procedimentos em uma passada (em vez de um re.findall por
+    padrão). Os padrões do MEDICAL_LEXICON casam como no re.findall antigo,
+    sem fronteira de palavra ("insulinas" → insulina, "ECGs" → ECG,
+    "hipercolesterolemia" → colesterol); os termos do arquivo só casam
+    como palavras inteiras.
+    """
+    groups = []
+    for category, patterns in MEDICAL_LEXICON.items():
+        alternatives = [f"(?:{p})" for p in patterns]
+        trie = _trie_pattern((extra_terms or {}).get(category, []))
+        if trie:
+            alternatives.append(r"(?<!\w)(?:" + trie + r")(?!\w)")
+        groups.append(f"(?P<{category}>" + "|".join(alternatives) + ")")
+    return re.compile("|".join(groups), re.IGNORECASE)
+
 class MedicalEntityExtractor:
     """
     Extração de entidades médicas usando MediAlbertina PT-PT
@@ -198,7 +473,13 @@ class MedicalEntityExtractor:
             print(f"   ⚠️  BioBERT não disponível: {str(e)[:100]}")
         """
 
-        print("   ✓ Usando extração por regex patterns (rápido e eficaz!)")
+        extra_terms = load_medical_lexicon()
+        self.lexicon_matcher = compile_lexicon_matcher(extra_terms)
+        extra_count = sum(len(terms) for terms in extra_terms.values())
+        if extra_count:
+            print(f"   ✓ Léxico médico: +{extra_count} termos de {os.getenv('MEDICAL_LEXICON_PATH')}")
+
+        print("   ✓ Usando extração por léxico compilado (uma passada por chunk)")
         self.ner = None
 
     def extract_entities(self, text: str) -> Dict[str, List[str]]:
@@ -272,96 +553,23 @@ class MedicalEntityExtractor:
 
     def _extract_entities_fallback(self, text: str) -> Dict[str, List[str]]:
         """
-        Fallback: Extração usando regex para termos médicos comuns em PT
+        Fallback: Extração usando o léxico médico compilado (MEDICAL_LEXICON)
 
         Padrões otimizados para textos médicos em português brasileiro/europeu
         Captura: doenças, medicamentos, procedimentos/exames
         """
-        diseases = []
-        medications = []
-        procedures = []
-
-        # Padrões expandidos de doenças
-        disease_patterns = [
-            r'diabetes\s+(?:mellitus\s+)?tipo\s+[12I]',
-            r'diabetes\s+tipo\s+[12]',
-            r'hipertensão\s+arterial(?:\s+sistêmica)?',
-            r'insuficiência\s+cardíaca(?:\s+congestiva)?',
-            r'cardiomiopatia\s+hipertrófica',
-            r'nefrite\s+lúpica',
-            r'síndrome\s+metabólica',
-            r'doença\s+renal\s+crônica',
-            r'síndrome\s+coronariana\s+aguda',
-            r'infarto\s+(?:agudo\s+do\s+)?miocárdio',
-            r'acidente\s+vascular\s+cerebral',
-            r'fibrilação\s+atrial',
-            r'obesidade',
-            r'dislipidemia',
-        ]
+        found = {category: set() for category in MEDICAL_LEXICON}
 
-        # Padrões expandidos de medicamentos
-        medication_patterns = [
-            r'metformina',
-            r'insulina(?:\s+(?:glargina|detemir|aspart|lispro|NPH|regular))?',
-            r'gliclazida',
-            r'empagliflozina',
-            r'dapagliflozina',
-            r'canagliflozina',
-            r'liraglutida',
-            r'semaglutida',
-            r'dulaglutida',
-            r'sitagliptina',
-            r'vildagliptina',
-            r'iSGLT-?2',
-            r'AR\s+GLP-?1',
-            r'iDPP-?4',
-            r'mavacamten',
-            r'aficamten',
-            r'enalapril',
-            r'losartana',
-            r'atorvastatina',
-            r'sinvastatina',
-            r'AAS|aspirina',
-            r'clopidogrel',
-        ]
-
-        # Padrões expandidos de procedimentos/exames
-        procedure_patterns = [
-            r'HbA1c|hemoglobina\s+glicada|A1C',
-            r'glicemia(?:\s+(?:de\s+jejum|pós-prandial|capilar))?',
-            r'TFG|taxa\s+de\s+filtração\s+glomerular',
-            r'creatinina(?:\s+sérica)?',
-            r'albuminúria',
-            r'ureia',
-            r'colesterol(?:\s+(?:total|LDL|HDL))?',
-            r'triglicerídeos',
-            r'ecocardiograma',
-            r'eletrocardiograma|ECG',
-            r'teste\s+ergométrico',
-            r'cintilografia\s+miocárdica',
-            r'cateterismo\s+cardíaco',
-            r'angiografia\s+coronariana',
-            r'ressonância\s+magnética',
-            r'tomografia\s+computadorizada',
-        ]
-
-        # Extrair matches únicos
-        for pattern in disease_patterns:
-            matches = re.findall(pattern, text, re.IGNORECASE)
-            diseases.extend([m.strip() for m in matches])
-
-        for pattern in medication_patterns:
-            matches = re.findall(pattern, text, re.IGNORECASE)
-            medications.extend([m.strip() for m in matches])
-
-        for pattern in procedure_patterns:
-            matches = re.findall(pattern, text, re.IGNORECASE)
-            procedures.extend([m.strip() for m in matches])
+        # Uma passada: cada match diz a categoria pelo grupo nomeado
+        for match in self.lexicon_matcher.finditer(text):
+            term = match.group(match.lastgroup).strip()
+            if term:
+                found[match.lastgroup].add(term)
 
         return {
-            "diseases": list(set([d for d in diseases if d])),
-            "medications": list(set([m for m in medications if m])),
-            "procedures": list(set([p for p in procedures if p]))
+            "diseases": list(found["diseases"]),
+            "medications": list(found["medications"]),
+            "procedures": list(found["procedures"])
         }
 
 
@@ -369,12 +577,51 @@ class MedicalEntityExtractor:
 # 3. NUMERICAL VALUE EXTRACTION
 # ==============================================================================
 
+# Padrões de medições médicas comuns: (nome padrão, nome, valor, unidade)
+MEASUREMENT_PATTERNS = [
+    # HbA1c: 7.5%
+    ('HbA1c', r'HbA1c|A1C|hemoglobina\s+glicada', r'\d+\.?\d*', r'%'),
+
+    # Creatinina: 1.2 mg/dL
+    ('creatinina', r'creatinina|creatinine', r'\d+\.?\d*', r'mg/dL|μmol/L'),
+
+    # TFG: 60 mL/min/1.73m²
+    ('TFG', r'TFG|GFR|taxa\s+de\s+filtração\s+glomerular', r'\d+\.?\d*', r'mL/min(?:/1\.73m²)?'),
+
+    # Pressão arterial: 140/90 mmHg
+    ('pressão_arterial', None, r'\d{2,3}/\d{2,3}', r'mmHg'),
+
+    # Glicemia: 180 mg/dL
+    ('glicemia', r'glicemia|glucose', r'\d+\.?\d*', r'mg/dL|mmol/L'),
+
+    # Peso: 75.5 kg
+    ('peso', r'peso|weight', r'\d+\.?\d*', r'kg'),
+
+    # Albuminúria: 300 mg/g
+    ('albuminúria', r'albuminúria|albumin', r'\d+\.?\d*', r'mg/g|mg/24h'),
+]
+
+
+def compile_measurement_regex():
+    """
+    Todos os MEASUREMENT_PATTERNS em um único regex compilado
+
+    Cada padrão vira o grupo m<i> (com n<i>/v<i>/u<i> para nome, valor e
+    unidade): um finditer() por chunk em vez de um por padrão.
+    """
+    alternatives = []
+    for i, (_, name, value, unit) in enumerate(MEASUREMENT_PATTERNS):
+        name_part = rf'(?P<n{i}>{name})[:\s]+' if name else ''
+        alternatives.append(rf'(?P<m{i}>{name_part}(?P<v{i}>{value})\s*(?P<u{i}>{unit}))')
+    return re.compile("|".join(alternatives), re.IGNORECASE)
+
+
 class NumericalValueExtractor:
     """Extração de valores numéricos com unidades de medida médicas"""
 
     def __init__(self):
-        """Inicializa extrator de valores numéricos"""
-        pass
+        """Inicializa extrator de valores numéricos (regex combinado compilado uma vez)"""
+        self.measurement_regex = compile_measurement_regex()
 
     def extract_measurements(self, text: str) -> List[Dict[str, any]]:
         """
@@ -399,52 +646,31 @@ class NumericalValueExtractor:
         if not text:
             return []
 
-        measurements = []
-
-        # Padrões de medições médicas comuns
-        patterns = [
-            # HbA1c: 7.5%
-            (r'(?P<name>HbA1c|A1C|hemoglobina\s+glicada)[:\s]+(?P<value>\d+\.?\d*)\s*(?P<unit>%)', 'HbA1c'),
-
-            # Creatinina: 1.2 mg/dL
-            (r'(?P<name>creatinina|creatinine)[:\s]+(?P<value>\d+\.?\d*)\s*(?P<unit>mg/dL|μmol/L)', 'creatinina'),
-
-            # TFG: 60 mL/min/1.73m²
-            (r'(?P<name>TFG|GFR|taxa\s+de\s+filtração\s+glomerular)[:\s]+(?P<value>\d+\.?\d*)\s*(?P<unit>mL/min(?:/1\.73m²)?)', 'TFG'),
-
-            # Pressão arterial: 140/90 mmHg
-            (r'(?P<value>\d{2,3}/\d{2,3})\s*(?P<unit>mmHg)', 'pressão_arterial'),
-
-            # Glicemia: 180 mg/dL
-            (r'(?P<name>glicemia|glucose)[:\s]+(?P<value>\d+\.?\d*)\s*(?P<unit>mg/dL|mmol/L)', 'glicemia'),
-
-            # Peso: 75.5 kg
-            (r'(?P<name>peso|weight)[:\s]+(?P<value>\d+\.?\d*)\s*(?P<unit>kg)', 'peso'),
-
-            # Albuminúria: 300 mg/g
-            (r'(?P<name>albuminúria|albumin)[:\s]+(?P<value>\d+\.?\d*)\s*(?P<unit>mg/g|mg/24h)', 'albuminúria'),
-        ]
-
-        for pattern, default_name in patterns:
-            matches = re.finditer(pattern, text, re.IGNORECASE)
-
-            for match in matches:
-                measurement = {
-                    "name": match.group('name') if 'name' in match.groupdict() and match.group('name') else default_name,
-                    "value": match.group('value'),
-                    "unit": match.group('unit')
-                }
+        found = []
+
+        # Uma passada: o grupo m<i> que casou identifica o padrão
+        for match in self.measurement_regex.finditer(text):
+            i = int(match.lastgroup[1:])
+            default_name = MEASUREMENT_PATTERNS[i][0]
+            name = match.group(f"n{i}") if MEASUREMENT_PATTERNS[i][1] else None
+            measurement = {
+                "name": name or default_name,
+                "value": match.group(f"v{i}"),
+                "unit": match.group(f"u{i}")
+            }
 
-                # Tentar converter valor para float
-                try:
-                    if '/' not in measurement['value']:  # Não converter pressão arterial
-                        measurement['value'] = float(measurement['value'])
-                except:
-                    pass  # Manter como string
+            # Tentar converter valor para float
+            try:
+                if '/' not in measurement['value']:  # Não converter pressão arterial
+                    measurement['value'] = float(measurement['value'])
+            except:
+                pass  # Manter como string
 
-                measurements.append(measurement)
+            found.append((i, measurement))
 
-        return measurements
+        # Mesma ordem de antes: agrupado por padrão, na ordem do texto
+        found.sort(key=lambda item: item[0])
+        return [measurement for _, measurement in found]
 
 
 # ==============================================================================
@@ -471,11 +697,16 @@ class MetadataEnricher:
         # }
     """
 
-    def __init__(self):
-        """Inicializa todos os extractors"""
+    def __init__(self, load_keyword_model: bool = True):
+        """
+        Inicializa todos os extractors
+
+        Args:
+            load_keyword_model: False = sem KeyBERT, keywords por regex (fallback leve)
+        """
         print("\n🚀 Inicializando Metadata Enrichment System...")
 
-        self.keyword_extractor = KeywordExtractor()
+        self.keyword_extractor = KeywordExtractor() if load_keyword_model else None
         self.entity_extractor = MedicalEntityExtractor()
         self.numerical_extractor = NumericalValueExtractor()
 
@@ -498,7 +729,10 @@ class MetadataEnricher:
 
         # Keywords
         if extract_keywords:
-            keywords = self.keyword_extractor.extract_keywords(text)
+            if self.keyword_extractor is not None:
+                keywords = self.keyword_extractor.extract_keywords(text)
+            else:
+                keywords = extract_keywords_regex(text) if text else []
             enriched["keywords"] = keywords
             enriched["keywords_str"] = ", ".join(keywords)
 
@@ -522,6 +756,39 @@ class MetadataEnricher:
 
         return enriched
 
+    def enrich_batch(self, texts: List[str], extract_keywords: bool = True, extract_entities: bool = True,
+                     extract_measurements: bool = True) -> List[Dict]:
+        """
+        Enriquece todos os chunks de um documento de uma vez
+
+        Keywords saem de extract_keywords_batch() (poucas chamadas grandes ao
+        modelo em vez de uma por chunk); entidades e medições continuam por chunk.
+
+        Returns:
+            Lista de dicts no formato de enrich(), na mesma ordem de `texts`
+        """
+        if not extract_keywords:
+            keywords_per_text = [None] * len(texts)
+        elif self.keyword_extractor is not None:
+            keywords_per_text = self.keyword_extractor.extract_keywords_batch(texts)
+        else:
+            keywords_per_text = [extract_keywords_regex(text) if text else [] for text in texts]
+
+        enriched_batch = []
+        for text, keywords in zip(texts, keywords_per_text):
+            enriched = {}
+            if extract_keywords:
+                enriched["keywords"] = keywords
+                enriched["keywords_str"] = ", ".join(keywords)
+            enriched.update(self.enrich(
+                text,
+                extract_keywords=False,
+                extract_entities=extract_entities,
+                extract_measurements=extract_measurements,
+            ))
+            enriched_batch.append(enriched)
+        return enriched_batch
+
 
 # ==============================================================================
 # TESTES
@@ -0,0 +1,418 @@
+"""
+🚦 RATE LIMITER - Token bucket adaptativo compartilhado (OpenAI / Cohere)
+
+Todas as chamadas de API da ingestão (Vision de tabelas, resumos, descrições
+de imagens, contexto, embeddings) e da consulta (geração de queries, resposta,
+rerank) passam pelo mesmo orçamento, em vez de cada etapa se limitar sozinha.
+
+- Um bucket por modelo ("gpt-4o", "gpt-4o-mini", "text-embedding-3-large",
+  "rerank-v3.5"), limitando requisições E tokens por minuto
+- Estado em SQLite em PERSIST_DIR/rate_limiter.sqlite3: API, worker de
+  ingestão e processos do modo bulk dividem o mesmo orçamento
+- Adaptativo: um 429 reduz o ritmo do bucket pela metade (para todos os
+  processos) e respeita o Retry-After; cada sucesso recupera 5% do ritmo
+
+Limites por modelo via env (requisições:tokens por minuto), conforme o tier
+da conta. Bucket sem limite configurado não segura chamadas nem abre o
+SQLite: só depois de um 429 neste processo passa a respeitar as pausas
+(Retry-After) gravadas por todos os processos.
+    RATE_LIMIT_GPT_4O="500:30000"
+    RATE_LIMIT_GPT_4O_MINI="500:200000"
+
+Uso:
+    limiter = get_rate_limiter(persist_directory)
+    with limiter.guard("gpt-4o", tokens=estimate_tokens(prompt, max_output=2000)):
+        response = llm.invoke(prompt)
+
+    llm = ChatOpenAI(model="gpt-4o-mini", **limiter.chat_model_kwargs("gpt-4o-mini"))
+"""
+
+import os
+import re
+import time
+import asyncio
+import sqlite3
+import threading
+from contextlib import contextmanager, asynccontextmanager
+from typing import Dict, List, Optional, Tuple
+
+RATE_LIMITER_ENABLED = os.getenv("RATE_LIMITER_ENABLED", "true").lower() == "true"
+
+# Quantos segundos de orçamento podem ser gastos de uma vez (rajada)
+RATE_LIMIT_BURST_SECONDS = float(os.getenv("RATE_LIMIT_BURST_SECONDS", "10"))
+
+# Adaptação a 429: ritmo mínimo, queda multiplicativa, recuperação aditiva
+MIN_RATE_FACTOR = 0.1
+RATE_DECREASE = 0.5
+RATE_RECOVERY = 0.05
+
+LIMITER_FILENAME = "rate_limiter.sqlite3"
+
+# Tokens estimados por chamada quando o input não é conhecido antes da chamada
+DEFAULT_TOKENS_PER_REQUEST: Dict[str, int] = {
+    "gpt-4o": 8000,  # Resposta RAG: contexto com chunks + imagens
+    "gpt-4o-mini": 1500,
+    "text-embedding-3-large": 500,
+    "rerank-v3.5": 0,
+}
+
+# Custo aproximado de uma imagem em tokens de input (detail=auto)
+IMAGE_TOKENS = 1000
+
+
+def estimate_tokens(*texts, images: int = 0, max_output: int = 0) -> int:
+    """Estimativa barata (~4 caracteres por token) de input + output de uma chamada"""
+    chars = sum(len(str(t)) for t in texts)
+    return chars // 4 + images * IMAGE_TOKENS + max_output
+
+
+def bucket_limits(bucket: str) -> Optional[Tuple[float, float]]:
+    """(requisições/min, tokens/min) do bucket via env RATE_LIMIT_<MODELO>; None = sem limite"""
+    env_name = "RATE_LIMIT_" + re.sub(r"[^A-Z0-9]+", "_", bucket.upper()).strip("_")
+    value = os.getenv(env_name)
+    if value:
+        try:
+            rpm, tpm = value.split(":")
+            return float(rpm), float(tpm)
+        except ValueError:
+            print(f"⚠️  {env_name} inválido ('{value}'), bucket sem limite")
+    return None
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """Erro de 429 da OpenAI (RateLimitError) ou Cohere (TooManyRequestsError)?"""
+    if type(error).__name__ in ("RateLimitError", "TooManyRequestsError"):
+        return True
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    return status == 429
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """Header Retry-After da resposta 429, se disponível"""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        value = headers.get("retry-after")
+        return float(value) if value else None
+    except (TypeError, ValueError, AttributeError):
+        return None
+
+
+class SharedRateLimiter:
+    """Token buckets (requisições + tokens) persistidos em SQLite, com adaptação a 429"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.waited_seconds = 0.0
+        self.rate_limited = 0
+        self._factors: Dict[str, float] = {}
+        self._backoff_buckets = set()  # Buckets sem limite que já receberam 429 neste processo
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+
+        # journal_mode não muda dentro de transação: configurar fora do BEGIN IMMEDIATE
+        conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+        finally:
+            conn.close()
+
+        with self._connect() as conn:
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS buckets (
+                    name TEXT PRIMARY KEY,
+                    requests REAL NOT NULL,
+                    tokens REAL NOT NULL,
+                    updated REAL NOT NULL,
+                    factor REAL NOT NULL,
+                    cooldown_until REAL NOT NULL
+                )"""
+            )
+
+    @contextmanager
+    def _connect(self):
+        """Transação exclusiva curta: leitura + atualização do bucket são atômicas entre processos"""
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        finally:
+            conn.close()
+
+    def _load(self, conn, bucket: str, now: float):
+        """Estado atual do bucket, já reabastecido até `now`"""
+        limits = bucket_limits(bucket)
+        rpm, tpm = limits or (0.0, 0.0)
+        request_capacity = max(1.0, rpm * RATE_LIMIT_BURST_SECONDS / 60)
+        token_capacity = max(1.0, tpm * RATE_LIMIT_BURST_SECONDS / 60)
+
+        row = conn.execute(
+            "SELECT requests, tokens, updated, factor, cooldown_until FROM buckets WHERE name = ?", (bucket,)
+        ).fetchone()
+        if row is None:
+            requests, tokens, updated, factor, cooldown_until = request_capacity, token_capacity, now, 1.0, 0.0
+        else:
+            requests, tokens, updated, factor, cooldown_until = row
+
+        elapsed = max(0.0, now - updated)
+        requests = min(request_capacity, requests + elapsed * rpm * factor / 60)
+        tokens = min(token_capacity, tokens + elapsed * tpm * factor / 60)
+        return {
+            "requests": requests, "tokens": tokens, "factor": factor, "cooldown_until": cooldown_until,
+            "rpm": rpm, "tpm": tpm, "token_capacity": token_capacity, "limited": limits is not None,
+        }
+
+    @staticmethod
+    def _store(conn, bucket: str, state: dict, now: float):
+        conn.execute(
+            "INSERT OR REPLACE INTO buckets (name, requests, tokens, updated, factor, cooldown_until) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (bucket, state["requests"], state["tokens"], now, state["factor"], state["cooldown_until"]),
+        )
+
+    def _unthrottled(self, bucket: str) -> bool:
+        """Bucket sem limite e sem 429: nada a consultar no SQLite"""
+        return bucket not in self._backoff_buckets and bucket_limits(bucket) is None
+
+    def _try_acquire(self, bucket: str, tokens: int) -> float:
+        """Tenta consumir 1 requisição + `tokens`. Returns: 0 se conseguiu, senão segundos até tentar de novo"""
+        if self._unthrottled(bucket):
+            return 0.0
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            state = self._load(conn, bucket, now)
+            self._factors[bucket] = state["factor"]
+            needed = min(float(tokens), state["token_capacity"])
+
+            if now < state["cooldown_until"]:
+                wait = state["cooldown_until"] - now
+            elif not state["limited"]:
+                self._backoff_buckets.discard(bucket)  # Pausa do 429 acabou
+                wait = 0.0
+            elif state["requests"] >= 1 and state["tokens"] >= needed:
+                state["requests"] -= 1
+                state["tokens"] -= needed
+                wait = 0.0
+            else:
+                request_rate = state["rpm"] * state["factor"] / 60
+                token_rate = state["tpm"] * state["factor"] / 60
+                wait = max((1 - state["requests"]) / request_rate, (needed - state["tokens"]) / token_rate, 0.01)
+
+            if state["limited"]:
+                self._store(conn, bucket, state, now)
+        return wait
+
+    def acquire(self, bucket: str, tokens: int = 0):
+        """Bloqueia até o bucket ter orçamento para 1 requisição + `tokens`"""
+        while True:
+            wait = self._try_acquire(bucket, tokens)
+            if not wait:
+                return
+            wait = min(wait, 5.0)  # Re-checa: outro processo pode ter sido penalizado/liberado
+            self.waited_seconds += wait
+            time.sleep(wait)
+
+    async def aacquire(self, bucket: str, tokens: int = 0):
+        """Versão async de acquire() (SQLite e espera fora do event loop)"""
+        if self._unthrottled(bucket):
+            return
+        while True:
+            wait = await asyncio.to_thread(self._try_acquire, bucket, tokens)
+            if not wait:
+                return
+            wait = min(wait, 5.0)
+            self.waited_seconds += wait
+            await asyncio.sleep(wait)
+
+    def report_rate_limited(self, bucket: str, retry_after: Optional[float] = None):
+        """429 recebido: reduz o ritmo do bucket e pausa até o Retry-After"""
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            state = self._load(conn, bucket, now)
+            state["factor"] = max(MIN_RATE_FACTOR, state["factor"] * RATE_DECREASE)
+            state["cooldown_until"] = max(state["cooldown_until"], now + (retry_after or 2.0))
+            state["requests"] = 0.0
+            state["tokens"] = 0.0
+            self._store(conn, bucket, state, now)
+            self._factors[bucket] = state["factor"]
+            if not state["limited"]:
+                self._backoff_buckets.add(bucket)
+        self.rate_limited += 1
+        if state["limited"]:
+            print(f"   🚦 Rate limit em {bucket}: ritmo reduzido para {state['factor']:.0%}")
+        else:
+            print(f"   🚦 Rate limit em {bucket}: pausa de {state['cooldown_until'] - now:.1f}s "
+                  f"(configure RATE_LIMIT_<MODELO> para limitar o ritmo)")
+
+    def report_success(self, bucket: str):
+        """Chamada bem-sucedida: recupera o ritmo aos poucos depois de um 429"""
+        if self._factors.get(bucket, 1.0) >= 1.0 or bucket_limits(bucket) is None:
+            return  # Sem limite o ritmo não é usado: só a pausa do 429
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            state = self._load(conn, bucket, now)
+            state["factor"] = min(1.0, state["factor"] + RATE_RECOVERY)
+            self._store(conn, bucket, state, now)
+            self._factors[bucket] = state["factor"]
+
+    def report_error(self, bucket: str, error: Exception):
+        if is_rate_limit_error(error):
+            self.report_rate_limited(bucket, retry_after_seconds(error))
+
+    @contextmanager
+    def guard(self, bucket: str, tokens: int = 0):
+        """acquire() antes da chamada; sucesso/429 ajustam o ritmo do bucket"""
+        self.acquire(bucket, tokens)
+        try:
+            yield
+        except Exception as e:
+            self.report_error(bucket, e)
+            raise
+        self.report_success(bucket)
+
+    @asynccontextmanager
+    async def aguard(self, bucket: str, tokens: int = 0):
+        """Versão async de guard()"""
+        await self.aacquire(bucket, tokens)
+        try:
+            yield
+        except Exception as e:
+            await asyncio.to_thread(self.report_error, bucket, e)
+            raise
+        await asyncio.to_thread(self.report_success, bucket)
+
+    def chat_model_kwargs(self, bucket: str, tokens_per_request: Optional[int] = None) -> dict:
+        """
+        kwargs para ChatOpenAI(...): rate_limiter + callback que reporta 429/sucesso
+
+        Usado quando o modelo é chamado dentro de chains (o input não é
+        conhecido aqui): cada chamada consome `tokens_per_request` estimados.
+        """
+        if tokens_per_request is None:
+            tokens_per_request = DEFAULT_TOKENS_PER_REQUEST.get(bucket, 1500)
+        return {
+            "rate_limiter": _make_langchain_limiter(self, bucket, tokens_per_request),
+            "callbacks": [_make_feedback_handler(self, bucket)],
+        }
+
+    def stats(self) -> dict:
+        return {"waited_seconds": round(self.waited_seconds, 1), "rate_limited": self.rate_limited,
+                "factors": dict(self._factors)}
+
+
+class _DisabledRateLimiter:
+    """Mesma interface, sem limitar nada (RATE_LIMITER_ENABLED=false)"""
+
+    def acquire(self, bucket, tokens=0):
+        pass
+
+    async def aacquire(self, bucket, tokens=0):
+        pass
+
+    def report_rate_limited(self, bucket, retry_after=None):
+        pass
+
+    def report_success(self, bucket):
+        pass
+
+    def report_error(self, bucket, error):
+        pass
+
+    @contextmanager
+    def guard(self, bucket, tokens=0):
+        yield
+
+    @asynccontextmanager
+    async def aguard(self, bucket, tokens=0):
+        yield
+
+    def chat_model_kwargs(self, bucket, tokens_per_request=None):
+        return {}
+
+    def stats(self):
+        return {"waited_seconds": 0.0, "rate_limited": 0, "factors": {}}
+
+
+def _make_langchain_limiter(limiter: SharedRateLimiter, bucket: str, tokens_per_request: int):
+    """Adaptador para o parâmetro rate_limiter= dos chat models do LangChain"""
+    from langchain_core.rate_limiters import BaseRateLimiter
+
+    class SharedBucketLimiter(BaseRateLimiter):
+        def acquire(self, *, blocking: bool = True) -> bool:
+            if not blocking:
+                return limiter._try_acquire(bucket, tokens_per_request) == 0
+            limiter.acquire(bucket, tokens_per_request)
+            return True
+
+        async def aacquire(self, *, blocking: bool = True) -> bool:
+            if not blocking:
+                if limiter._unthrottled(bucket):
+                    return True
+                return await asyncio.to_thread(limiter._try_acquire, bucket, tokens_per_request) == 0
+            await limiter.aacquire(bucket, tokens_per_request)
+            return True
+
+    return SharedBucketLimiter()
+
+
+def _make_feedback_handler(limiter: SharedRateLimiter, bucket: str):
+    """Callback que devolve ao limiter o resultado das chamadas feitas por chains"""
+    from langchain_core.callbacks import BaseCallbackHandler
+
+    class RateLimitFeedbackHandler(BaseCallbackHandler):
+        def on_llm_end(self, response, **kwargs):
+            limiter.report_success(bucket)
+
+        def on_llm_error(self, error, **kwargs):
+            limiter.report_error(bucket, error)
+
+    return RateLimitFeedbackHandler()
+
+
+def rate_limited_embeddings(underlying, limiter, bucket: str):
+    """Envolve um Embeddings do LangChain: cada chamada consome o bucket do modelo"""
+    from langchain_core.embeddings import Embeddings
+
+    class RateLimitedEmbeddings(Embeddings):
+        def embed_documents(self, texts: List[str]) -> List[List[float]]:
+            with limiter.guard(bucket, tokens=estimate_tokens(*texts)):
+                return underlying.embed_documents(texts)
+
+        def embed_query(self, text: str) -> List[float]:
+            with limiter.guard(bucket, tokens=estimate_tokens(text)):
+                return underlying.embed_query(text)
+
+    return RateLimitedEmbeddings()
+
+
+def rate_limited_reranker(limiter, **kwargs):
+    """CohereRerank cujas chamadas de rerank consomem o bucket do modelo"""
+    from langchain_cohere import CohereRerank
+
+    class RateLimitedCohereRerank(CohereRerank):
+        def compress_documents(self, documents, query, callbacks=None):
+            with limiter.guard(self.model):
+                return super().compress_documents(documents, query, callbacks=callbacks)
+
+    return RateLimitedCohereRerank(**kwargs)
+
+
+_limiters: Dict[str, object] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(persist_directory: str):
+    """Instância única do limiter por persist_directory (por processo)"""
+    if not RATE_LIMITER_ENABLED:
+        return _DisabledRateLimiter()
+
+    db_path = os.path.join(os.path.abspath(persist_directory), LIMITER_FILENAME)
+    with _limiters_lock:
+        if db_path not in _limiters:
+            _limiters[db_path] = SharedRateLimiter(db_path)
+        return _limiters[db_path]
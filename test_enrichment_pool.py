@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+🧪 TESTE: Timeout real do pool de enriquecimento (enrichment_pool.py)
+
+Worker falso (sem KeyBERT): responde na hora, trava em chunks com "LENTO" e
+devolve erro em chunks com "ERRO". O lote que estoura o orçamento precisa ter
+o processo morto e recriado, e só os chunks DAQUELE lote caem no fallback
+regex, marcados com "enrichment_fallback".
+
+Uso: python test_enrichment_pool.py
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+CHUNK_TIMEOUT = 0.5
+
+
+def _fake_worker(conn):
+    """Mesmo protocolo de enrichment_pool._worker_main"""
+    conn.send(("ready", None))
+    while True:
+        try:
+            texts = conn.recv()
+        except EOFError:
+            return
+        if texts is None:
+            return
+        if any("LENTO" in text for text in texts):
+            time.sleep(60)  # Só sai daqui morto pelo pool
+        if any("ERRO" in text for text in texts):
+            conn.send(("error", "falha simulada"))
+            continue
+        conn.send(("ok", [{"keywords": ["worker"], "pid": os.getpid()} for _ in texts]))
+
+
+def make_pool():
+    from enrichment_pool import EnrichmentPool
+
+    return EnrichmentPool(workers=1, chunk_timeout=CHUNK_TIMEOUT, batch_size=2, worker_target=_fake_worker)
+
+
+def test_timeout_kills_worker_and_degrades_only_that_batch():
+    pool = make_pool()
+    try:
+        assert pool.available
+        texts = [
+            "Diabetes tipo 2 com metformina.",    # lote 0 → worker
+            "Hipertensão arterial sistêmica.",    # lote 0 → worker
+            "LENTO: glicemia de jejum elevada.",  # lote 1 → timeout
+            "Creatinina sérica e TFG reduzida.",  # lote 1 → timeout
+            "Insulina glargina à noite.",         # lote 2 → worker recriado
+        ]
+        started = time.monotonic()
+        results = pool.enrich_batch(texts)
+        elapsed = time.monotonic() - started
+
+        assert len(results) == len(texts)
+        assert [r.get("enrichment_fallback", False) for r in results] == [False, False, True, True, False]
+        assert results[0]["keywords"] == ["worker"] and results[4]["keywords"] == ["worker"]
+        assert results[0]["pid"] != results[4]["pid"], "worker travado não foi recriado"
+        assert "keywords" in results[2] and "entities_diseases" in results[2], "fallback sem formato do enricher"
+        assert pool.stats() == {"timeouts": 2, "errors": 0, "restarts": 1}
+        # Orçamento do lote (2 × timeout) + startup do worker novo, não os 60s do sleep
+        assert elapsed < 15, f"enrich_batch levou {elapsed:.1f}s"
+        print(f"✅ Timeout: lote travado morto em {elapsed:.1f}s, só os chunks 2 e 3 no fallback")
+    finally:
+        pool.close()
+
+
+def test_worker_error_degrades_batch():
+    pool = make_pool()
+    try:
+        results = pool.enrich_batch(["ERRO: resposta inválida do modelo.", "Outro chunk do mesmo lote.",
+                                     "Chunk de um lote saudável."])
+        assert [r.get("enrichment_fallback", False) for r in results] == [True, True, False]
+        assert pool.stats()["errors"] == 1 and pool.stats()["restarts"] == 0
+        print("✅ Erro no worker: lote no fallback, worker reaproveitado")
+    finally:
+        pool.close()
+
+
+if __name__ == "__main__":
+    print("=" * 70)
+    print("🧪 TESTE: POOL DE ENRIQUECIMENTO (TIMEOUT E FALLBACK POR CHUNK)")
+    print("=" * 70)
+    failed = 0
+    for test in (test_timeout_kills_worker_and_degrades_only_that_batch, test_worker_error_degrades_batch):
+        try:
+            test()
+        except AssertionError as e:
+            failed += 1
+            print(f"❌ {test.__name__}: {e}")
+    print()
+    if failed:
+        print(f"⚠️  {failed} testes falharam")
+        sys.exit(1)
+    print("✅ Pool degrada por chunk e recria o worker travado")
@@ -135,10 +135,12 @@ if os.path.exists(docstore_path):
 
     print(f"   ✓ Docstore existe: {len(docstore)} entradas")
 
-    # Contar imagens (base64)
+    # Contar imagens (base64 ou referência ao blob store)
     from base64 import b64decode
+    from blob_store import resolve_base64
     image_count = 0
     for doc_id, content in docstore.items():
+        content = resolve_base64(PERSIST_DIR, content)
         if isinstance(content, str):
             try:
                 decoded = b64decode(content[:100])
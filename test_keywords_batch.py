@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+🧪 TESTE: Keywords em batch vs extract_keywords() chunk a chunk
+
+extract_keywords_batch() precisa devolver o mesmo ranking do KeyBERT chamado
+por chunk (cosseno entre o chunk e seus unigramas/bigramas, sem MMR/MaxSum).
+Diferenças de ordem só são aceitas entre candidatos empatados: embeddings
+calculados em batch variam na casa de 1e-6.
+
+Uso: python test_keywords_batch.py  (carrega o modelo do KeyBERT)
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+SAMPLE_CHUNKS = [
+    "Pacientes com diabetes mellitus tipo 2 e HbA1c acima de 7% devem iniciar metformina, "
+    "exceto quando a taxa de filtração glomerular estiver abaixo de 30 mL/min.",
+    "A insulina basal (glargina ou NPH) é indicada quando a glicemia de jejum permanece "
+    "acima da meta apesar de dois antidiabéticos orais em dose máxima tolerada.",
+    "Na hipercolesterolemia familiar, o LDL-colesterol deve ser reduzido em pelo menos 50%, "
+    "com estatina de alta potência associada a ezetimiba quando necessário.",
+    "Fluxograma 2: rastreamento de doença renal crônica com albuminúria e creatinina sérica anuais.",
+    "Curto demais",  # < 20 caracteres: as duas versões devolvem []
+    "iSGLT2 e AR GLP-1 reduzem eventos cardiovasculares em pacientes com doença aterosclerótica "
+    "estabelecida, independentemente do controle glicêmico.",
+]
+
+# Diferença máxima de cosseno para considerar dois candidatos empatados
+SCORE_TOLERANCE = 1e-3
+
+
+def ranking_differences(extractor, text, batch, single):
+    """Posições em que os rankings divergem entre candidatos que NÃO estão empatados"""
+    if batch == single:
+        return []
+
+    candidates = sorted(set(batch) | set(single))
+    embeddings = extractor._normalize(extractor.kw_model.model.embed(candidates))
+    doc_embedding = extractor._normalize(extractor.kw_model.model.embed([text[:1500]]))[0]
+    scores = dict(zip(candidates, embeddings @ doc_embedding))
+
+    return [
+        (position, a, b) for position, (a, b) in enumerate(zip(batch, single))
+        if a != b and abs(scores[a] - scores[b]) > SCORE_TOLERANCE
+    ] + ([("tamanho", len(batch), len(single))] if len(batch) != len(single) else [])
+
+
+def test_batch_matches_per_chunk(extractor=None):
+    from metadata_extractors import KeywordExtractor
+
+    extractor = extractor or KeywordExtractor()
+    batch_keywords = extractor.extract_keywords_batch(SAMPLE_CHUNKS)
+    assert len(batch_keywords) == len(SAMPLE_CHUNKS)
+
+    failures = []
+    for i, text in enumerate(SAMPLE_CHUNKS):
+        # Timeout folgado: comparar com o KeyBERT, não com o fallback regex
+        single = extractor.extract_keywords(text, timeout_seconds=120)
+        differences = ranking_differences(extractor, text, batch_keywords[i], single)
+        status = "✅" if not differences else "❌"
+        print(f"{status} Chunk {i}: {batch_keywords[i][:4]}{' ...' if len(batch_keywords[i]) > 4 else ''}")
+        if differences:
+            print(f"      batch:     {batch_keywords[i]}")
+            print(f"      por chunk: {single}")
+            failures.append(i)
+
+    assert not failures, f"Ranking diferente nos chunks {failures}"
+
+
+if __name__ == "__main__":
+    print("=" * 70)
+    print("🧪 TESTE: KEYWORDS EM BATCH vs POR CHUNK")
+    print("=" * 70)
+    try:
+        test_batch_matches_per_chunk()
+    except AssertionError as e:
+        print(f"\n⚠️  {e}")
+        sys.exit(1)
+    print("\n✅ Batch reproduz o ranking do KeyBERT por chunk")
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+🧪 TESTE: Léxico médico e medições em uma passada vs loops antigos por padrão
+
+compile_lexicon_matcher() e compile_measurement_regex() juntam todos os
+padrões em um único regex. O resultado precisa ser o mesmo dos loops antigos
+(um re.findall/re.finditer por padrão, sem fronteira de palavra), inclusive
+para plurais e termos dentro de outra palavra.
+
+Uso: python test_lexicon_patterns.py
+"""
+
+import os
+import re
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.pop("MEDICAL_LEXICON_PATH", None)  # Loops antigos não tinham termos extras
+
+SAMPLE_TEXTS = [
+    "Pacientes com diabetes mellitus tipo 2 e hipertensão arterial sistêmica usam insulinas "
+    "(insulina glargina ou NPH), metformina e iSGLT2; ECGs seriados e ecocardiograma anual.",
+    "Na hipercolesterolemia familiar o colesterol LDL e os triglicerídeos sobem; "
+    "colesterolemia e dislipidemia são frequentes. AAS ou aspirina após infarto agudo do miocárdio.",
+    "Doença renal crônica: TFG 45 mL/min/1.73m², creatinina sérica 1.8 mg/dL, albuminúria: 300 mg/g.",
+    "HbA1c: 8.2%, glicemia de jejum 180 mg/dL, peso 92.5 kg e pressão arterial 150/95 mmHg "
+    "(meta <130/80 mmHg). A1C 7% após 3 meses; glucose 7.8 mmol/L.",
+    "Insuficiência cardíaca congestiva com fibrilação atrial; AR GLP-1 (semaglutida, liraglutida), "
+    "iDPP-4 e sitagliptina. Teste ergométrico e cintilografia miocárdica.",
+    "Texto sem termos médicos: casas, pesos, glúteos e cálculos.",
+]
+
+
+def old_entities(text):
+    """_extract_entities_fallback() antigo: um re.findall por padrão"""
+    from metadata_extractors import MEDICAL_LEXICON
+
+    result = {}
+    for category, patterns in MEDICAL_LEXICON.items():
+        found = []
+        for pattern in patterns:
+            found.extend(m.strip() for m in re.findall(pattern, text, re.IGNORECASE))
+        result[category] = set(term for term in found if term)
+    return result
+
+
+def old_measurements(text):
+    """extract_measurements() antigo: um re.finditer por padrão, na ordem dos padrões"""
+    from metadata_extractors import MEASUREMENT_PATTERNS
+
+    measurements = []
+    for default_name, name, value, unit in MEASUREMENT_PATTERNS:
+        name_part = rf'(?P<name>{name})[:\s]+' if name else ''
+        pattern = rf'{name_part}(?P<value>{value})\s*(?P<unit>{unit})'
+        for match in re.finditer(pattern, text, re.IGNORECASE):
+            measurement = {
+                "name": match.group('name') if 'name' in match.groupdict() and match.group('name') else default_name,
+                "value": match.group('value'),
+                "unit": match.group('unit'),
+            }
+            try:
+                if '/' not in measurement['value']:
+                    measurement['value'] = float(measurement['value'])
+            except ValueError:
+                pass
+            measurements.append(measurement)
+    return measurements
+
+
+def test_lexicon_matches_old_loops():
+    from metadata_extractors import MedicalEntityExtractor
+
+    extractor = MedicalEntityExtractor()
+    for i, text in enumerate(SAMPLE_TEXTS):
+        new = {category: set(terms) for category, terms in extractor._extract_entities_fallback(text).items()}
+        old = old_entities(text)
+        status = "✅" if new == old else "❌"
+        print(f"{status} Entidades do texto {i}: {sum(len(terms) for terms in new.values())} termos")
+        assert new == old, f"texto {i}: combinado {new} != antigo {old}"
+
+
+def test_lexicon_keeps_in_word_matches():
+    from metadata_extractors import MedicalEntityExtractor
+
+    entities = MedicalEntityExtractor()._extract_entities_fallback(SAMPLE_TEXTS[0] + " " + SAMPLE_TEXTS[1])
+    for category, term in [("medications", "insulina"), ("procedures", "ECG"), ("procedures", "colesterol")]:
+        print(f"{'✅' if term in entities[category] else '❌'} {term} em {category}")
+        assert term in entities[category]
+
+
+def test_measurements_match_old_loops():
+    from metadata_extractors import NumericalValueExtractor
+
+    extractor = NumericalValueExtractor()
+    for i, text in enumerate(SAMPLE_TEXTS):
+        new = extractor.extract_measurements(text)
+        old = old_measurements(text)
+        status = "✅" if new == old else "❌"
+        print(f"{status} Medições do texto {i}: {len(new)}")
+        assert new == old, f"texto {i}: combinado {new} != antigo {old}"
+
+
+if __name__ == "__main__":
+    print("=" * 70)
+    print("🧪 TESTE: LÉXICO E MEDIÇÕES (UMA PASSADA vs LOOPS ANTIGOS)")
+    print("=" * 70)
+    failed = 0
+    for test in (test_lexicon_matches_old_loops, test_lexicon_keeps_in_word_matches, test_measurements_match_old_loops):
+        try:
+            test()
+        except AssertionError as e:
+            failed += 1
+            print(f"   ⚠️  {e}")
+    print()
+    if failed:
+        print(f"⚠️  {failed} testes falharam")
+        sys.exit(1)
+    print("✅ Mesmo resultado dos loops por padrão")
@@ -43,6 +43,7 @@ from langchain_core.callbacks import CallbackManagerForRetrieverRun
 from typing import List
 from base64 import b64decode
 import pickle
+from blob_store import resolve_base64
 
 vectorstore = Chroma(
     collection_name="knowledge_base",
@@ -113,7 +114,7 @@ def parse_docs(docs):
             content = doc.text
             metadata = doc.metadata if hasattr(doc, 'metadata') else {}
         elif isinstance(doc, str):
-            content = doc
+            content = resolve_base64(persist_directory, doc)  # Blob store → base64
             metadata = {}
         else:
             content = str(doc)
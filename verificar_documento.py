@@ -8,6 +8,7 @@ import pickle
 from dotenv import load_dotenv
 from langchain_chroma import Chroma
 from langchain_openai import OpenAIEmbeddings
+from blob_store import resolve_base64, is_blob_ref
 
 load_dotenv()
 
@@ -110,11 +111,17 @@ if os.path.exists(docstore_path):
 
     # Contar documentos no docstore que pertencem a este PDF
     matching_docs = 0
+    missing_blobs = 0
     for chunk_id in chunk_ids:
         if chunk_id in docstore:
             matching_docs += 1
+            # Imagens: docstore guarda a referência, bytes ficam no blob store
+            if is_blob_ref(docstore[chunk_id]) and resolve_base64(PERSIST_DIR, docstore[chunk_id]) is None:
+                missing_blobs += 1
 
     print(f"   ✓ Documentos originais no docstore: {matching_docs}/{len(chunk_ids)}")
+    if missing_blobs:
+        print(f"   ⚠️  {missing_blobs} imagens com referência de blob sem arquivo em {PERSIST_DIR}/blobs")
 
     if matching_docs == len(chunk_ids):
         print(f"   ✅ COMPLETO: Todos os documentos originais salvos!")
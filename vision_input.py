@@ -0,0 +1,195 @@
+"""
+🔭 VISION INPUT - Prepara imagens para as chamadas Vision da ingestão
+
+Figuras do tamanho da página iam na resolução original, sem hint de
+`detail`: cada chamada pagava vários tiles de 512px, inclusive das margens
+em branco.
+
+- Recorta margens uniformes (fundo da cor dos cantos)
+- Reduz para o tamanho que a OpenAI usaria (cabe em 2048², menor lado 768)
+  e, para figuras, até caber em VISION_MAX_TILES tiles
+- detail "low" (85 tokens fixos) para imagens pequenas ou com pouco
+  texto/traço (logos, fotos); "high" para fluxogramas, gráficos e tabelas
+- Estatísticas de tokens estimados antes/depois por documento
+
+Módulo leve de propósito: só PIL, como image_transcode.py.
+
+Uso:
+    reset_vision_stats()  # início de cada documento
+    optimized = optimize_for_vision(jpeg_b64)
+    {"url": f"data:image/jpeg;base64,{optimized['image']}", "detail": optimized["detail"]}
+    print(vision_stats())
+"""
+
+import io
+import os
+import math
+import threading
+from base64 import b64decode, b64encode
+from typing import Optional
+
+from PIL import Image, ImageChops, ImageFilter
+
+# auto = escolhe pelo conteúdo; high/low = força o detail das figuras
+VISION_DETAIL_MODE = os.getenv("VISION_DETAIL_MODE", "auto").strip().lower()
+
+# Tiles de 512px por figura (detail high). 0 = sem limite além do da OpenAI
+VISION_MAX_TILES = int(os.getenv("VISION_MAX_TILES", "4"))
+
+# Tabelas precisam de todas as células legíveis: só recorte + escala da OpenAI
+VISION_TABLE_MAX_TILES = int(os.getenv("VISION_TABLE_MAX_TILES", "0"))
+
+# Fração de pixels de borda (texto/linhas) acima da qual a figura vai em "high"
+LOW_DETAIL_MAX_EDGE_DENSITY = 0.05
+
+# Diferença de cor (0-255) em relação ao fundo que conta como conteúdo
+MARGIN_THRESHOLD = 20
+MARGIN_PADDING = 8
+
+TILE_SIZE = 512
+BASE_TOKENS = 85
+TILE_TOKENS = 170
+
+_stats = {"images": 0, "tokens_before": 0, "tokens_after": 0, "low_detail": 0, "trimmed": 0}
+_stats_lock = threading.Lock()
+
+
+def openai_scaled_size(width: int, height: int):
+    """Tamanho que a OpenAI usa no detail high: cabe em 2048x2048, menor lado <= 768"""
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    return max(1, int(width * scale)), max(1, int(height * scale))
+
+
+def estimate_image_tokens(width: int, height: int, detail: str = "high") -> int:
+    """Tokens de imagem estimados (tabela de preços Vision da OpenAI)"""
+    if detail == "low":
+        return BASE_TOKENS
+    width, height = openai_scaled_size(width, height)
+    return BASE_TOKENS + TILE_TOKENS * math.ceil(width / TILE_SIZE) * math.ceil(height / TILE_SIZE)
+
+
+def trim_margins(img: Image.Image) -> Image.Image:
+    """Recorta margens da cor de fundo (cor mais comum entre os 4 cantos)"""
+    rgb = img.convert("RGB")
+    width, height = rgb.size
+    corners = [rgb.getpixel((0, 0)), rgb.getpixel((width - 1, 0)),
+               rgb.getpixel((0, height - 1)), rgb.getpixel((width - 1, height - 1))]
+    background = max(set(corners), key=corners.count)
+
+    diff = ImageChops.difference(rgb, Image.new("RGB", rgb.size, background)).convert("L")
+    bbox = diff.point(lambda p: 255 if p > MARGIN_THRESHOLD else 0).getbbox()
+    if not bbox:
+        return img
+
+    left, top, right, bottom = bbox
+    bbox = (max(0, left - MARGIN_PADDING), max(0, top - MARGIN_PADDING),
+            min(width, right + MARGIN_PADDING), min(height, bottom + MARGIN_PADDING))
+    cropped_area = (bbox[2] - bbox[0]) * (bbox[3] - bbox[1])
+    if cropped_area > 0.98 * width * height:
+        return img  # Margem desprezível
+    return img.crop(bbox)
+
+
+def edge_density(img: Image.Image) -> float:
+    """Fração de pixels de borda numa miniatura: alta em texto, linhas e fluxogramas"""
+    thumb = img.convert("L")
+    thumb.thumbnail((256, 256))
+    edges = thumb.filter(ImageFilter.FIND_EDGES)
+    histogram = edges.point(lambda p: 255 if p > 40 else 0).histogram()
+    total = thumb.size[0] * thumb.size[1]
+    return histogram[255] / total if total else 0.0
+
+
+def fit_tile_budget(width: int, height: int, max_tiles: int):
+    """Maior tamanho (sem ampliar) cuja contagem de tiles cabe em max_tiles"""
+    width, height = openai_scaled_size(width, height)
+    if max_tiles <= 0:
+        return width, height
+    scale = 1.0
+    while scale > 0.1:
+        w, h = int(width * scale), int(height * scale)
+        if math.ceil(w / TILE_SIZE) * math.ceil(h / TILE_SIZE) <= max_tiles:
+            return max(1, w), max(1, h)
+        scale *= 0.95
+    return max(1, int(width * scale)), max(1, int(height * scale))
+
+
+def optimize_for_vision(image_b64: str, max_tiles: Optional[int] = None, detail: Optional[str] = None) -> dict:
+    """
+    Recorta, reduz e escolhe o detail de uma imagem para a Vision API
+
+    Args:
+        max_tiles: Limite de tiles (padrão: VISION_MAX_TILES; 0 = sem limite)
+        detail: "high"/"low" força o detail; None = VISION_DETAIL_MODE
+
+    Returns:
+        dict: {"image": jpeg_b64, "detail", "tokens_before", "tokens_after"}
+            (imagem original em "high" se não abrir)
+    """
+    if max_tiles is None:
+        max_tiles = VISION_MAX_TILES
+    if detail is None and VISION_DETAIL_MODE in ("high", "low"):
+        detail = VISION_DETAIL_MODE
+
+    try:
+        img = Image.open(io.BytesIO(b64decode(image_b64)))
+        img.load()
+    except Exception:
+        return {"image": image_b64, "detail": "high", "tokens_before": 0, "tokens_after": 0}
+
+    tokens_before = estimate_image_tokens(*img.size)
+
+    trimmed = trim_margins(img)
+    width, height = fit_tile_budget(*trimmed.size, max_tiles)
+
+    if detail is None:
+        # Até 1 tile, "low" (512px) não perde nada; acima, só sem texto/traço fino
+        if width <= TILE_SIZE and height <= TILE_SIZE:
+            detail = "low"
+        else:
+            detail = "low" if edge_density(trimmed) < LOW_DETAIL_MAX_EDGE_DENSITY else "high"
+
+    if detail == "low":
+        # A OpenAI reduz para 512x512 no detail low: enviar já reduzida
+        width, height = openai_scaled_size(*trimmed.size)
+        scale = min(1.0, TILE_SIZE / max(width, height))
+        width, height = max(1, int(width * scale)), max(1, int(height * scale))
+
+    resized = trimmed
+    if (width, height) != trimmed.size:
+        resized = trimmed.resize((width, height), Image.Resampling.LANCZOS)
+    if resized.mode != "RGB":
+        resized = resized.convert("RGB")
+
+    if resized is img:
+        optimized_b64 = image_b64  # Nada mudou: evita re-encodar o JPEG
+    else:
+        buffer = io.BytesIO()
+        resized.save(buffer, format="JPEG", quality=90, optimize=True)
+        optimized_b64 = b64encode(buffer.getvalue()).decode("utf-8")
+
+    tokens_after = estimate_image_tokens(width, height, detail)
+    with _stats_lock:
+        _stats["images"] += 1
+        _stats["tokens_before"] += tokens_before
+        _stats["tokens_after"] += tokens_after
+        _stats["low_detail"] += detail == "low"
+        _stats["trimmed"] += trimmed is not img
+
+    return {"image": optimized_b64, "detail": detail, "tokens_before": tokens_before, "tokens_after": tokens_after}
+
+
+def reset_vision_stats():
+    """Zera as estatísticas (início de cada documento)"""
+    with _stats_lock:
+        for key in _stats:
+            _stats[key] = 0
+
+
+def vision_stats() -> dict:
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["tokens_saved"] = stats["tokens_before"] - stats["tokens_after"]
+    return stats
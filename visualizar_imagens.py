@@ -15,6 +15,7 @@ from langchain_openai import OpenAIEmbeddings
 from base64 import b64decode
 from PIL import Image
 import io
+from blob_store import resolve_base64
 
 load_dotenv()
 
@@ -134,7 +135,7 @@ for source, imgs in sorted(hiperglicemia_docs.items()):
 
             # Tentar decodificar e salvar
             try:
-                img_data = docstore[doc_id]
+                img_data = resolve_base64(PERSIST_DIR, docstore[doc_id])  # Blob store → base64
 
                 # Se for string base64
                 if isinstance(img_data, str):